@@ -0,0 +1,291 @@
+"""Minimal utilities for working directly with ENDF-6 formatted text.
+
+These are used where going through the full GND conversion would be wasteful,
+e.g. to pick up a handful of constants or a single section of a file.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+def parse_float(s):
+    """Convert an 11-character ENDF real, e.g. ' 1.000000-5', to a float"""
+    s = s.strip()
+    if not s:
+        return 0.0
+    for i in range(len(s) - 1, 0, -1):
+        if s[i] in '+-' and s[i-1] not in 'eE':
+            return float(s[:i] + 'e' + s[i:])
+    return float(s)
+
+
+def parse_int(s):
+    """Convert an 11-character ENDF integer to an int"""
+    s = s.strip()
+    return int(s) if s else 0
+
+
+def format_float(x):
+    """Format a float as an 11-character ENDF real, e.g. ' 1.000000-5'"""
+    if x == 0.:
+        return ' 0.000000+0'
+    mantissa, exponent = '{0:.6e}'.format(x).split('e')
+    exponent = int(exponent)
+    if abs(exponent) >= 10:
+        mantissa, exponent = '{0:.5e}'.format(x).split('e')
+        exponent = int(exponent)
+    return '{0}{1}{2}'.format(mantissa, '-' if exponent < 0 else '+',
+                              abs(exponent)).rjust(11)
+
+
+def format_int(i):
+    """Format an integer as an 11-character ENDF integer"""
+    return '{0:11d}'.format(int(i))
+
+
+def replace_fields(line, values, first=0):
+    """Replace real fields of a line starting at field index 'first' while
+    keeping the rest of the line, including MAT/MF/MT/NS, unchanged"""
+    for k, value in enumerate(values):
+        i = 11*(first + k)
+        line = line[:i] + format_float(value) + line[i + 11:]
+    return line
+
+
+def read_sections(filename):
+    """Split an ENDF file into its sections.
+
+    Returns an ordered dictionary mapping (MF, MT) to the list of lines in
+    that section, excluding the SEND record that terminates it.
+
+    """
+    sections = OrderedDict()
+    with open(filename, 'r') as fh:
+        for line in fh:
+            try:
+                mf = int(line[70:72])
+                mt = int(line[72:75])
+            except ValueError:
+                continue
+            if mf == 0 or mt == 0:
+                continue
+            sections.setdefault((mf, mt), []).append(line)
+    return sections
+
+
+def tab1_length(lines, start=0):
+    """Number of lines in the TAB1 record beginning at lines[start]"""
+    nr = parse_int(lines[start][44:55])
+    np_ = parse_int(lines[start][55:66])
+    return 1 + (nr + 2)//3 + (2*np_ + 5)//6
+
+
+def read_tab1(lines, start=0):
+    """Read a TAB1 record beginning at lines[start].
+
+    Returns the x and y values of the tabulated function. Interpolation
+    regions are not returned; callers interpolate linearly, which is what
+    MF3 uses in practice.
+
+    """
+    nr = parse_int(lines[start][44:55])
+    np_ = parse_int(lines[start][55:66])
+    first = start + 1 + (nr + 2)//3
+    values = []
+    for line in lines[first:first + (2*np_ + 5)//6]:
+        values.extend(parse_float(line[11*i:11*(i + 1)]) for i in range(6))
+    values = np.array(values[:2*np_])
+    return values[::2], values[1::2]
+
+
+def replace_tab1(lines, start, y):
+    """Return lines of the TAB1 record beginning at lines[start] with its y
+    values replaced. The x grid and interpolation law are kept."""
+    nr = parse_int(lines[start][44:55])
+    np_ = parse_int(lines[start][55:66])
+    if len(y) != np_:
+        raise ValueError('TAB1 record has {0} points, not {1}'.format(np_, len(y)))
+    first = start + 1 + (nr + 2)//3
+    record = lines[start:first]
+    for k, line in enumerate(lines[first:first + (2*np_ + 5)//6]):
+        for i in range(3):
+            j = 3*k + i
+            if j < np_:
+                line = replace_fields(line, [y[j]], 2*i + 1)
+        record.append(line)
+    return record
+
+
+def write_patched(original, filename, replacements):
+    """Copy an ENDF file, replacing the lines of some sections.
+
+    Lines outside the replaced sections, including the SEND records that end
+    them, are copied byte-for-byte. The file is streamed line by line.
+
+    Parameters
+    ----------
+    original : str
+        Path to the original ENDF file
+    filename : str
+        Path to the ENDF file to write
+    replacements : dict
+        Mapping of (MF, MT) to the list of lines that replace that section
+
+    """
+    with open(original, 'r') as fin, open(filename, 'w') as fout:
+        for line in fin:
+            try:
+                key = (int(line[70:72]), int(line[72:75]))
+            except ValueError:
+                key = None
+            if key in replacements:
+                lines = replacements[key]
+                if lines is not None:
+                    fout.writelines(lines)
+                    replacements[key] = None
+            else:
+                fout.write(line)
+
+
+def _first_range_start(lines):
+    """Index of the SPI/AP record of the first range in MF2/MT151 lines"""
+    i = 3
+    # Skip energy-dependent scattering radius if present
+    if parse_int(lines[2][44:55]) != 0:
+        i += tab1_length(lines, i)
+    return i
+
+
+def resonance_lines(lines):
+    """Find the lines holding Reich-Moore parameters in MF2/MT151.
+
+    Returns a list of (index, L) for each resonance of the first range, or
+    None if the first range is not a resolved Reich-Moore range.
+
+    """
+    lru = parse_int(lines[2][22:33])
+    lrf = parse_int(lines[2][33:44])
+    if lru != 1 or lrf != 3:
+        return None
+    i = _first_range_start(lines)
+    nls = parse_int(lines[i][44:55])
+    i += 1
+    rows = []
+    for _ in range(nls):
+        l = parse_int(lines[i][22:33])
+        nrs = parse_int(lines[i][55:66])
+        rows.extend((i + 1 + k, l) for k in range(nrs))
+        i += 1 + nrs
+    return rows
+
+
+def resolved_constants(sections):
+    """Get constants needed to evaluate the first resolved resonance range.
+
+    Returns a dictionary with the atomic weight ratio ('awr'), the target spin
+    ('spin'), the scattering radius in 10^-12 cm ('ap'), the flag indicating
+    whether it is also used as the channel radius ('naps') and the energy
+    bounds of the range ('el', 'eh').
+
+    """
+    lines = sections[2, 151]
+    awr = parse_float(lines[0][11:22])
+    el = parse_float(lines[2][:11])
+    eh = parse_float(lines[2][11:22])
+    naps = parse_int(lines[2][55:66])
+    i = _first_range_start(lines)
+    spin = parse_float(lines[i][:11])
+    ap = parse_float(lines[i][11:22])
+    return {'awr': awr, 'spin': spin, 'ap': ap, 'naps': naps, 'el': el, 'eh': eh}
+
+
+def read_list(lines, start=0):
+    """Read a LIST record beginning at lines[start].
+
+    Returns the six fields of its first line, the array of NPL values that
+    follow, and the index of the line after the record.
+
+    """
+    line = lines[start]
+    fields = [parse_float(line[:11]), parse_float(line[11:22])] + \
+             [parse_int(line[11*i:11*(i + 1)]) for i in range(2, 6)]
+    npl = fields[4]
+    n = (npl + 5)//6
+    values = []
+    for line in lines[start + 1:start + 1 + n]:
+        values.extend(parse_float(line[11*i:11*(i + 1)]) for i in range(6))
+    return fields, np.array(values[:npl]), start + 1 + n
+
+
+def _expand(bounds, groups, matrix):
+    """Expand a matrix given on groups onto the finer groups between bounds.
+    Elements for groups outside the range of the matrix are zero."""
+    g = np.searchsorted(groups, bounds[:-1], side='right') - 1
+    inside = (g >= 0) & (g < len(groups) - 1)
+    expanded = np.zeros((len(bounds) - 1, len(bounds) - 1))
+    i = np.where(inside)[0]
+    expanded[np.ix_(i, i)] = matrix[np.ix_(g[i], g[i])]
+    return expanded
+
+
+def read_covariance(lines):
+    """Read the relative covariance of a reaction with itself from MF31/MF33.
+
+    NI-type subsections with LB=1, 2 or 5 are summed on the union of their
+    energy grids. Subsections giving covariances with other reactions,
+    NC-type subsections, and LB types that are absolute or only used for
+    group-averaged variances are not included.
+
+    Returns
+    -------
+    bounds : numpy.ndarray
+        Group boundaries in eV
+    matrix : numpy.ndarray
+        Relative covariance matrix with one row per group
+
+    Returns None if the section has no relative self-covariance.
+
+    """
+    mt = int(lines[0][72:75])
+    nl = parse_int(lines[0][55:66])
+    i = 1
+    blocks = []
+    for _ in range(nl):
+        mt1 = parse_int(lines[i][33:44])
+        nc = parse_int(lines[i][44:55])
+        ni = parse_int(lines[i][55:66])
+        i += 1
+        for _ in range(nc):
+            _, _, i = read_list(lines, i + 1)
+        for _ in range(ni):
+            (_, _, l1, lb, nt, ne), values, i = read_list(lines, i)
+            if mt1 != mt:
+                continue
+            if lb in (1, 2):
+                groups = values[0:2*ne:2]
+                f = values[1:2*ne:2][:-1]
+                if lb == 1:
+                    matrix = np.diag(f)
+                else:
+                    matrix = np.outer(f, f)
+            elif lb == 5:
+                groups = values[:ne]
+                m = values[ne:]
+                n = ne - 1
+                if l1 == 1:
+                    # LS=1, upper triangle given row by row
+                    matrix = np.zeros((n, n))
+                    matrix[np.triu_indices(n)] = m
+                    matrix = matrix + np.triu(matrix, 1).T
+                else:
+                    matrix = m.reshape(n, n)
+            else:
+                continue
+            blocks.append((groups, matrix))
+
+    if not blocks:
+        return None
+    bounds = np.unique(np.concatenate([groups for groups, _ in blocks]))
+    matrix = sum(_expand(bounds, groups, m) for groups, m in blocks)
+    return bounds, matrix
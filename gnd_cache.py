@@ -0,0 +1,140 @@
+"""Persistent cache of ENDF files converted to GND.
+
+Converting a large actinide evaluation with endfFileToGND takes far longer
+than reading back a pickle of the result, so the converted reactionSuite and
+covarianceSuite are stored in a cache directory keyed by the SHA-1 hash of
+the ENDF file. Entries for a path whose contents have since changed are
+removed when the new entry is written, and the least recently used entries
+are removed once the cache grows beyond a size limit.
+
+The cache directory defaults to ~/.cache/cielo-benchmarking and can be set
+with the GND_CACHE_DIR environment variable; setting GND_CACHE_DIR to an
+empty string disables the cache.
+"""
+
+from __future__ import print_function
+from contextlib import contextmanager
+import errno
+import glob
+import hashlib
+import os
+import sys
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from fudge.legacy.converting.endfFileToGND import endfFileToGND
+
+CACHE_DIR = os.environ.get('GND_CACHE_DIR', os.path.join(
+    os.path.expanduser('~'), '.cache', 'cielo-benchmarking'))
+
+# Maximum total size of cache entries in bytes
+MAX_SIZE = 4*1024**3
+
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+def _file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+@contextmanager
+def _recursion_limit(limit):
+    """GND objects are deeply nested, so (un)pickling needs a higher limit"""
+    original = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(original, limit))
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(original)
+
+def _remove(path):
+    """Remove a cache file that another process may have removed already"""
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+def _evict(keep):
+    """Remove least recently used entries until the cache fits in MAX_SIZE"""
+    entries = []
+    for path in glob.glob(os.path.join(CACHE_DIR, '*.pickle')):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= MAX_SIZE:
+            break
+        if path != keep:
+            _remove(path)
+            total -= size
+
+def load(filename):
+    """Convert an ENDF file to GND, using the cache when possible.
+
+    Parameters
+    ----------
+    filename : str
+        Path to ENDF file
+
+    Returns
+    -------
+    dict
+        Dictionary with 'reactionSuite' and 'covarianceSuite' keys, as
+        returned by endfFileToGND
+
+    """
+    if not CACHE_DIR:
+        return endfFileToGND(filename, toStdOut=False, toStdErr=False)
+
+    prefix = _sha1(os.path.abspath(filename).encode('utf-8'))[:12]
+    path = os.path.join(CACHE_DIR, '{0}-{1}.pickle'.format(
+        prefix, _file_hash(filename)))
+
+    # Use cached entry if present, marking it as recently used
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as fh, _recursion_limit(100000):
+                data = pickle.load(fh)
+            os.utime(path, None)
+            return data
+        except Exception:
+            _remove(path)
+
+    data = endfFileToGND(filename, toStdOut=False, toStdErr=False)
+    result = {key: data[key] for key in ('reactionSuite', 'covarianceSuite')}
+
+    # Remove entries for earlier contents of the same file
+    try:
+        os.makedirs(CACHE_DIR)
+    except OSError:
+        if not os.path.isdir(CACHE_DIR):
+            raise
+    for stale in glob.glob(os.path.join(CACHE_DIR, prefix + '-*.pickle')):
+        _remove(stale)
+
+    # Each process writes its own temporary file, so that processes caching
+    # the same evaluation at once never write into each other's pickle
+    fd, temporary = tempfile.mkstemp(suffix='.tmp', dir=CACHE_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as fh, _recursion_limit(100000):
+            pickle.dump(result, fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, path)
+    except Exception as e:
+        print('Warning: Could not cache {0}: {1}'.format(filename, e),
+              file=sys.stderr)
+        _remove(temporary)
+
+    _evict(path)
+    return result
@@ -3,28 +3,313 @@
 from __future__ import print_function
 import argparse
 import copy
-import math
+import json
 import os
 import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy.interpolate import interp1d
+from scipy.optimize import brentq
 from tabulate import tabulate
-from fudge.legacy.converting.endfFileToGND import endfFileToGND
+
+import endf
+import gnd_cache
 
 def header(s):
     n = (77 - len(s))//2
     print('{0}\n{1} {2} {1}\n{0}\n'.format(
             '='*79, ' '*n, s, ' '*(79 - n+len(s)+2)))
 
+def integrate(x, y):
+    """Integral of a lin-lin tabulated function"""
+    return np.sum(np.diff(x)*(y[1:] + y[:-1]))/2
+
+def average_energy(E, p):
+    """Exact mean of a lin-lin tabulated distribution"""
+    dE = np.diff(E)
+    moment = np.sum(dE*(E[:-1]*(2*p[:-1] + p[1:]) + E[1:]*(p[:-1] + 2*p[1:])))/6
+    return moment/integrate(E, p)
+
+def tabulated_shape(energies, values):
+    """Shape function interpolated linearly from a table"""
+    energies = np.asarray(energies, dtype=float)
+    values = np.asarray(values, dtype=float)
+    return lambda E: np.interp(E, energies, values)
+
+def group_shape(bounds, values):
+    """Shape function that is constant over each group between energy bounds"""
+    bounds = np.asarray(bounds, dtype=float)
+    values = np.asarray(values, dtype=float)
+    def shape(E):
+        g = np.searchsorted(bounds, E, side='right') - 1
+        return values[np.clip(g, 0, len(values) - 1)]
+    return shape
+
+def covariance_eigenvector(covariance, k=0):
+    """Shape function from an eigenvector of a relative covariance matrix.
+
+    Eigenvectors are ordered from the largest eigenvalue down and scaled by the
+    square root of their eigenvalue, so the shape is a one standard deviation
+    relative perturbation along that mode. The sign is chosen so that the
+    largest component is positive.
+
+    """
+    native = covariance.getNativeData()
+    bounds = np.array(native.axes[0].data, dtype=float)
+    matrix = np.array(native.matrix.data, dtype=float)
+    eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+    order = np.argsort(eigenvalues)[::-1]
+    vector = eigenvectors[:, order[k]]*np.sqrt(max(eigenvalues[order[k]], 0.))
+    if vector[np.abs(vector).argmax()] < 0:
+        vector = -vector
+    return group_shape(bounds, vector)
+
+# Recipe used by default, for the Pu-239 evaluations this repository began with
+DEFAULT_RECIPE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'evaluations', 'pu239', 'recipe.json')
+
+# MT numbers whose covariances are used for each quantity, in order of
+# preference
+COVARIANCE_MT = {'capture': (102,), 'fission': (18,), 'nubar': (456, 452)}
+
+# Doublings of the bracket searched for a change in the Watt parameter
+MAX_BRACKET_STEPS = 60
+
+def covariance_index(covarianceSuite):
+    """Map MT numbers to the covariance sections of a covariance suite.
+
+    Sections are identified by the ENDF MF/MT of the data they refer to
+    rather than by their position, which differs between evaluations. Only
+    covariances of a reaction with itself are included.
+
+    """
+    index = {}
+    for section in covarianceSuite.sections:
+        try:
+            mf, mt = [int(s) for s in section.rowData.ENDF_MFMT.split(',')]
+        except (AttributeError, ValueError):
+            continue
+        column = getattr(section, 'columnData', None)
+        if column is not None and column.ENDF_MFMT != section.rowData.ENDF_MFMT:
+            continue
+        index.setdefault(mt, section)
+    return index
+
+def find_covariance(index, name):
+    """Return the covariance section for a quantity in COVARIANCE_MT or an MT
+    number, or None if the evaluation has none"""
+    for mt in COVARIANCE_MT.get(name, (name,)):
+        if mt in index:
+            return index[mt]
+    return None
+
+def load_recipe(filename):
+    """Read a JSON file describing the modifications made to a nuclide.
+
+    A recipe may have the following keys, each of which is optional:
+
+    uncertainties
+        Relative 2200 m/s uncertainties of 'capture', 'fission' and 'nubar'
+        used when the evaluation has no covariances for them
+    resonances
+        List of width changes, each with a 'name', the 'energy' of the
+        resonance (the nearest resonance is changed), the 'column' of the
+        width and its 'uncertainty' in eV, negative to decrease the width
+    negative
+        Whether negative energy resonances are modified
+    nubar
+        Constants 'A' and 'B' of the exponential shape of the default thermal
+        prompt nubar change, -A*exp(-B*E) per unit uncertainty
+    pfns
+        Watt parameter 'a' (eV) and the 'uncertainty' in the average energy of
+        the prompt fission neutron spectrum (eV)
+
+    """
+    with open(filename, 'r') as fh:
+        return json.load(fh)
+
+def penetrability(l, rho):
+    """Return the penetrability for angular momentum l at rho = ka"""
+    if l == 0:
+        return rho
+    elif l == 1:
+        return rho**3/(1 + rho**2)
+    elif l == 2:
+        return rho**5/(9 + 3*rho**2 + rho**4)
+    raise NotImplementedError('Penetrability for l = {0}'.format(l))
+
+def reich_moore(energies, params, awr, spin, radius=None):
+    """Evaluate Reich-Moore capture and fission cross sections pointwise.
+
+    Rather than reconstructing the resonance region on an adaptive grid, the
+    R-matrix is evaluated directly at the requested energies, which makes
+    this cheap enough to call inside an iteration. Widths of each resonance
+    are taken from the columns of the GND resonance parameter table and
+    fission widths may be negative (the sign is that of the amplitude).
+
+    Parameters
+    ----------
+    energies : Iterable of float
+        Incident neutron energies in eV
+    params : dict
+        Arrays of resonance parameters keyed by column name ('energy', 'L',
+        'J', 'neutronWidth', 'captureWidth', 'fissionWidthA' and, optionally,
+        'fissionWidthB')
+    awr : float
+        Atomic weight ratio of the target
+    spin : float
+        Spin of the target
+    radius : float, optional
+        Channel radius in units of 10^-12 cm. If not given, the ENDF default
+        based on the atomic weight ratio is used.
+
+    Returns
+    -------
+    capture, fission : numpy.ndarray
+        Resonance contribution to the cross sections in b
+
+    """
+    E = np.atleast_1d(np.asarray(energies, dtype=float))
+    ratio = awr/(awr + 1)
+    wavenumber = lambda e: 2.196771e-3*ratio*np.sqrt(e)
+    a = 0.123*awr**(1./3.) + 0.08 if radius is None else radius
+    k = wavenumber(E)
+
+    capture = np.zeros_like(E)
+    fission = np.zeros_like(E)
+    L = np.asarray(params['L'], dtype=int)
+    J = np.asarray(params['J'], dtype=float)
+    fissionColumns = [c for c in ('fissionWidthA', 'fissionWidthB') if c in params]
+    for l, j in sorted(set(zip(L, J))):
+        res = (L == l) & (J == j)
+        Er = np.asarray(params['energy'])[res]
+        g = (2*abs(j) + 1)/(2*(2*spin + 1))
+
+        # Neutron width amplitudes scale with the penetrability at E
+        P = penetrability(l, k*a)
+        Pr = penetrability(l, wavenumber(abs(Er))*a)
+        Gn = np.asarray(params['neutronWidth'])[res]
+        amplitudes = [np.sign(Gn)*np.sqrt(np.abs(Gn)*P[:, np.newaxis]/Pr)]
+        for c in fissionColumns:
+            Gf = np.asarray(params[c])[res]
+            amplitudes.append(np.broadcast_to(np.sign(Gf)*np.sqrt(np.abs(Gf)),
+                                              amplitudes[0].shape))
+        beta = np.array(amplitudes)
+
+        # Form I - K where K_cc' = i/2 sum_r b_rc b_rc'/(E_r - E - i*Gg_r/2)
+        Gg = np.asarray(params['captureWidth'])[res]
+        denominator = Er - E[:, np.newaxis] - 0.5j*Gg
+        K = 0.5j*np.einsum('inr,jnr->nij', beta/denominator, beta)
+        Y = np.linalg.inv(np.eye(len(beta)) - K)
+
+        factor = 4*np.pi/k**2*g
+        absorption = factor*(Y[:, 0, 0].real - abs(Y[:, 0, 0])**2)
+        fissionJ = factor*np.sum(abs(Y[:, 0, 1:])**2, axis=1)
+        capture += absorption - fissionJ
+        fission += fissionJ
+    return capture, fission
+
+class ResonanceTable(object):
+    """NumPy-backed copy of a GND resonance parameter table.
+
+    Columns are accessed by name, e.g. table['captureWidth'], and are returned
+    as views so that they can be modified in place with array operations.
+    Changes are only written back to the GND table when sync() is called.
+
+    Parameters
+    ----------
+    params : fudge.gnd.resonances.resonanceParameters table
+        Resonance parameters of a resolved region
+
+    """
+    def __init__(self, params):
+        self.params = params
+        self.names = [col.name for col in params.columns]
+        self.data = np.array(params.data, dtype=float)
+        self._synced = self.data.copy()
+
+    def __getitem__(self, name):
+        return self.data[:, self.names.index(name)]
+
+    def __setitem__(self, name, values):
+        self.data[:, self.names.index(name)] = values
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def columns(self):
+        """Return a dictionary of column views keyed by column name"""
+        return {name: self[name] for name in self.names}
+
+    def scale(self, name, factor, mask=None):
+        """Multiply a column, or the rows of it selected by mask, by factor"""
+        if mask is None:
+            self[name] *= factor
+        else:
+            self.data[mask, self.names.index(name)] *= factor
+
+    def snapshot(self):
+        return self.data.copy()
+
+    def restore(self, snapshot):
+        self.data[...] = snapshot
+
+    def sync(self):
+        """Write modified parameters back to the GND table"""
+        for i, j in np.argwhere(self.data != self._synced):
+            self.params.data[i][j] = float(self.data[i, j])
+        self._synced[...] = self.data
+
+
 class Evaluation(object):
-    def __init__(self, filename, target):
+    """Evaluation being modified.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the ENDF file
+    target : float
+        Target change in units of the uncertainty of each modified quantity
+    reconstruct : bool
+        Whether to get 2200 m/s values by full resonance reconstruction
+    recipe : str, optional
+        Path to a recipe giving the modifications and nuclide-specific
+        constants; see load_recipe
+
+    """
+    def __init__(self, filename, target, reconstruct=False, recipe=None):
         self.target = target
-        print('Target: {0}\n'.format(target))
+        self.reconstruct = reconstruct
+        if target is not None:
+            print('Target: {0}\n'.format(target))
 
         header('Reading data from {0}'.format(filename))
-        self.endf = endfFileToGND(filename, toStdOut=False, toStdErr=False)
+        self.endf = gnd_cache.load(filename)
+        self.filename = filename
+        self.recipe = {} if recipe is None else load_recipe(recipe)
+
+        # Covariance sections by MT
+        self.covariances = covariance_index(self.endf['covarianceSuite'])
+
+        # Names of the data that have been modified; see _patch_sections
+        self.modified = set()
+
+        # Constants and background cross sections needed to evaluate the
+        # resolved resonance range directly from its parameters
+        sections = endf.read_sections(filename)
+        self.background = {}
+        for name, mt in (('capture', 102), ('fission', 18)):
+            if (3, mt) in sections:
+                self.background[name] = endf.read_tab1(sections[3, mt], 1)
+
+        # Resonance parameters are modified through a NumPy copy of the table.
+        # Without a Reich-Moore resolved range, 2200 m/s values come from the
+        # background cross sections alone.
+        self.table = None
+        if (2, 151) in sections and endf.resonance_lines(sections[2, 151]) is not None:
+            self.constants = endf.resolved_constants(sections)
+            self.table = ResonanceTable(self._get_parameters())
 
         # Store original 2200 m/s values for capture and fission
         self.capture = []
@@ -32,81 +317,114 @@ class Evaluation(object):
         self._get_2200_values()
 
         # Get original RM parameters
+        if self.table is not None:
+            params = self._get_parameters()
+            self.headers = [col.name + (' ({0})'.format(col.units) if col.units else '')
+                       for col in params.columns]
+            print('ORIGINAL RESONANCE PARAMETERS')
+            row = np.where(self.table['energy'] > 0.)[0][0]
+            print(tabulate(params.data[:row+2], headers=self.headers, tablefmt='grid') + '\n')
+
+    def covariance(self, name):
+        """Return the covariance section of a quantity in COVARIANCE_MT or of an
+        MT number, or None if the evaluation has none"""
+        return find_covariance(self.covariances, name)
+
+    def uncertainty(self, name):
+        """Relative 2200 m/s uncertainty of 'capture', 'fission' or 'nubar'.
+
+        The uncertainty is taken from the covariances of the evaluation when
+        present and otherwise from the 'uncertainties' of the recipe.
+
+        """
+        covariance = self.covariance(name)
+        if covariance is not None:
+            return covariance.getNativeData().getUncertaintyVector().getValue(0.0253)
+        try:
+            return self.recipe['uncertainties'][name]
+        except KeyError:
+            raise ValueError('No covariance or recipe uncertainty for {0} in {1}'
+                             .format(name, self.filename))
+
+    def _require_table(self):
+        if self.table is None:
+            raise ValueError('{0} has no Reich-Moore resolved range to modify'
+                             .format(self.filename))
+
+    def _get_parameters(self):
         rSuite = self.endf['reactionSuite']
         resolvedResonances = rSuite.resonances.resolved
         if resolvedResonances.multipleRegions:
-            params = resolvedResonances.regions[0].nativeData.resonanceParameters
+            return resolvedResonances.regions[0].nativeData.resonanceParameters
+        else:
+            return resolvedResonances.nativeData.resonanceParameters
+
+    def cross_sections(self, energies):
+        """Evaluate capture and fission cross sections at a few energies in the
+        first resolved range directly from the current resonance parameters"""
+        if self.table is None:
+            capture = np.zeros(len(energies))
+            fission = np.zeros(len(energies))
         else:
-            params = resolvedResonances.nativeData.resonanceParameters
-        columnNames = [col.name for col in params.columns]
-        self.headers = [col.name + (' ({0})'.format(col.units) if col.units else '')
-                   for col in params.columns]
-        print('ORIGINAL RESONANCE PARAMETERS')
-        row = np.where(np.array(params.getColumn('energy')) > 0.)[0][0]
-        print(tabulate(params.data[:row+2], headers=self.headers, tablefmt='grid') + '\n')
+            capture, fission = reich_moore(
+                energies, self.table.columns(), self.constants['awr'], self.constants['spin'],
+                self.constants['ap'] if self.constants['naps'] == 1 else None)
+        if 'capture' in self.background:
+            capture += np.interp(energies, *self.background['capture'])
+        if 'fission' in self.background:
+            fission += np.interp(energies, *self.background['fission'])
+        return capture, fission
 
     def _get_2200_values(self):
-        print('Reconstructing resonances...')
-        rSuite = self.endf['reactionSuite']
-        rSuite.reconstructResonances()
-        self.capture.append(rSuite.getReaction('capture')\
-                                .getCrossSection()['linear'].getValue(0.0253))
-        self.fission.append(rSuite.getReaction('fission')\
-                                .getCrossSection()['linear'].getValue(0.0253))
+        if self.reconstruct:
+            print('Reconstructing resonances...')
+            if self.table is not None:
+                self.table.sync()
+            rSuite = self.endf['reactionSuite']
+            rSuite.reconstructResonances()
+            self.capture.append(rSuite.getReaction('capture')\
+                                    .getCrossSection()['linear'].getValue(0.0253))
+            self.fission.append(rSuite.getReaction('fission')\
+                                    .getCrossSection()['linear'].getValue(0.0253))
+        else:
+            capture, fission = self.cross_sections([0.0253])
+            self.capture.append(capture[0])
+            self.fission.append(fission[0])
+
+    def modify_resonance_widths(self, changes):
+        """Change the widths of individual resonances.
+
+        Parameters
+        ----------
+        changes : list of dict
+            Width changes as given in the 'resonances' of a recipe. Each width
+            changes by the target times its uncertainty.
+
+        """
+        self._require_table()
 
-    def modify_lowE_resonances(self, args):
         # Get capture and fission cross sections
         print('Original 2200 m/s capture xs = {0:.3f} b'.format(self.capture[0]))
         print('Original 2200 m/s fission xs = {0:.3f} b'.format(self.fission[0]))
 
-        # Get RM parameters, column indices for partial-widths
-        rSuite = self.endf['reactionSuite']
-        resolvedResonances = rSuite.resonances.resolved
-        if resolvedResonances.multipleRegions:
-            params = resolvedResonances.regions[0].nativeData.resonanceParameters
-        else:
-            params = resolvedResonances.nativeData.resonanceParameters
-        columnNames = [col.name for col in params.columns]
-        colE = columnNames.index('energy')
-        colN = columnNames.index('neutronWidth')
-        colG = columnNames.index('captureWidth')
-        colFA = columnNames.index('fissionWidthA')
-        colFB = columnNames.index('fissionWidthB')
-
         header('Modifying resonance parameters...')
-
-        # Uncertainties in resonance parameters given by Gilles Noguerre. These are
-        # supposedly from SG34 file 32.
-
-        if args.capture_03 or args.fission_03:
-            uCapture = 1.3e-3
-            uFission = 0.95e-3
-            row = np.where(np.array(params.getColumn('energy')) > 0.)[0][0]
-            print('Uncertainty in 0.296 eV capture width = {0} eV'.format(uCapture))
-            print('Uncertainty in 0.296 eV fissionA width = {0} eV'.format(uFission))
-
-            # Increase radiation width / decrease fission widths 
-            if args.capture_03:
-                params.data[row][colG] += self.target*uCapture
-            if args.fission_03:
-                params.data[row][colFA] -= self.target*uFission
-
-        if args.capture_78 or args.fission_78:
-            uCapture = 2.1e-3
-            uFission = 1.85e-3
-            row = np.where(np.array(params.getColumn('energy')) > 0.)[0][0] + 1
-            print('Uncertainty in 7.8 eV capture width = {0} eV'.format(uCapture))
-            print('Uncertainty in 7.8 eV fissionA width = {0} eV\n'.format(uFission))
-
-            # Increase radiation width / decrease fission widths 
-            if args.capture_78:
-                params.data[row][colG] += self.target*uCapture
-            if args.fission_78:
-                params.data[row][colFA] -= self.target*uFission
+        self.modified.add('resonances')
+
+        # Change widths of the resonances nearest the given energies
+        table = self.table
+        rows = []
+        for change in changes:
+            row = np.abs(table['energy'] - change['energy']).argmin()
+            uncertainty = change['uncertainty']
+            print('Uncertainty in {0} eV {1} = {2} eV'.format(
+                    change['energy'], change['column'], abs(uncertainty)))
+            table[change['column']][row] += self.target*uncertainty
+            if row not in rows:
+                rows.append(row)
+        print('')
 
         print('MODIFIED RESONANCE PARAMETERS')
-        row = np.where(np.array(params.getColumn('energy')) > 0.)[0][0]
-        print(tabulate(params.data[row:row+2], headers=self.headers, tablefmt='grid') + '\n')
+        print(tabulate(table.data[sorted(rows)], headers=self.headers, tablefmt='grid') + '\n')
 
         # Get capture and fission cross sections
         self._get_2200_values()
@@ -115,36 +433,15 @@ class Evaluation(object):
         print('Modified 2200 m/s capture xs = {0:.3f} b ({1:.3%})'.format(self.capture[-1], changeCapture))
         print('Modified 2200 m/s fission xs = {0:.3f} b ({1:.3%})\n'.format(self.fission[-1], changeFission))
 
-    def modify_negative_resonances(self):
+    def modify_negative_resonances(self, tolerance=1e-3, max_iterations=20):
+        self._require_table()
         header('Modifying negative energy resonances...')
-        rSuite = self.endf['reactionSuite']
-        resolvedResonances = rSuite.resonances.resolved
-        if resolvedResonances.multipleRegions:
-            params = resolvedResonances.regions[0].nativeData.resonanceParameters
-        else:
-            params = resolvedResonances.nativeData.resonanceParameters
-
-        columnNames = [col.name for col in params.columns]
-        colN = columnNames.index('neutronWidth')
-        colG = columnNames.index('captureWidth')
-        colFA = columnNames.index('fissionWidthA')
-        colFB = columnNames.index('fissionWidthB')
-        headers = [col.name + (' ({0})'.format(col.units) if col.units else '')
-                   for col in params.columns]
-
-        # Determine 2200 m/s covariances for fission and capture
-        cSuite = self.endf['covarianceSuite']
-        try:
-            covFission = cSuite.sections[12]
-            uFission = covFission.getNativeData().getUncertaintyVector().getValue(0.0253)
-        except IndexError:
-            uFission = 0.011260977
+        self.modified.add('resonances')
+        table = self.table
 
-        try:
-            covCapture = cSuite.sections[19]
-            uCapture = covCapture.getNativeData().getUncertaintyVector().getValue(0.0253)
-        except IndexError:
-            uCapture = 0.017603641
+        # Determine 2200 m/s uncertainties for fission and capture
+        uFission = self.uncertainty('fission')
+        uCapture = self.uncertainty('capture')
 
         print('Uncertainty in 2200 m/s capture = {0:.2f} b ({1:.2%})'.format(
                 uCapture*self.capture[0], uCapture))
@@ -156,81 +453,69 @@ class Evaluation(object):
         print('Targeting a {0:.3%} increase in 2200 m/s capture'.format(targetCapture).upper())
         print('Targeting a {0:.3%} decrease in 2200 m/s fission\n'.format(targetFission).upper())
 
-        # Determine number of negative resonances
-        n_res = np.where(np.array(params.getColumn('energy')) < 0.)[0].size
+        # Determine negative resonances
+        negative = table['energy'] < 0.
+        n_res = np.count_nonzero(negative)
 
-        initial_guess = 0.2
-        xg1 = initial_guess*uCapture
-        xf1 = -initial_guess*uFission
-        iteration = 1
         j = len(self.capture) - 1
+        original = table.snapshot()
+        targets = np.array([targetCapture, targetFission])
 
-        fCapture = lambda xs: xs - (1 + targetCapture)*self.capture[j]
-        fFission = lambda xs: xs - (1 + targetFission)*self.fission[j]
-
-        xg0 = 0.
-        xf0 = 0.
-        fg0 = fCapture(self.capture[j])
-        ff0 = fFission(self.fission[j])
-
-        while True:
+        def residual(x, iteration):
+            """Apply relative changes x to the capture and fission widths of the
+            negative resonances and return the miss in 2200 m/s changes"""
+            xg, xf = x
             print('Iteration ' + str(iteration))
-            print('  Changing capture widths by {0:.1%}'.format(xg1))
-            print('  Changing fission widths by {0:.1%}'.format(xf1))
-
-            # Save original values
-            GG = [params.data[i][colG] for i in range(n_res)]
-            GFA = [params.data[i][colFA] for i in range(n_res)]
-            GFB = [params.data[i][colFB] for i in range(n_res)]
+            print('  Changing capture widths by {0:.3%}'.format(xg))
+            print('  Changing fission widths by {0:.3%}'.format(xf))
 
             # Increase capture widths and decrease fission widths for negative energy
             # resonances -- note that if the width is negative, we do the opposite
-            for row in range(n_res):
-                params.data[row][colG] *= 1 + xg1
-                if params.data[row][colFA] > 0:
-                    params.data[row][colFA] *= 1 - xf1
-                else:
-                    params.data[row][colFA] *= 1 + xf1
-                if params.data[row][colFB] > 0:
-                    params.data[row][colFB] *= 1 - xf1
-                else:
-                    params.data[row][colFB] *= 1 + xf1
-
-            # Reconstruct resonances
-            self._get_2200_values()
+            table.restore(original)
+            table.scale('captureWidth', 1 + xg, negative)
+            for name in ('fissionWidthA', 'fissionWidthB'):
+                widths = table[name][negative]
+                table.scale(name, np.where(widths > 0, 1 - xf, 1 + xf), negative)
 
+            self._get_2200_values()
             changeCapture = (self.capture[-1] - self.capture[j]) / self.capture[j]
             changeFission = (self.fission[-1] - self.fission[j]) / self.fission[j]
             print('  2200 m/s capture xs = {0:.3f} b ({1:.3%})'.format(self.capture[-1], changeCapture))
             print('  2200 m/s fission xs = {0:.3f} b ({1:.3%})'.format(self.fission[-1], changeFission))
+            return np.array([changeCapture, changeFission]) - targets
 
-            iteration += 1
-            if (abs(targetCapture/changeCapture - 1) < abs(targetCapture)*0.1 and
-                abs(targetFission/changeFission - 1) < abs(targetFission)*0.1):
+        # Estimate the 2x2 Jacobian of the changes in capture and fission with
+        # respect to the width changes by forward differences. Scaling capture
+        # widths also changes fission (and vice versa), so both are solved for
+        # together.
+        initial_guess = 0.2
+        steps = initial_guess*np.array([uCapture, -uFission])
+        x = np.zeros(2)
+        F = -targets
+        jacobian = np.empty((2, 2))
+        for k in range(2):
+            dx = np.zeros(2)
+            dx[k] = steps[k]
+            jacobian[:, k] = (residual(dx, k + 1) - F)/steps[k]
+
+        # Newton iterations with Broyden updates of the Jacobian
+        iteration = 3
+        while True:
+            dx = np.linalg.solve(jacobian, -F)
+            x += dx
+            F_new = residual(x, iteration)
+            if np.all(abs(F_new) <= tolerance*abs(targets)):
                 break
-
-            # Reset partial widths
-            for row in range(n_res):
-                params.data[row][colG] = GG[row]
-                params.data[row][colFA] = GFA[row]
-                params.data[row][colFB] = GFB[row]
-
-            fg1 = fCapture(self.capture[-1])
-            ff1 = fFission(self.fission[-1])
-
-            xg_new = xg1 - fg1*(xg1 - xg0)/(fg1 - fg0)
-            xf_new = xf1 - ff1*(xf1 - xf0)/(ff1 - ff0)
-
-            fg0 = fg1
-            ff0 = ff1
-            xg0 = xg1
-            xf0 = xf1
-            xg1 = xg_new
-            xf1 = xf_new
+            if iteration >= max_iterations:
+                print('Warning: 2200 m/s targets not met after {0} iterations'.format(iteration))
+                break
+            jacobian += np.outer(F_new - F - jacobian.dot(dx), dx)/dx.dot(dx)
+            F = F_new
+            iteration += 1
 
         # Print tables
         print('\nMODIFIED RESONANCE PARAMETERS')
-        print(tabulate(params.data[:n_res], headers=self.headers, tablefmt='grid'))
+        print(tabulate(table.data[:n_res], headers=self.headers, tablefmt='grid'))
 
         # Get capture and fission cross sections
         changeCapture = (self.capture[-1] - self.capture[0]) / self.capture[0]
@@ -239,102 +524,288 @@ class Evaluation(object):
         print('Modified 2200 m/s fission xs = {0:.3f} b ({1:.3%})\n'.format(self.fission[-1], changeFission))
 
 
-    def modify_nubar(self):
-
-        header('Modifying thermal prompt nubar...')
-
-        # Determine 2200 m/s covariance for nubar
-        try:
-            covNubar = self.endf['covarianceSuite'].sections[0]
-            uncvNubar = covNubar.getNativeData().getUncertaintyVector()
-            uNubar = uncvNubar.getValue(0.0253)
-        except IndexError:
-            uNubar = 0.0018568252
-
-        # Get prompt nubar
-        nubar = self.endf['reactionSuite'].getReaction('fission').outputChannel\
-            .particles[0].multiplicity['pointwise']
-
-        print('Uncertainty in 2200 m/s prompt fission nubar = {0:.3f} ({1:.3%})\n'.format(
-                uNubar*nubar.getValue(0.0253), uNubar))
-
-        # Set constants for modification
-        A = 1.0608
-        B = 2.3321
-
-        # Loop through energies and modified nu-bar values
-        for i, (energy, nu) in enumerate(nubar):
-            nubar[i] = [energy, nu - self.target*uNubar*A*math.exp(-B*energy)]
+    def _get_multiplicities(self, kind):
+        """Return pointwise multiplicities of prompt, delayed or all (total)
+        fission neutrons"""
+        neutrons = [p for p in self.endf['reactionSuite'].getReaction('fission')
+                    .outputChannel.particles if p.particle.name == 'n']
+        if kind == 'prompt':
+            neutrons = neutrons[:1]
+        elif kind == 'delayed':
+            neutrons = neutrons[1:]
+        elif kind != 'total':
+            raise ValueError('Unknown multiplicity: {0}'.format(kind))
+        return [n.multiplicity['pointwise'] for n in neutrons]
+
+    def perturb_multiplicity(self, shape, kind='prompt', scale=None,
+                             relative=True, energies=(0.0253,)):
+        """Apply an energy-dependent perturbation to fission multiplicities.
+
+        Parameters
+        ----------
+        shape : callable
+            Function of an array of incident energies returning the change per
+            unit scale, e.g. from tabulated_shape, group_shape or
+            covariance_eigenvector
+        kind : {'prompt', 'delayed', 'total'}
+            Which multiplicities to perturb. For 'total', prompt and delayed
+            multiplicities are perturbed alike.
+        scale : float, optional
+            Multiplier on the shape; defaults to the target
+        relative : bool
+            Whether the shape is a relative change (nu*(1 + scale*shape)) or an
+            absolute one (nu + scale*shape). An absolute change is shared
+            among the multiplicities perturbed in proportion to their values,
+            so that their sum changes by scale*shape.
+        energies : Iterable of float
+            Energies at which to report the change in multiplicity
+
+        Returns
+        -------
+        before, after : numpy.ndarray
+            Summed multiplicity at the report energies
+
+        """
+        if scale is None:
+            scale = self.target
+        if kind in ('prompt', 'total'):
+            self.modified.add('prompt nubar')
+        if kind in ('delayed', 'total'):
+            self.modified.add('delayed nubar')
+
+        energies = np.asarray(energies, dtype=float)
+        before = np.zeros_like(energies)
+        after = np.zeros_like(energies)
+        multiplicities = self._get_multiplicities(kind)
+        data = [tuple(map(np.array, nubar.copyDataToXsAndYs()))
+                for nubar in multiplicities]
+        for nubar, (E, nu) in zip(multiplicities, data):
+            delta = scale*np.asarray(shape(E), dtype=float)
+            if relative:
+                modified = nu*(1 + delta)
+            else:
+                total = sum(np.interp(E, x, y) for x, y in data)
+                modified = nu + delta*nu/total
+            nubar.setDataFromXsAndYs(list(E), list(modified))
+            before += np.interp(energies, E, nu)
+            after += np.interp(energies, E, modified)
+
+        table = [[e, b, a, '{0:.3%}'.format(a/b - 1)]
+                 for e, b, a in zip(energies, before, after)]
+        print(tabulate(table, headers=['Energy (eV)', 'Original {0} nubar'.format(kind),
+                                       'Modified', 'Change'], tablefmt='grid') + '\n')
+        return before, after
+
+    def modify_nubar(self, shape=None, kind='prompt'):
+        header('Modifying {0} nubar...'.format(kind if shape else 'thermal prompt'))
+
+        if shape is None:
+            # Determine 2200 m/s uncertainty for nubar
+            uNubar = self.uncertainty('nubar')
+
+            # Get prompt nubar
+            nubar = self._get_multiplicities('prompt')[0]
+
+            print('Uncertainty in 2200 m/s prompt fission nubar = {0:.3f} ({1:.3%})\n'.format(
+                    uNubar*nubar.getValue(0.0253), uNubar))
+
+            # Set constants for modification
+            try:
+                A = self.recipe['nubar']['A']
+                B = self.recipe['nubar']['B']
+            except KeyError:
+                raise ValueError('Recipe has no constants for the default nubar shape')
+
+            # Decrease thermal nu-bar with an exponential shape
+            shape = lambda E: -uNubar*A*np.exp(-B*E)
+            self.perturb_multiplicity(shape, 'prompt', relative=False)
+        else:
+            self.perturb_multiplicity(shape, kind)
 
     def modify_fission_spectrum(self):
         header('Modifying prompt neutron fission spectra...')
+        self.modified.add('pfns')
 
-        # Get prompt fission neutron spectrum from thermal fission
+        # Get prompt fission neutron spectra for all incident energies
         promptN = self.endf['reactionSuite'].getReaction('fission').outputChannel.particles[0]
         pnfs = promptN.distributions.components['uncorrelated'].energyComponent['pointwise']
-        xys = pnfs[0]
-        #x0, y0 = map(np.array, xys.copyDatatoXsAndYs())
+        spectra = [tuple(map(np.array, xys.copyDataToXsAndYs())) for xys in pnfs]
 
-        # Construct Watt fission spectrum
-        a = 0.966e6
-        b = 2.842e-6
-        Watt = lambda E, a, b: float(np.exp(-E/a)*np.sinh(np.sqrt(b*E)))
-
-        # Uncertainty of 30 keV from R. Capote
-        uAverage = 30.0e3
+        # Spectra are multiplied by the ratio of Watt spectra with the 'a'
+        # parameter changed by a factor (1 + x). The sinh(sqrt(b*E)) term is
+        # the same in both and cancels.
+        try:
+            a = self.recipe['pfns']['a']
+            uAverage = self.recipe['pfns']['uncertainty']
+        except KeyError:
+            raise ValueError('Recipe has no Watt parameter or PFNS uncertainty')
+        ratio = lambda E, x: np.exp(E/a - E/((1 + x)*a))
 
-        originalAvgE = xys.integrateWithWeight_x()
-        origX, origY = xys.copyDataToXsAndYs()
+        E0, p0 = spectra[0]
+        originalAvgE = average_energy(E0, p0)
 
         print('Uncertainty in PFNS average energy = {0:.3f} keV ({1:.2%})'.format(
                 uAverage/1e3, uAverage/originalAvgE))
 
         target = self.target*uAverage/originalAvgE
-        initial_guess = 0.5
-        x = initial_guess*target
-        iteration = 0
+        targetAvgE = originalAvgE*(1 + target)
         print('Targeting a {0:.3%} increase in PFNS average energy ({1:.4f} MeV)'.format(
-                target, originalAvgE*1e-6*(1 + target)).upper())
-
-        while True:
-            print('Iteration ' + str(iteration))
-            print('  Changing Watt parameter by {0:.2%}'.format(x))
-
-            # Modify each probability by ratio of Watt spectra
-            for i, (energy, prob) in enumerate(xys):
-                if np.isclose(energy, 0.0):
-                    continue
-                xys[i] = [energy, prob*Watt(energy, (1+x)*a, b)/Watt(energy, a, b)]
-
-            # Renormalize spectra
-            integral = xys.integrate()
-            for i, (energy, prob) in enumerate(xys):
-                xys[i] = [energy, prob/integral]
-
-            avgE = xys.integrateWithWeight_x()
-            change = (avgE - originalAvgE)/originalAvgE
-
-            print('  PFNS average energy = {0:.4f} MeV ({1:.3%})'.format(
-                    avgE*1e-6, change))
-
-            iteration += 1
-            if (abs(target/change - 1) < abs(target)*0.1):
+                target, targetAvgE*1e-6).upper())
+
+        # Solve for the change in the Watt parameter that gives the target
+        # average energy for thermal fission. The average energy increases
+        # monotonically with x, so widen the bracket until it holds the root.
+        f = lambda x: average_energy(E0, p0*ratio(E0, x)) - targetAvgE
+        lower, upper = -0.5, 0.5
+        for _ in range(MAX_BRACKET_STEPS):
+            if f(lower) <= 0.:
                 break
+            lower = (lower - 1.)/2
+        for _ in range(MAX_BRACKET_STEPS):
+            if f(upper) >= 0.:
+                break
+            upper *= 2
+        if f(lower) > 0. or f(upper) < 0.:
+            raise ValueError('PFNS average energy of {0:.4f} MeV ({1:+.3%}) cannot be '
+                             'reached by changing the Watt parameter'.format(
+                                 targetAvgE*1e-6, target))
+        x, result = brentq(f, lower, upper, xtol=1e-12, full_output=True)
+        print('Changing Watt parameter by {0:.4%} ({1} evaluations)\n'.format(
+                x, result.function_calls))
+
+        # Apply the same change to the spectrum at every incident energy
+        table = []
+        for xys, (E, p) in zip(pnfs, spectra):
+            modified = p*ratio(E, x)
+            modified /= integrate(E, modified)
+            xys.setDataFromXsAndYs(list(E), list(modified))
+            avgE = average_energy(E, modified)
+            change = avgE/average_energy(E, p) - 1
+            table.append([xys.value, avgE*1e-6, '{0:.3%}'.format(change)])
+        print(tabulate(table, headers=['Incident energy (eV)', 'Average energy (MeV)',
+                                       'Change'], tablefmt='grid') + '\n')
+
+    def _patch_resonances(self, lines):
+        """Return MF2/MT151 lines with the current resonance widths"""
+        rows = endf.resonance_lines(lines)
+        if rows is None:
+            return None
+
+        # Match resonances by L, J and energy as written in the ENDF file
+        table = self.table
+        lookup = {}
+        for r, (l, j, e) in enumerate(zip(table['L'], table['J'], table['energy'])):
+            key = (int(l), endf.format_float(j), endf.format_float(e))
+            lookup.setdefault(key, []).append(r)
+        columns = [table.names.index(name) for name in
+                   ('neutronWidth', 'captureWidth', 'fissionWidthA', 'fissionWidthB')]
+
+        lines = list(lines)
+        for i, l in rows:
+            key = (l, endf.format_float(endf.parse_float(lines[i][11:22])),
+                   endf.format_float(endf.parse_float(lines[i][:11])))
+            if not lookup.get(key):
+                return None
+            lines[i] = endf.replace_fields(lines[i], table.data[lookup[key].pop(0), columns], 2)
+        return lines
+
+    def _patch_nubar(self, sections):
+        """Return MF1/MT456 and MF1/MT452 lines with the current prompt nubar"""
+        prompt = sections[1, 456]
+        total = sections.get((1, 452))
+        if endf.parse_int(prompt[0][33:44]) != 2:
+            return None
+        if total is not None and endf.parse_int(total[0][33:44]) != 2:
+            return None
+
+        E, nu = map(np.array, self._get_multiplicities('prompt')[0].copyDataToXsAndYs())
+        E0, nu0 = endf.read_tab1(prompt, 1)
+        if len(E) != len(E0):
+            return None
+        n = endf.tab1_length(prompt, 1)
+        replacements = {(1, 456): prompt[:1] + endf.replace_tab1(prompt, 1, nu) + prompt[1+n:]}
+
+        # Total nubar changes by the same amount as prompt nubar
+        if total is not None:
+            x, y = endf.read_tab1(total, 1)
+            n = endf.tab1_length(total, 1)
+            y = y + np.interp(x, E, nu - nu0)
+            replacements[1, 452] = total[:1] + endf.replace_tab1(total, 1, y) + total[1+n:]
+        return replacements
+
+    def _patch_pfns(self, lines):
+        """Return MF5/MT18 lines with the current prompt fission spectra"""
+        # Only a single tabulated (LF=1) subsection is handled
+        if endf.parse_int(lines[0][44:55]) != 1 or endf.parse_int(lines[1][33:44]) != 1:
+            return None
+        i = 1 + endf.tab1_length(lines, 1)
+        nr = endf.parse_int(lines[i][44:55])
+        ne = endf.parse_int(lines[i][55:66])
+        i += 1 + (nr + 2)//3
 
-            xys.setDataFromXsAndYs(origX, origY)
-            x *= target/change
-
-    def write(self, filename):
+        promptN = self.endf['reactionSuite'].getReaction('fission').outputChannel.particles[0]
+        pnfs = promptN.distributions.components['uncorrelated'].energyComponent['pointwise']
+        if len(pnfs) != ne:
+            return None
+        patched = lines[:i]
+        for xys in pnfs:
+            E, p = xys.copyDataToXsAndYs()
+            n = endf.tab1_length(lines, i)
+            try:
+                patched += endf.replace_tab1(lines, i, p)
+            except ValueError:
+                return None
+            i += n
+        return patched + lines[i:]
+
+    def _patch_sections(self):
+        """Re-serialize only the sections holding modified data.
+
+        Returns a dictionary mapping (MF, MT) to replacement lines, or None if
+        some modification cannot be written by patching the original file.
+
+        """
+        sections = endf.read_sections(self.filename)
+        replacements = {}
+        for name in self.modified:
+            if name == 'resonances' and self.table is None:
+                # No Reich-Moore parameters to write back
+                continue
+            elif name == 'resonances':
+                patch = self._patch_resonances(sections[2, 151])
+                patch = None if patch is None else {(2, 151): patch}
+            elif name == 'prompt nubar':
+                patch = self._patch_nubar(sections)
+            elif name == 'pfns':
+                patch = self._patch_pfns(sections[5, 18])
+                patch = None if patch is None else {(5, 18): patch}
+            else:
+                patch = None
+            if patch is None:
+                print('Cannot patch {0} into original file'.format(name))
+                return None
+            replacements.update(patch)
+        return replacements
+
+    def write(self, filename, patch=True):
         header('Writing new ENDF file...')
-        endf = self.endf['reactionSuite'].toENDF6(
+        if self.table is not None:
+            self.table.sync()
+
+        # Only rewrite modified sections when possible, copying the rest of
+        # the original file unchanged
+        replacements = self._patch_sections() if patch else None
+        if replacements is not None:
+            endf.write_patched(self.filename, filename, replacements)
+            return
+
+        print('Converting full evaluation to ENDF-6...')
+        text = self.endf['reactionSuite'].toENDF6(
             {'verbosity': 0}, covarianceSuite=self.endf['covarianceSuite'])
-        open(filename, 'w').write(endf)
+        open(filename, 'w').write(text)
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('endf', help='ENDF file to modify')
-    parser.add_argument('endfModified', help='Modified ENDF file')
-    parser.add_argument('target', type=float, help='Target percentage change')
+def add_modification_arguments(parser):
+    """Add flags selecting which modifications are made to an argument parser"""
     parser.add_argument('--capture-03', action='store_true', help='Increase 0.3 eV capture width')
     parser.add_argument('--fission-03', action='store_true', help='Decrease 0.3 eV fission width')
     parser.add_argument('--capture-78', action='store_true', help='Increase 7.8 eV capture width')
@@ -342,17 +813,69 @@ if __name__ == '__main__':
     parser.add_argument('--negative', action='store_true', help='Modify negative energy resonances')
     parser.add_argument('--nubar', action='store_true', help='Modify nubar')
     parser.add_argument('--pfns', action='store_true', help='Modify prompt fission neutron spectrum')
+    parser.add_argument('--nubar-kind', choices=('prompt', 'delayed', 'total'),
+                        default='prompt', help='Multiplicity modified by --nubar-shape '
+                        'or --nubar-eigenvector')
+    parser.add_argument('--nubar-shape', help='File with energies (eV) and relative '
+                        'changes in nubar per unit target, in two columns')
+    parser.add_argument('--nubar-eigenvector', type=int, help='Modify nubar along '
+                        'this eigenvector of its covariance (0 = largest eigenvalue)')
+    parser.add_argument('--tolerance', type=float, default=1e-3,
+                        help='Relative tolerance on 2200 m/s targets for negative resonances')
+    parser.add_argument('--all', action='store_true',
+                        help='Make every modification listed in the recipe')
+
+def apply_modifications(evaluation, args):
+    """Make the modifications selected by flags in args"""
+    recipe = evaluation.recipe
+
+    # Resonance flags select width changes of the recipe by name
+    changes = recipe.get('resonances', [])
+    if not args.all:
+        selected = [name for name in ('capture-03', 'fission-03', 'capture-78', 'fission-78')
+                    if getattr(args, name.replace('-', '_'))]
+        missing = set(selected) - set(c['name'] for c in changes)
+        if missing:
+            raise ValueError('Recipe has no width changes named {0}'.format(
+                ', '.join(sorted(missing))))
+        changes = [c for c in changes if c['name'] in selected]
+    if changes: evaluation.modify_resonance_widths(changes)
+
+    if args.negative or (args.all and recipe.get('negative')):
+        evaluation.modify_negative_resonances(args.tolerance)
+    if args.nubar or (args.all and 'nubar' in recipe):
+        shape = None
+        if args.nubar_shape is not None:
+            shape = tabulated_shape(*np.loadtxt(args.nubar_shape, unpack=True))
+        elif args.nubar_eigenvector is not None:
+            covariance = evaluation.covariance('nubar')
+            if covariance is None:
+                raise ValueError('{0} has no nubar covariance'.format(evaluation.filename))
+            shape = covariance_eigenvector(covariance, args.nubar_eigenvector)
+        evaluation.modify_nubar(shape, args.nubar_kind)
+    if args.pfns or (args.all and 'pfns' in recipe):
+        evaluation.modify_fission_spectrum()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('endf', help='ENDF file to modify')
+    parser.add_argument('endfModified', help='Modified ENDF file')
+    parser.add_argument('target', type=float, help='Target percentage change')
+    add_modification_arguments(parser)
+    parser.add_argument('--recipe', default=DEFAULT_RECIPE,
+                        help='Recipe with the modifications and constants for the nuclide')
+    parser.add_argument('--reconstruct', action='store_true',
+                        help='Get 2200 m/s values by full resonance reconstruction')
+    parser.add_argument('--full-write', action='store_true',
+                        help='Convert the whole evaluation to ENDF-6 rather than '
+                        'patching modified sections into the original file')
     args = parser.parse_args()
 
     # Read evaluation
-    pu239 = Evaluation(args.endf, args.target)
+    evaluation = Evaluation(args.endf, args.target, args.reconstruct, args.recipe)
 
     # Make modifications
-    lowE = (args.capture_03 or args.fission_03 or args.capture_78 or args.fission_78)
-    if lowE: pu239.modify_lowE_resonances(args)
-    if args.negative: pu239.modify_negative_resonances()
-    if args.nubar: pu239.modify_nubar()
-    if args.pfns: pu239.modify_fission_spectrum()
+    apply_modifications(evaluation, args)
 
     # Write modified evaluation
-    pu239.write(args.endfModified)
+    evaluation.write(args.endfModified, not args.full_write)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Modify several evaluations, each according to its own recipe.
+
+Jobs are read from a file with one evaluation per line giving the ENDF file,
+its recipe, the modified ENDF file to write and the target, e.g.
+
+  evaluations/u235/endf.txt  evaluations/u235/recipe.json  u235-mod.endf  0.5
+
+Every modification listed in a recipe is made. Evaluations are modified in
+parallel, with the output of each written to a log file next to the modified
+ENDF file.
+"""
+
+from __future__ import print_function
+import argparse
+import multiprocessing
+import sys
+
+from modify import Evaluation, add_modification_arguments, apply_modifications
+
+# Parser providing the default modify.py options, with every recipe
+# modification selected
+options_parser = argparse.ArgumentParser(prog='options')
+add_modification_arguments(options_parser)
+
+
+def read_jobs(filename):
+    """Return (endf, recipe, output, target) for each line of a jobs file"""
+    jobs = []
+    with open(filename, 'r') as fh:
+        for line in fh:
+            words = line.split('#')[0].split()
+            if not words:
+                continue
+            if len(words) != 4:
+                raise ValueError('Expected ENDF file, recipe, output and target: '
+                                 + line.strip())
+            jobs.append((words[0], words[1], words[2], float(words[3])))
+    return jobs
+
+def modify(job):
+    """Modify and write one evaluation; output is captured in a log file"""
+    filename, recipe, output, target = job
+    log = output + '.out'
+    args = options_parser.parse_args(['--all'])
+
+    sys.stdout = open(log, 'w')
+    try:
+        evaluation = Evaluation(filename, target, recipe=recipe)
+        apply_modifications(evaluation, args)
+        evaluation.write(output)
+    finally:
+        sys.stdout.close()
+        sys.stdout = sys.__stdout__
+    return output, log
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('jobs', help='File listing evaluations, recipes, outputs '
+                        'and targets, one evaluation per line')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of evaluations to modify in parallel')
+    args = parser.parse_args()
+
+    jobs = read_jobs(args.jobs)
+
+    # Evaluations differ in size, so each gets a fresh worker that returns its
+    # memory when done
+    pool = multiprocessing.Pool(args.processes, maxtasksperchild=1)
+    for output, log in pool.imap_unordered(modify, jobs):
+        print('Wrote {0} (log in {1})'.format(output, log))
+    pool.close()
+    pool.join()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""Perturb processed cross sections directly, without re-running NJOY.
+
+A nuclide is read from the HDF5 library given by a cross_sections.xml file.
+Multipliers are applied to the pointwise cross sections of chosen reactions,
+after which every redundant reaction (total, fission, absorption, ...) is
+recomputed from its components so that sums remain consistent. Unresolved
+resonance probability tables are scaled as well when they are not already
+multiplied by the smooth cross section. The perturbed nuclide and a copy of
+cross_sections.xml pointing to it are written to an output directory.
+
+Multipliers may be given as
+  - a number, e.g. '-p 102 1.02' for a flat 2% increase in capture
+  - a file with two columns, energy (eV) and multiplier, interpolated linearly
+  - a relative uncertainty vector with '-u MT FILE SIGMAS', where FILE has
+    group boundaries (eV) and relative uncertainties in two columns and the
+    multiplier in each group is 1 + SIGMAS*uncertainty (and 1 outside the
+    groups)
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+import time
+
+import numpy as np
+import openmc.data
+
+
+def flat_multiplier(value):
+    return lambda E: np.full_like(E, value)
+
+
+def tabulated_multiplier(filename):
+    x, y = np.loadtxt(filename, unpack=True)
+    return lambda E: np.interp(E, x, y)
+
+
+def uncertainty_multiplier(filename, sigmas):
+    """Multiplier of 1 + sigmas*uncertainty in each group and one outside
+
+    Each line of the file gives the lower bound of a group and its relative
+    uncertainty; the bound on the last line is the upper bound of the last
+    group.
+
+    """
+    bounds, unc = np.loadtxt(filename, unpack=True)
+    return group_multiplier(bounds, 1 + sigmas*unc[:-1])
+
+
+def group_multiplier(bounds, values):
+    """Multiplier constant over each group between bounds and one outside"""
+    def multiplier(E):
+        g = np.searchsorted(bounds, E, side='right') - 1
+        inside = (g >= 0) & (g < len(values))
+        return np.where(inside, values[np.clip(g, 0, len(values) - 1)], 1.0)
+    return multiplier
+
+
+def full_xs(xs, n):
+    """Return cross section values on the full energy grid of length n"""
+    y = np.zeros(n)
+    y[xs._threshold_idx:] = xs.y
+    return y
+
+
+def perturb(nuclide, multipliers):
+    """Apply multipliers to reactions of an openmc.data.IncidentNeutron
+
+    Parameters
+    ----------
+    nuclide : openmc.data.IncidentNeutron
+        Nuclide data, modified in place
+    multipliers : dict
+        Mapping of MT to a function of energy returning the multiplier
+
+    """
+    # Multipliers on redundant reactions are applied to their components
+    factors = {}
+    for mt, f in multipliers.items():
+        for component in nuclide.get_reaction_components(mt):
+            factors[component] = f
+
+    for strT, E in nuclide.energy.items():
+        n = E.size
+        for mt, f in factors.items():
+            xs = nuclide.reactions[mt].xs[strT]
+            xs.y = xs.y*f(xs.x)
+
+        # Recompute redundant reactions from their components
+        for mt, rx in nuclide.reactions.items():
+            if not rx.redundant or strT not in rx.xs:
+                continue
+            components = nuclide.get_reaction_components(mt)
+            total = sum(full_xs(nuclide.reactions[c].xs[strT], n)
+                        for c in components if c in nuclide.reactions)
+            xs = rx.xs[strT]
+            xs.y = total[xs._threshold_idx:]
+
+        # Unresolved resonance probability tables
+        urr = nuclide.urr.get(strT)
+        if urr is not None and not urr.multiply_smooth:
+            # Columns of the table are CDF, total, elastic, fission, capture
+            # and heating number
+            columns = {2: 2, 18: 3, 102: 4}
+            for mt, col in columns.items():
+                f = multipliers.get(mt, factors.get(mt))
+                if f is None:
+                    continue
+                m = f(urr.energy)[:, np.newaxis]
+                delta = urr.table[:, col, :]*(m - 1)
+                urr.table[:, col, :] += delta
+                urr.table[:, 1, :] += delta
+
+
+def write_library(library, entry, nuclide, directory):
+    """Write a nuclide and a copy of a library that points to it
+
+    Parameters
+    ----------
+    library : openmc.data.DataLibrary
+        Original library
+    entry : dict
+        Entry of the library for the nuclide being replaced
+    nuclide : openmc.data.IncidentNeutron
+        Nuclide data to write
+    directory : pathlib.Path
+        Directory to write the nuclide and cross_sections.xml to
+
+    Returns
+    -------
+    pathlib.Path
+        Path to the nuclide written
+
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    path = (directory / f'{nuclide.name}.h5').resolve()
+    path.unlink(missing_ok=True)
+    nuclide.export_to_hdf5(path)
+
+    # Write library with perturbed nuclide in place of the original
+    new_library = openmc.data.DataLibrary()
+    for lib in library.libraries:
+        if lib is entry:
+            new_library.register_file(path)
+        else:
+            new_library.libraries.append(lib)
+    new_library.export_to_xml(directory / 'cross_sections.xml')
+    return path
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('cross_sections', type=Path, help='cross_sections.xml of library')
+    parser.add_argument('nuclide', help='Name of nuclide to perturb, e.g. Pu239')
+    parser.add_argument('directory', type=Path, help='Directory for perturbed library')
+    parser.add_argument('-p', '--perturb', nargs=2, action='append', default=[],
+                        metavar=('MT', 'MULTIPLIER'),
+                        help='Multiply reaction MT by a number or by a tabulated '
+                        'multiplier read from a file')
+    parser.add_argument('-u', '--uncertainty', nargs=3, action='append', default=[],
+                        metavar=('MT', 'FILE', 'SIGMAS'),
+                        help='Multiply reaction MT by 1 + SIGMAS times the relative '
+                        'uncertainty in FILE')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+
+    multipliers = {}
+    for mt, value in args.perturb:
+        try:
+            multipliers[int(mt)] = flat_multiplier(float(value))
+        except ValueError:
+            multipliers[int(mt)] = tabulated_multiplier(value)
+    for mt, filename, sigmas in args.uncertainty:
+        multipliers[int(mt)] = uncertainty_multiplier(filename, float(sigmas))
+
+    # Find nuclide in library
+    library = openmc.data.DataLibrary.from_xml(args.cross_sections)
+    entry = library.get_by_material(args.nuclide)
+    if entry is None:
+        raise SystemExit(f'{args.nuclide} not found in {args.cross_sections}')
+
+    # Perturb and write nuclide
+    nuclide = openmc.data.IncidentNeutron.from_hdf5(entry['path'])
+    perturb(nuclide, multipliers)
+    path = write_library(library, entry, nuclide, args.directory)
+
+    print(f'Wrote {path} in {time.perf_counter() - t0:.1f} s')
@@ -0,0 +1,191 @@
+"""Campaign-level precision trigger on the average C/E of each category.
+
+A library is judged on the average C/E of each fuel/spectrum category (as in
+the summary of get_results.py), not on any single benchmark, yet every
+benchmark is normally run to the same k-effective standard deviation. The
+statistical uncertainty of a category average over n benchmarks is
+
+  sqrt(sum of sigma_i^2)/n
+
+so the precision asked of individual benchmarks can be relaxed by about
+sqrt(n) while the average still meets a target. Since benchmarks differ in
+how much transport time a given precision costs, the target is shared out
+so as to minimize the total time: for a benchmark whose variance times
+transport time is a_i, the variance it is run to is proportional to
+sqrt(a_i). Benchmarks that are expensive to converge are thus given more
+particles but a looser threshold than cheap ones.
+
+As results come in, the budget of each category is recomputed from the
+standard deviations actually reached, and the thresholds of benchmarks not
+yet started are reallocated; once the finished benchmarks of a category
+leave room to spare, the rest of the category runs to the loosest threshold
+allowed. Benchmarks are never dropped, since that would change the averages
+being judged. The C/E uncertainty is taken as that of k-effective, model
+values being close to one.
+"""
+
+import math
+import os
+import statistics
+
+from tabulate import tabulate
+
+from results import benchmark_name, category, read_results, model_keff
+from scaling import read_timing
+
+# Tightest threshold a benchmark is asked to run to
+MIN_THRESHOLD = 1e-4
+
+
+def read_costs(paths):
+    """Variance of k-effective times transport time of each benchmark
+
+    Parameters
+    ----------
+    paths : Iterable of pathlib.Path
+        Campaign directories with results and timing files, or timing files
+        next to their results files
+
+    Returns
+    -------
+    dict
+        Mapping of benchmark path to the average variance times transport
+        time (wall time for runs recorded without it) in s
+
+    """
+    costs = {}
+    for path in paths:
+        directory = path if path.is_dir() else path.parent
+        filenames = [directory / 'results']
+        if not filenames[0].exists():
+            filenames = sorted(directory.glob('results.*'))
+        results = {}
+        for filename in filenames:
+            results.update(read_results(filename))
+
+        for benchmark, records in read_timing([path]).items():
+            if benchmark not in results:
+                continue
+            seconds = statistics.mean(r[5] if len(r) >= 6 else r[0] for r in records)
+            costs.setdefault(benchmark, []).append(results[benchmark][1]**2*seconds)
+    return {benchmark: statistics.mean(c) for benchmark, c in costs.items()}
+
+
+def read_thresholds(filename):
+    """Read the k-effective threshold of each benchmark from a file"""
+    thresholds = {}
+    with open(filename, 'r') as fh:
+        for line in fh:
+            words = line.split()
+            if len(words) >= 2:
+                thresholds[words[0]] = float(words[1])
+    return thresholds
+
+
+class CampaignTrigger:
+    """Thresholds of benchmarks meeting a precision target for each category
+
+    Parameters
+    ----------
+    benchmarks : list of str
+        Paths of the benchmarks in the campaign
+    target : float
+        Standard deviation of each category's average C/E to reach in pcm
+    costs : dict
+        Variance times transport time of benchmarks, as from read_costs.
+        Benchmarks without one are given the median.
+    max_threshold : float
+        Loosest threshold any benchmark is run to
+
+    """
+    def __init__(self, benchmarks, target, costs=None, max_threshold=0.005):
+        self.benchmarks = list(benchmarks)
+        self.target = target
+        self.max_threshold = max_threshold
+        self.categories = {}
+        for benchmark in self.benchmarks:
+            self.categories.setdefault(category(benchmark), []).append(benchmark)
+
+        costs = costs or {}
+        known = [costs[b] for b in self.benchmarks if b in costs]
+        default = statistics.median(known) if known else 1.
+        self.costs = {b: costs.get(b, default) for b in self.benchmarks}
+        self.results = {}
+        self.thresholds = {}
+        self.allocate()
+
+    def allocate(self):
+        """Share out the variance left in each category among the benchmarks
+        without results"""
+        for members in self.categories.values():
+            budget = (len(members)*self.target*1e-5)**2
+            budget -= sum(self.results[b][1]**2 for b in members if b in self.results)
+            remaining = [b for b in members if b not in self.results]
+            if not remaining:
+                continue
+            weights = {b: math.sqrt(self.costs[b]) for b in remaining}
+            scale = max(budget, 0.)/sum(weights.values())
+            for b in remaining:
+                threshold = math.sqrt(scale*weights[b])
+                self.thresholds[b] = min(max(threshold, MIN_THRESHOLD), self.max_threshold)
+
+    def update(self, results):
+        """Reallocate thresholds given the results of finished benchmarks
+
+        Parameters
+        ----------
+        results : dict
+            Mapping of benchmark path to k-effective and its standard
+            deviation, as from results.read_results
+
+        """
+        self.results = {b: r for b, r in results.items() if b in self.costs}
+        self.allocate()
+
+    def write(self, filename):
+        """Write the thresholds, replacing the file at once so that tasks
+        reading it never see it partly written"""
+        temporary = f'{filename}.new'
+        with open(temporary, 'w') as fh:
+            for benchmark in self.benchmarks:
+                fh.write(f'{benchmark} {self.thresholds[benchmark]:.6g}\n')
+        os.replace(temporary, filename)
+
+    def statistics(self):
+        """Running average C/E deviation and its standard deviation in pcm,
+        and the number of finished benchmarks, of each category"""
+        stats = {}
+        for name, members in sorted(self.categories.items()):
+            finished = [b for b in members if b in self.results]
+            deviations = []
+            for b in finished:
+                model = model_keff.get(benchmark_name(b))
+                if model is not None:
+                    deviations.append((self.results[b][0]/model[0] - 1)*1e5)
+            mean = statistics.mean(deviations) if deviations else None
+            variance = sum(self.results[b][1]**2 for b in finished)
+            stdev = math.sqrt(variance)/len(finished)*1e5 if finished else None
+            stats[name] = (len(finished), len(members), mean, stdev)
+        return stats
+
+    def met(self, stdev):
+        """Whether a category standard deviation meets the target, allowing
+        for thresholds being rounded when written"""
+        return stdev is not None and stdev <= self.target*(1 + 1e-5)
+
+    def satisfied(self):
+        """Whether every category has all its results and meets the target"""
+        return all(n == total and self.met(stdev)
+                   for n, total, _, stdev in self.statistics().values())
+
+    def summary(self):
+        """Table of the running category averages"""
+        rows = []
+        for name, (n, total, mean, stdev) in self.statistics().items():
+            rows.append([name, f'{n}/{total}',
+                         '-' if mean is None else f'{mean:.0f}',
+                         '-' if stdev is None else f'{stdev:.1f}',
+                         'yes' if self.met(stdev) else 'no'])
+        return tabulate(rows, headers=['Category', 'Finished', 'Mean C/E - 1 (pcm)',
+                                       'Std. dev. (pcm)', 'Target met'],
+                        tablefmt='grid', disable_numparse=True)
@@ -0,0 +1,131 @@
+"""Functions for reading results files produced by a benchmark campaign.
+
+Both run-benchmarks and run_benchmarks.py append one line per benchmark to a
+file named 'results' in the campaign directory. Each line holds the path of
+the benchmark (as given in the benchmark list) followed by the mean and
+standard deviation of k-effective and, optionally, other quantities.
+run_benchmarks.py also writes a file named 'batches' with the k-effective of
+each active batch, which is used to compare campaigns run with the same seed.
+"""
+
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+try:
+    from icsbep.icsbep import model_keff
+except ImportError:
+    model_keff = {}
+
+
+def benchmark_name(path):
+    """Convert a path from a benchmark list to an ICSBEP model/case name.
+
+    For example, 'icsbep/pu-met-fast-001/openmc' becomes 'pu-met-fast-001' and
+    'icsbep/leu-comp-therm-008/openmc/case-1' becomes
+    'leu-comp-therm-008/case-1'.
+
+    """
+    if '/' not in path:
+        return path
+    words = path.split('/')
+    model = words[1]
+    if len(words) >= 4:
+        return model + '/' + words[3]
+    else:
+        return model
+
+
+def category(name):
+    """Return the fuel/spectrum category of a benchmark, e.g. 'pf' for
+    pu-met-fast-001.
+
+    """
+    model = benchmark_name(name).split('/')[0].split('-')
+    return model[0][0] + model[2][0]
+
+
+def read_results(filename):
+    """Read a campaign results file.
+
+    Returns an ordered dictionary mapping the path of each benchmark to a
+    (keff, stdev) tuple. Benchmarks whose run did not produce a k-effective
+    are skipped.
+
+    """
+    results = OrderedDict()
+    with open(filename, 'r') as fh:
+        for line in fh:
+            words = line.split()
+            if len(words) < 3:
+                continue
+            results[words[0]] = (float(words[1]), float(words[2]))
+    return results
+
+
+def read_batches(filename):
+    """Read the k-effective of each active batch from a campaign.
+
+    Returns an ordered dictionary mapping the path of each benchmark to an
+    array of batch k-effective values.
+
+    """
+    batches = OrderedDict()
+    with open(filename, 'r') as fh:
+        for line in fh:
+            words = line.split()
+            if len(words) < 2:
+                continue
+            batches[words[0]] = np.array([float(k) for k in words[1:]])
+    return batches
+
+
+def paired_difference(k0, k1):
+    """Difference in k-effective between two runs with the same seed.
+
+    Batches of runs that share a seed and settings see the same random
+    numbers, so their k-effective values are positively correlated and the
+    variance of the difference is reduced by twice their covariance.
+
+    Parameters
+    ----------
+    k0, k1 : numpy.ndarray
+        k-effective of each active batch of the baseline and other run
+
+    Returns
+    -------
+    diff : float
+        Mean difference k1 - k0
+    stdev : float
+        Standard deviation of the mean difference
+    correlation : float
+        Correlation coefficient of the batch k-effective values
+
+    """
+    if len(k0) != len(k1):
+        raise ValueError(f'Runs have different numbers of batches '
+                         f'({len(k0)} and {len(k1)})')
+    cov = np.cov(k0, k1)
+    variance = (cov[0, 0] + cov[1, 1] - 2*cov[0, 1])/len(k0)
+    correlation = cov[0, 1]/np.sqrt(cov[0, 0]*cov[1, 1])
+    return np.mean(k1 - k0), np.sqrt(max(variance, 0.)), correlation
+
+
+def calculated_over_experimental(results):
+    """Return C/E and its uncertainty for each benchmark with a model value"""
+    coe = OrderedDict()
+    for path, (keff, stdev) in results.items():
+        name = benchmark_name(path)
+        if name not in model_keff:
+            print(f'Warning: No benchmark value for {name}')
+            continue
+        coe[path] = (keff/model_keff[name][0], stdev/model_keff[name][0])
+    return coe
+
+
+def group_by_category(paths):
+    """Group benchmark paths by their fuel/spectrum category"""
+    groups = defaultdict(list)
+    for path in paths:
+        groups[category(path)].append(path)
+    return groups
@@ -1,19 +1,19 @@
 from argparse import ArgumentParser
+from contextlib import contextmanager
+import ctypes
 import os
 from pathlib import Path
+import re
 from subprocess import run, STDOUT, PIPE
+import sys
 import time
 
+import numpy as np
 import openmc
+from openmc.exceptions import OpenMCError
 
-current_time = time.strftime("%Y-%m-%d-%H%M%S")
-
-parser = ArgumentParser()
-parser.add_argument('--directory', default=current_time)
-parser.add_argument("--cross_sections", type=Path)
-parser.add_argument("--threshold", type=float, default=0.001)
-parser.add_argument("--mpi_args", default="")
-args = parser.parse_args()
+from precision import read_thresholds
+from scaling import read_timing
 
 benchmark_list = "benchmarks/lists/pst-short"
 particles = 10000
@@ -21,40 +21,28 @@ max_batches = 10000
 batches = 150
 inactive = 50
 code = "openmc"
-basedir = Path(args.directory).resolve()
-mpi_args = args.mpi_args.split()
-
-# Change to correct directory
-basedir.mkdir(exist_ok=True)
-os.chdir(basedir)
-
-# Remove previous results if they exist
-Path(basedir / 'results').unlink(missing_ok=True)
 
-# Get copy of benchmarks repository and switch to nndc branch
-run(["git", "clone", "https://github.com/mit-crpg/benchmarks.git"])
 
-# Get benchmark directories
-with open(benchmark_list, 'r') as fh:
-    benchmarks = [Path(line.strip()) for line in fh]
+def prepare(threshold, seed=None, n_batches=batches):
+    """Modify settings.xml in the current benchmark directory.
 
-# Set cross sections
-env = os.environ.copy()
-if args.cross_sections is not None:
-    env["OPENMC_CROSS_SECTIONS"] = args.cross_sections
-
-for i, benchmark in enumerate(benchmarks):
-    print(f"{i + 1} {benchmark} ", end="")
-    os.chdir(basedir / "benchmarks" / benchmark)
+    With a seed, every run of the benchmark uses the same random number
+    sequence and a fixed number of batches, so that runs with different
+    libraries are correlated batch by batch. Triggers are not used in that
+    case since they would let the number of batches differ between runs.
 
-    # Modify settings based on inputs
+    """
     settings = openmc.Settings.from_xml("settings.xml")
     settings.particles = particles
-    settings.batches = 150
-    settings.inactive = 50
-    settings.trigger_max_batches = max_batches
-    settings.trigger_active = True
-    settings.keff_trigger = {'type': 'std_dev', 'threshold': args.threshold}
+    settings.batches = n_batches
+    settings.inactive = inactive
+    if seed is None:
+        settings.trigger_max_batches = max_batches
+        settings.trigger_active = True
+        settings.keff_trigger = {'type': 'std_dev', 'threshold': threshold}
+    else:
+        settings.seed = seed
+        settings.trigger_active = False
     settings.export_to_xml()
 
     # Re-generate materials if Python script is present
@@ -62,35 +50,383 @@ for i, benchmark in enumerate(benchmarks):
     if genmat_script.is_file():
         run(["python", "generate_materials.py"])
 
+
+def last_statepoint():
+    """Return the most recently written statepoint in the current directory"""
+    t_last = 0
+    last = None
+    for sp in Path().glob('statepoint.*.h5'):
+        mtime = sp.stat().st_mtime
+        if mtime >= t_last:  # >= allows for poor clock resolution
+            t_last = mtime
+            last = sp
+    return last
+
+
+def run_benchmark(benchmark, basedir, env, mpi_args, threshold, seed=None,
+                  n_batches=batches, label="", suffix="", threads=None):
+    """Run a single benchmark and append its k-effective to the results files
+
+    Besides the results and batches files, the wall time of the run is
+    appended to a timing file for use in sizing later runs, along with the
+    number of MPI processes and threads, the number of particles simulated,
+    and the initialization and transport times reported by OpenMC.
+
+    Parameters
+    ----------
+    benchmark : pathlib.Path
+        Path of the benchmark relative to the benchmarks repository
+    basedir : pathlib.Path
+        Campaign directory holding the benchmarks repository and results
+    env : dict
+        Environment for OpenMC
+    mpi_args : list of str
+        MPI launcher and arguments to run OpenMC with
+    threshold : float
+        Standard deviation of k-effective to run to
+    seed : int, optional
+        Random number seed for correlated runs
+    n_batches : int
+        Number of batches when a seed is given
+    label : str
+        Suffix of the OpenMC output file
+    suffix : str
+        Suffix of the results, batches and timing files, so that several
+        tasks can run benchmarks of one campaign at the same time
+    threads : int, optional
+        Number of OpenMP threads per MPI process
+
+    Returns
+    -------
+    uncertainties.UFloat or None
+        Combined k-effective, or None if OpenMC did not produce a statepoint
+
+    """
+    os.chdir(basedir / "benchmarks" / benchmark)
+    prepare(threshold, seed, n_batches)
+
     # Run OpenMC
+    start = time.perf_counter()
+    threads_args = [] if threads is None else ["-s", str(threads)]
     result = run(
-        mpi_args + ["openmc"],
+        mpi_args + ["openmc"] + threads_args,
         env=env,
         stdout=PIPE,
         stderr=STDOUT,
         text=True,
     )
+    elapsed = time.perf_counter() - start
 
     # Write output to file
-    with open(f"output_{current_time}", "w") as fh:
+    with open(f"output_{label}", "w") as fh:
         fh.write(result.stdout)
 
-    # Determine last statepoint
-    t_last = 0
-    last_statepoint = None
-    for sp in Path().glob('statepoint.*.h5'):
-        mtime = sp.stat().st_mtime
-        if mtime >= t_last:  # >= allows for poor clock resolution
-            t_last = mtime
-            last_statepoint = sp
+    return record(benchmark, basedir, result.stdout, elapsed, suffix)
 
-    # Write to results file
-    if last_statepoint is not None:
-        with openmc.StatePoint(last_statepoint) as sp:
-            keff = sp.k_combined
 
-        print(f"{keff.n:.5f} ± {keff.s:.5f}")
-        with open(basedir / "results", "a") as results:
-            results.write(f"{benchmark} {keff.nominal_value} {keff.std_dev}\n")
-    else:
-        print("")
+def record(benchmark, basedir, output, elapsed, suffix=""):
+    """Append the results of a finished run in the current directory to the
+    results, batches and timing files
+
+    Returns the combined k-effective, or None if OpenMC did not produce a
+    statepoint.
+
+    """
+    sp_path = last_statepoint()
+    if sp_path is None:
+        return None
+
+    with openmc.StatePoint(sp_path) as sp:
+        keff = sp.k_combined
+        k_batches = sp.k_generation[sp.n_inactive:]
+        particles = sp.n_particles*sp.current_batch
+        initialization = sp.runtime['total initialization']
+        transport = sp.runtime['transport']
+
+    # Parallelism as reported in the header of the OpenMC output
+    sizes = []
+    for name in ("MPI Processes", "OpenMP Threads"):
+        match = re.search(rf"{name}\s*\|\s*(\d+)", output)
+        sizes.append(int(match.group(1)) if match else 1)
+    ranks, n_threads = sizes
+
+    # Write to results file, and write k-effective of each active batch for
+    # paired comparisons between campaigns
+    with open(basedir / f"results{suffix}", "a") as results:
+        results.write(f"{benchmark} {keff.nominal_value} {keff.std_dev}\n")
+    with open(basedir / f"batches{suffix}", "a") as fh:
+        fh.write(f"{benchmark} " + " ".join(f"{k:.8f}" for k in k_batches) + "\n")
+    with open(basedir / f"timing{suffix}", "a") as fh:
+        fh.write(f"{benchmark} {elapsed:.1f} {ranks} {n_threads} {particles} "
+                 f"{initialization:.3f} {transport:.3f}\n")
+    return keff
+
+
+@contextmanager
+def redirect_output(filename):
+    """Send everything written to standard output and error, including by
+    the OpenMC shared library, to a file"""
+    # The C library buffers output of its own, which has to reach the file
+    # before the descriptors are switched back
+    libc = ctypes.CDLL(None)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    libc.fflush(None)
+    saved = [os.dup(1), os.dup(2)]
+    with open(filename, "w") as fh:
+        os.dup2(fh.fileno(), 1)
+        os.dup2(fh.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            libc.fflush(None)
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            for fd in saved:
+                os.close(fd)
+
+
+def benchmark_nuclides(directory):
+    """Names of the nuclides in the materials of a benchmark"""
+    materials = openmc.Materials.from_xml(str(directory / "materials.xml"))
+    return {nuc for m in materials for nuc in m.get_nuclides()}
+
+
+class Worker:
+    """Run successive benchmarks from this process through openmc.lib
+
+    Starting OpenMC for each benchmark repeats the process and library
+    startup. A worker loads the shared library once and runs each benchmark
+    of a task in a child forked from this process, in an order that puts
+    benchmarks sharing nuclides next to each other so that their cross
+    section files are still in the page cache when read again. OpenMC frees
+    nuclide data when finalized and cannot swap the model of an initialized
+    run, so every benchmark still reads its nuclides from the library.
+
+    Running each benchmark in a child keeps failures isolated as they are
+    for separate OpenMC processes: a fatal error in OpenMC exits the child,
+    and the worker goes on with the next benchmark.
+
+    Parameters
+    ----------
+    basedir : pathlib.Path
+        Campaign directory holding the benchmarks repository and results
+    threshold : float
+        Standard deviation of k-effective to run to
+    seed : int, optional
+        Random number seed for correlated runs
+    n_batches : int
+        Number of batches when a seed is given
+    label : str
+        Suffix of the OpenMC output files
+    suffix : str
+        Suffix of the results, batches and timing files
+
+    """
+    def __init__(self, basedir, threshold, seed=None, n_batches=batches, label="",
+                 suffix=""):
+        # The shared library is only loaded when running in process
+        import openmc.lib
+        self.lib = openmc.lib
+        self.basedir = basedir
+        self.threshold = threshold
+        self.seed = seed
+        self.n_batches = n_batches
+        self.label = label
+        self.suffix = suffix
+        # Initialization time of each benchmark run
+        self.initialization = {}
+
+    def order(self, benchmarks):
+        """Order benchmarks so that each shares the most nuclides with the
+        ones run before it"""
+        nuclides = {}
+        for benchmark, *size in benchmarks:
+            try:
+                nuclides[benchmark] = benchmark_nuclides(
+                    self.basedir / "benchmarks" / benchmark)
+            except (OSError, ValueError):
+                nuclides[benchmark] = set()
+
+        remaining = list(benchmarks)
+        ordered = []
+        seen = set()
+        while remaining:
+            best = max(remaining, key=lambda b: len(nuclides[b[0]] & seen))
+            remaining.remove(best)
+            ordered.append(best)
+            seen |= nuclides[best[0]]
+        return ordered
+
+    def _simulate(self, args, output):
+        """Run OpenMC in a forked child, returning its exit status"""
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                with redirect_output(output):
+                    try:
+                        self.lib.init(args)
+                        self.lib.run()
+                        status = 0
+                    except OpenMCError as e:
+                        print(e)
+                    finally:
+                        self.lib.finalize()
+            finally:
+                os._exit(status)
+        return os.waitpid(pid, 0)[1]
+
+    def run(self, benchmark, threads=None, threshold=None):
+        """Run a single benchmark and append its k-effective to the results
+        files, as run_benchmark does"""
+        os.chdir(self.basedir / "benchmarks" / benchmark)
+        if threshold is None:
+            threshold = self.threshold
+        prepare(threshold, self.seed, self.n_batches)
+
+        args = [] if threads is None else ["-s", str(threads)]
+        output = f"output_{self.label}"
+        start = time.perf_counter()
+        status = self._simulate(args, output)
+        elapsed = time.perf_counter() - start
+        if status != 0:
+            return None
+
+        with open(output, "r") as fh:
+            keff = record(benchmark, self.basedir, fh.read(), elapsed, self.suffix)
+        sp_path = last_statepoint()
+        if keff is not None and sp_path is not None:
+            with openmc.StatePoint(sp_path) as sp:
+                self.initialization[str(benchmark)] = sp.runtime['total initialization']
+        return keff
+
+    def report(self, compare=()):
+        """Print the initialization time of the benchmarks run
+
+        Parameters
+        ----------
+        compare : Iterable of pathlib.Path
+            Timing files or campaign directories of runs with a separate
+            OpenMC process for each benchmark, whose initialization times
+            are shown for the same benchmarks
+
+        """
+        if not self.initialization:
+            return
+        print(f"Initialized {len(self.initialization)} benchmarks in worker mode "
+              f"in {sum(self.initialization.values()):.1f} s")
+
+        # Only records with an initialization time can be compared
+        previous = {}
+        for benchmark, records in read_timing(compare).items():
+            times = [r[4] for r in records if len(r) >= 6]
+            if benchmark in self.initialization and times:
+                previous[benchmark] = np.mean(times)
+        if previous:
+            worker = sum(self.initialization[b] for b in previous)
+            print(f"Initialized {len(previous)} of them in {worker:.1f} s in worker "
+                  f"mode and {sum(previous.values()):.1f} s as separate processes")
+
+
+def main():
+    current_time = time.strftime("%Y-%m-%d-%H%M%S")
+
+    parser = ArgumentParser()
+    parser.add_argument('--directory', default=current_time)
+    parser.add_argument("--cross_sections", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.001)
+    parser.add_argument("--mpi_args", default="",
+                        help="MPI launcher and arguments; for benchmarks listed with "
+                        "a number of processes and threads, {ranks} and {threads} "
+                        "are replaced by them")
+    parser.add_argument("--seed", type=int,
+                        help="Random number seed; use the same seed for the baseline "
+                        "and perturbed libraries to get correlated runs")
+    parser.add_argument("--batches", type=int, default=batches,
+                        help="Number of batches for runs with a seed")
+    parser.add_argument("--list", default=benchmark_list,
+                        help="File listing the benchmarks to run, optionally each "
+                        "followed by the number of MPI processes and threads")
+    parser.add_argument("--task", default="",
+                        help="Name of this task when a campaign is split into "
+                        "tasks; its results are written to files ending in "
+                        "'.TASK' and gathered by submit.py")
+    parser.add_argument("--thresholds", type=Path,
+                        help="File giving the threshold of each benchmark, read "
+                        "again before each one so that it can be changed while "
+                        "running (see precision.py)")
+    parser.add_argument("--worker", action="store_true",
+                        help="Run all benchmarks in this process through openmc.lib "
+                        "rather than starting OpenMC for each one")
+    parser.add_argument("--compare-timing", type=Path, nargs="+", default=[],
+                        help="Timing files or campaign directories of runs of the "
+                        "same benchmarks as separate OpenMC processes, whose "
+                        "initialization times are reported next to those in "
+                        "worker mode")
+    args = parser.parse_args()
+    suffix = f".{args.task}" if args.task else ""
+    if args.worker and args.mpi_args:
+        parser.error("--worker runs OpenMC in this process; start it under the MPI "
+                     "launcher instead of giving --mpi_args")
+
+    basedir = Path(args.directory).resolve()
+
+    # Change to correct directory
+    basedir.mkdir(exist_ok=True)
+    os.chdir(basedir)
+
+    # Remove previous results if they exist
+    for name in ('results', 'batches', 'timing'):
+        Path(basedir / f'{name}{suffix}').unlink(missing_ok=True)
+
+    # Get copy of benchmarks repository and switch to nndc branch
+    if not (basedir / "benchmarks").is_dir():
+        run(["git", "clone", "https://github.com/mit-crpg/benchmarks.git"])
+
+    # Get benchmark directories
+    with open(args.list, 'r') as fh:
+        benchmarks = [line.split() for line in fh if line.strip()]
+
+    # Set cross sections
+    env = os.environ.copy()
+    if args.cross_sections is not None:
+        env["OPENMC_CROSS_SECTIONS"] = str(args.cross_sections)
+
+    worker = None
+    if args.worker:
+        os.environ.update(env)
+        worker = Worker(basedir, args.threshold, args.seed, args.batches,
+                        current_time, suffix)
+        benchmarks = worker.order(benchmarks)
+
+    for i, (benchmark, *size) in enumerate(benchmarks):
+        benchmark = Path(benchmark)
+        mpi_args = args.mpi_args
+        threads = None
+        if size:
+            ranks, threads = map(int, size)
+            mpi_args = mpi_args.format(ranks=ranks, threads=threads)
+        threshold = args.threshold
+        if args.thresholds is not None:
+            threshold = read_thresholds(args.thresholds).get(str(benchmark), threshold)
+        print(f"{i + 1} {benchmark} ", end="", flush=True)
+        if worker is not None:
+            keff = worker.run(benchmark, threads, threshold)
+        else:
+            keff = run_benchmark(benchmark, basedir, env, mpi_args.split(),
+                                 threshold, args.seed, args.batches,
+                                 current_time, suffix, threads)
+        if keff is not None:
+            print(f"{keff.n:.5f} ± {keff.s:.5f}")
+        else:
+            print("")
+
+    if worker is not None:
+        worker.report(args.compare_timing)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Choose the MPI processes and threads to run each benchmark with.
+
+Every rank of an OpenMC run reads the whole cross section library, so small
+benchmarks spend most of a large allocation initializing. The timing files
+written by run_benchmarks.py record, for each run, its wall time, the numbers
+of processes and threads, the particles simulated, and the initialization and
+transport times. From these a model of each benchmark is fit:
+
+  - initialization time, growing linearly with log2(processes) when runs
+    with different numbers of processes are available and constant otherwise
+  - transport cost in core-seconds per particle, growing linearly with the
+    number of cores to account for parallel efficiency below one, or constant
+    (perfect scaling) when only one core count has been run
+  - any remaining wall time (startup, statepoint writing) as a constant
+
+The size chosen for a benchmark is the one using the fewest core-seconds
+among those finishing within a time limit, so that cores are added only when
+a benchmark would otherwise take too long.
+"""
+
+import math
+import statistics
+
+import numpy as np
+
+
+def read_timing(paths):
+    """Read timing records of benchmark runs
+
+    Parameters
+    ----------
+    paths : Iterable of pathlib.Path
+        Timing files written by run_benchmarks.py, or campaign directories
+        holding them
+
+    Returns
+    -------
+    dict
+        Mapping of benchmark path to a list of records, each a list of the
+        wall time followed (for runs recorded with them) by the numbers of
+        processes, threads and particles, and the initialization and
+        transport times
+
+    """
+    records = {}
+    for path in paths:
+        files = [path]
+        if path.is_dir():
+            # Per-task files are only read when they were never gathered
+            files = [path / 'timing']
+            if not files[0].exists():
+                files = sorted(path.glob('timing.*'))
+        for filename in files:
+            with open(filename, 'r') as fh:
+                for line in fh:
+                    words = line.split()
+                    if len(words) >= 2:
+                        records.setdefault(words[0], []).append(
+                            [float(w) for w in words[1:]])
+    return records
+
+
+def candidates(max_ranks, threads_per_rank):
+    """Sizes to consider: one process with 1, 2, 4, ... threads, then 2, 4,
+    ... processes each with threads_per_rank threads"""
+    sizes = []
+    threads = 1
+    while threads < threads_per_rank:
+        sizes.append((1, threads))
+        threads *= 2
+    ranks = 1
+    while ranks <= max_ranks:
+        sizes.append((ranks, threads_per_rank))
+        ranks *= 2
+    return sizes
+
+
+def _fit(x, y):
+    """Coefficients of a least-squares line, or a constant for a single x"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(set(x)) < 2:
+        return np.array([y.mean(), 0.])
+    return np.linalg.lstsq(np.column_stack([np.ones_like(x), x]), y, rcond=None)[0]
+
+
+class ScalingModel:
+    """Wall time of benchmarks as a function of processes and threads
+
+    Parameters
+    ----------
+    records : dict
+        Timing records of each benchmark, as returned by read_timing
+
+    """
+    def __init__(self, records):
+        self.models = {}
+        for benchmark, runs in records.items():
+            runs = [r for r in runs if len(r) >= 6 and r[3] > 0]
+            if not runs:
+                continue
+            wall, ranks, threads, particles, init, transport = np.array(runs)[:, :6].T
+            cores = ranks*threads
+            per_particle = transport*cores/particles
+            self.models[benchmark] = {
+                'initialization': _fit(np.log2(ranks), init),
+                'cost': _fit(cores - 1, per_particle),
+                'minimum cost': per_particle.min(),
+                'particles': particles.mean(),
+                'other': max(statistics.mean(wall - init - transport), 0.),
+            }
+
+    @classmethod
+    def from_history(cls, paths):
+        return cls(read_timing(paths))
+
+    def __contains__(self, benchmark):
+        return benchmark in self.models
+
+    def predict(self, benchmark, ranks, threads):
+        """Predicted wall time in seconds of a benchmark run"""
+        model = self.models[benchmark]
+        cores = ranks*threads
+        init = max(model['initialization'] @ [1., math.log2(ranks)], 0.)
+        cost = max(model['cost'] @ [1., cores - 1], model['minimum cost'])
+        return init + model['particles']*cost/cores + model['other']
+
+    def choose(self, benchmark, sizes, limit):
+        """Choose the size to run a benchmark with
+
+        Parameters
+        ----------
+        benchmark : str
+            Benchmark path
+        sizes : Iterable of tuple
+            (processes, threads) to choose from
+        limit : float
+            Longest acceptable wall time in seconds
+
+        Returns
+        -------
+        tuple
+            Processes, threads and predicted wall time. The size using the
+            fewest core-seconds within the limit is chosen, or the fastest if
+            none is within it.
+
+        """
+        predictions = [(r, t, self.predict(benchmark, r, t)) for r, t in sizes]
+        within = [p for p in predictions if p[2] <= limit]
+        if within:
+            return min(within, key=lambda p: p[0]*p[1]*p[2])
+        return min(predictions, key=lambda p: p[2])
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+
+"""Run a benchmark campaign as packed job-array tasks.
+
+Rather than holding one large allocation until the longest benchmark
+finishes, the benchmark list is split into tasks of about equal runtime,
+using wall times recorded by run_benchmarks.py in earlier campaigns (the
+'timing' files of their directories). Benchmarks are packed longest first
+into the first task with room for them, so that each task fits in a target
+walltime. Each task runs run_benchmarks.py on its share of the list and
+writes its own results, which are gathered into the campaign's results,
+batches and timing files as tasks finish.
+
+With --size, benchmarks with recorded scaling data are each given the
+numbers of MPI processes and threads that use the fewest core-seconds while
+finishing within the task time (see scaling.py); the others run on --nodes
+nodes with the default launcher as before. Benchmarks of the same size are
+packed together and each size is submitted as its own job array, requesting
+only the cores it needs, so small benchmarks no longer hold whole nodes while
+every rank loads cross sections. With --worker, each task runs its
+benchmarks from a single process through openmc.lib (see run_benchmarks.py).
+
+With --category-target, benchmarks are not each run to --threshold; instead
+their thresholds are chosen so that the average C/E of every fuel/spectrum
+category reaches the target standard deviation at the least transport time,
+and are reallocated as results are gathered (see precision.py).
+
+Tasks are submitted as Slurm or PBS (Torque) job arrays, or run by a local
+process pool that stands in for the scheduler, e.g. to try a packing or to run
+a campaign on a workstation:
+
+  submit.py 2021-03-01 --cross_sections lib/cross_sections.xml \
+      --history 2021-02-01 2021-02-15 --task-time 3600 --backend slurm --size
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import math
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import time
+
+from precision import CampaignTrigger, read_costs
+from results import read_results
+from scaling import ScalingModel, candidates, read_timing
+
+# Benchmark list used by default, as in run_benchmarks.py (not imported from
+# there so that submitting does not need OpenMC)
+BENCHMARK_LIST = 'benchmarks/lists/pst-short'
+
+# Wall time assumed for benchmarks without any recorded runs when there is no
+# history at all
+DEFAULT_RUNTIME = 600.
+
+# Launchers used for OpenMC within a task by default
+MPI_ARGS = {
+    'local': '',
+    'slurm': 'srun -N $SLURM_JOB_NUM_NODES -n $((SLURM_JOB_NUM_NODES * 2)) --cpu-bind=socket',
+    'pbs': 'mpiexec -rmk pbs',
+}
+
+# Launchers for benchmarks run with a chosen number of processes and threads
+SIZED_MPI_ARGS = {
+    'local': 'mpiexec -n {ranks}',
+    'slurm': 'srun -n {ranks} -c {threads} --cpu-bind=cores',
+    'pbs': 'mpiexec -n {ranks}',
+}
+
+
+def read_runtimes(paths):
+    """Average recorded wall time of each benchmark
+
+    Parameters
+    ----------
+    paths : Iterable of pathlib.Path
+        Timing files written by run_benchmarks.py, or campaign directories
+        holding them
+
+    Returns
+    -------
+    dict
+        Mapping of benchmark path to wall time in seconds
+
+    """
+    return {benchmark: statistics.mean(r[0] for r in records)
+            for benchmark, records in read_timing(paths).items()}
+
+
+def read_list(filename):
+    """Read a benchmark list
+
+    Returns
+    -------
+    benchmarks : list of str
+        Paths of the benchmarks
+    sizes : dict
+        Numbers of MPI processes and threads of benchmarks listed with them
+
+    """
+    benchmarks = []
+    sizes = {}
+    with open(filename, 'r') as fh:
+        for line in fh:
+            words = line.split()
+            if not words:
+                continue
+            benchmarks.append(words[0])
+            if len(words) >= 3:
+                sizes[words[0]] = (int(words[1]), int(words[2]))
+    return benchmarks, sizes
+
+
+def pack(benchmarks, runtimes, capacity, default=None):
+    """Split benchmarks into tasks of at most a given runtime
+
+    Benchmarks are placed longest first into the first task with room for
+    them (first-fit decreasing). A benchmark longer than the capacity gets a
+    task of its own.
+
+    Parameters
+    ----------
+    benchmarks : list of str
+        Benchmark paths
+    runtimes : dict
+        Expected wall time of benchmarks in seconds
+    capacity : float
+        Target wall time of a task in seconds
+    default : float, optional
+        Wall time of benchmarks without a runtime; defaults to the median of
+        the known runtimes
+
+    Returns
+    -------
+    list of tuple
+        Benchmarks and expected wall time of each task, the longest first
+
+    """
+    if default is None:
+        known = [runtimes[b] for b in benchmarks if b in runtimes]
+        default = statistics.median(known) if known else DEFAULT_RUNTIME
+    expected = {b: runtimes.get(b, default) for b in benchmarks}
+
+    tasks = []
+    for benchmark in sorted(benchmarks, key=lambda b: -expected[b]):
+        for task in tasks:
+            if task[1] + expected[benchmark] <= capacity:
+                task[0].append(benchmark)
+                task[1] += expected[benchmark]
+                break
+        else:
+            tasks.append([[benchmark], expected[benchmark]])
+    return [(members, total) for members, total in tasks]
+
+
+def walltime(seconds):
+    """Format seconds as HH:MM:SS, rounded up to whole minutes"""
+    minutes = math.ceil(seconds/60)
+    return f'{minutes // 60:02d}:{minutes % 60:02d}:00'
+
+
+def run_task(script, task):
+    """Run one task of a job array locally"""
+    return subprocess.run(['bash', str(script), str(task)]).returncode
+
+
+class LocalExecutor:
+    """Run the tasks of a job array in a local process pool
+
+    Stands in for a batch scheduler: tasks are queued when submitted and run
+    as workers become free, and completed tasks are found the same way as for
+    a scheduler, from the files they leave behind.
+
+    """
+    array_variable = None
+
+    def __init__(self, processes=None):
+        self.executor = ProcessPoolExecutor(processes)
+        self.futures = []
+
+    def submit(self, script, first, last, walltime, size=None):
+        self.futures += [self.executor.submit(run_task, script, i)
+                         for i in range(first, last + 1)]
+
+    def active(self):
+        return not all(f.done() for f in self.futures)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+class SlurmBackend:
+    """Submit job arrays with sbatch"""
+    array_variable = 'SLURM_ARRAY_TASK_ID'
+
+    def __init__(self, nodes, options=()):
+        self.nodes = nodes
+        self.options = list(options)
+        self.jobs = []
+
+    def submit(self, script, first, last, walltime, size=None):
+        if size is None:
+            resources = [f'--nodes={self.nodes}']
+        else:
+            resources = [f'--ntasks={size[0]}', f'--cpus-per-task={size[1]}']
+        command = ['sbatch', '--parsable', f'--array={first}-{last}', f'--time={walltime}',
+                   '--job-name=openmc-benchmarks',
+                   f'--output={script.parent}/task-%a.out'] + resources + self.options
+        result = subprocess.run(command + [str(script.with_suffix('.array'))],
+                                check=True, stdout=subprocess.PIPE, text=True)
+        self.jobs.append(result.stdout.strip().split(';')[0])
+        print(f'Submitted job array {self.jobs[-1]}')
+
+    def active(self):
+        result = subprocess.run(['squeue', '-h', '-j', ','.join(self.jobs)],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return bool(result.stdout.strip())
+
+    def shutdown(self):
+        pass
+
+
+class PBSBackend:
+    """Submit job arrays with qsub (Torque)"""
+    array_variable = 'PBS_ARRAYID'
+
+    def __init__(self, nodes, options=(), cores_per_node=8):
+        self.nodes = nodes
+        self.options = list(options)
+        self.cores_per_node = cores_per_node
+        self.jobs = []
+
+    def submit(self, script, first, last, walltime, size=None):
+        if size is None:
+            nodes, ppn = self.nodes, self.cores_per_node
+        else:
+            cores = size[0]*size[1]
+            nodes = math.ceil(cores/self.cores_per_node)
+            ppn = math.ceil(cores/nodes)
+        command = ['qsub', '-t', f'{first}-{last}', '-l', f'nodes={nodes}:ppn={ppn}',
+                   '-l', f'walltime={walltime}', '-N', 'openmc-benchmarks',
+                   '-j', 'oe', '-o', str(script.parent)] + self.options
+        result = subprocess.run(command + [str(script.with_suffix('.array'))],
+                                check=True, stdout=subprocess.PIPE, text=True)
+        self.jobs.append(result.stdout.strip())
+        print(f'Submitted job array {self.jobs[-1]}')
+
+    def active(self):
+        # Finished subjobs stay listed for a while, in state C (Torque) or F
+        # or X (PBS Pro), so only those in other states count
+        for job in self.jobs:
+            result = subprocess.run(['qstat', '-t', job], stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, text=True)
+            for line in result.stdout.splitlines():
+                words = line.split()
+                if len(words) < 6 or words[0] == 'Job' or words[0].startswith('-'):
+                    continue
+                if words[4] not in ('C', 'F', 'X'):
+                    return True
+        return False
+
+    def shutdown(self):
+        pass
+
+
+def write_scripts(basedir, tasks, launchers, options, array_variable):
+    """Write the benchmark list of each task and the scripts that run them
+
+    Parameters
+    ----------
+    tasks : list of tuple
+        Benchmarks, expected wall time and size (processes and threads, or
+        None for the default launcher) of each task
+    launchers : dict
+        MPI launcher for tasks of each kind, keyed by whether they have a size
+    options : str
+        Other options of run_benchmarks.py
+    array_variable : str or None
+        Environment variable giving the task number in a job array
+
+    Returns
+    -------
+    dict
+        Path of the script running one task, given its number, for each kind
+        of task
+
+    """
+    taskdir = basedir / 'tasks'
+    taskdir.mkdir(exist_ok=True)
+    for i, (members, _, size) in enumerate(tasks):
+        fields = '' if size is None else f' {size[0]} {size[1]}'
+        (taskdir / f'task-{i}').write_text(''.join(f'{b}{fields}\n' for b in members))
+        (taskdir / f'done-{i}').unlink(missing_ok=True)
+
+    run_benchmarks = Path(__file__).resolve().parent / 'run_benchmarks.py'
+    scripts = {}
+    for sized, mpi_args in launchers.items():
+        script = taskdir / ('task-sized.sh' if sized else 'task.sh')
+        script.write_text(
+            '#!/bin/bash\n\n'
+            f'cd {basedir}\n'
+            f'{sys.executable} -u {run_benchmarks} --directory {basedir} '
+            f'--list {taskdir}/task-$1 --task $1 --mpi_args "{mpi_args}" {options}\n'
+            f'touch {taskdir}/done-$1\n')
+
+        # Schedulers give the task number in an environment variable
+        if array_variable is not None:
+            script.with_suffix('.array').write_text(
+                '#!/bin/bash\n\n'
+                f'bash {script} ${array_variable}\n')
+        scripts[sized] = script
+    return scripts
+
+
+def gather(basedir, benchmarks, tasks):
+    """Merge results of the finished tasks into the campaign's files"""
+    order = {b: i for i, b in enumerate(benchmarks)}
+    for name in ('results', 'batches', 'timing'):
+        lines = []
+        for i in tasks:
+            path = basedir / f'{name}.{i}'
+            if path.exists():
+                lines.extend(path.read_text().splitlines(keepends=True))
+        lines.sort(key=lambda line: order.get(line.split()[0], len(order)))
+        (basedir / name).write_text(''.join(lines))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('directory', type=Path, help='Campaign directory')
+    parser.add_argument('--cross_sections', type=Path, required=True)
+    parser.add_argument('--list', help='Benchmark list, relative to the campaign '
+                        f'directory (default: {BENCHMARK_LIST})', default=BENCHMARK_LIST)
+    parser.add_argument('--history', type=Path, nargs='*', default=[],
+                        help='Earlier campaign directories or timing files')
+    parser.add_argument('--task-time', type=float, default=4*3600,
+                        help='Target wall time of a task in seconds')
+    parser.add_argument('--margin', type=float, default=1.5,
+                        help='Factor on the expected time of a task for its walltime')
+    parser.add_argument('--backend', choices=('local', 'slurm', 'pbs'), default='local')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of tasks run at once by the local backend')
+    parser.add_argument('--nodes', type=int, default=1,
+                        help='Nodes per task for benchmarks run with the default launcher')
+    parser.add_argument('--size', action='store_true', help='Choose processes and '
+                        'threads for benchmarks with recorded scaling data')
+    parser.add_argument('--max-ranks', type=int, default=8,
+                        help='Largest number of MPI processes for a benchmark')
+    parser.add_argument('--threads-per-rank', type=int, default=8,
+                        help='Threads of each MPI process when using several')
+    parser.add_argument('--cores-per-node', type=int, default=8,
+                        help='Cores of a node, for PBS resource requests')
+    parser.add_argument('--scheduler-args', default='',
+                        help='Extra options for sbatch or qsub, e.g. "--account=X"')
+    parser.add_argument('--mpi_args', help='Launcher for OpenMC within a task '
+                        '(default depends on the backend)')
+    parser.add_argument('--sized_mpi_args', help='Launcher for benchmarks with a '
+                        'chosen size, with {ranks} and {threads} replaced by it '
+                        '(default depends on the backend)')
+    parser.add_argument('--worker', action='store_true', help='Run the benchmarks '
+                        'of each task in one process through openmc.lib (one MPI '
+                        'process per task)')
+    parser.add_argument('--threshold', type=float, default=0.001)
+    parser.add_argument('--category-target', type=float, help='Standard deviation '
+                        'in pcm of the average C/E of each category to run to')
+    parser.add_argument('--max-threshold', type=float, default=0.005,
+                        help='Loosest threshold a benchmark is run to with '
+                        '--category-target')
+    parser.add_argument('--poll', type=float, default=30.,
+                        help='Seconds between checks for finished tasks')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only print how the benchmarks would be packed')
+    args = parser.parse_args()
+
+    basedir = args.directory.resolve()
+    basedir.mkdir(exist_ok=True)
+
+    # Clone the benchmarks once so that tasks do not race to do it
+    if not (basedir / 'benchmarks').is_dir():
+        subprocess.run(['git', 'clone', 'https://github.com/mit-crpg/benchmarks.git'],
+                       cwd=basedir, check=True)
+    benchmarks, listed_sizes = read_list(basedir / args.list)
+
+    # Expected time and size of each benchmark
+    runtimes = read_runtimes(args.history)
+    groups = {None: []}
+    model = ScalingModel.from_history(args.history) if args.size else None
+    max_ranks = 1 if args.worker else args.max_ranks
+    sizes = candidates(max_ranks, args.threads_per_rank)
+    for benchmark in benchmarks:
+        # Sizes given in the list are kept as they are
+        if benchmark in listed_sizes:
+            size = listed_sizes[benchmark]
+            if model is not None and benchmark in model:
+                runtimes[benchmark] = model.predict(benchmark, *size)
+        elif model is not None and benchmark in model:
+            *size, runtimes[benchmark] = model.choose(benchmark, sizes, args.task_time)
+            size = tuple(size)
+        else:
+            size = None
+        groups.setdefault(size, []).append(benchmark)
+
+    # Benchmarks of each size are packed into tasks of their own
+    tasks = []
+    arrays = []
+    for size, members in groups.items():
+        if not members:
+            continue
+        packed = pack(members, runtimes, args.task_time)
+        arrays.append((len(tasks), len(tasks) + len(packed) - 1, size,
+                       max(total for _, total in packed)))
+        tasks.extend((m, total, size) for m, total in packed)
+    known = sum(b in runtimes for b in benchmarks)
+    print(f'Packed {len(benchmarks)} benchmarks ({known} with recorded runtimes) '
+          f'into {len(tasks)} tasks in {len(arrays)} job arrays')
+    for first, last, size, longest in arrays:
+        name = 'default size' if size is None else f'{size[0]} processes x {size[1]} threads'
+        print(f'  tasks {first}-{last}: {name}, longest task {longest/3600:.2f} h')
+    if args.dry_run:
+        for i, (members, total, size) in enumerate(tasks):
+            name = '' if size is None else f' on {size[0]} x {size[1]}'
+            print(f'{i:4d} {total/3600:6.2f} h {len(members):4d} benchmarks{name}')
+        return
+
+    if args.backend == 'local':
+        backend = LocalExecutor(args.processes)
+    elif args.backend == 'slurm':
+        backend = SlurmBackend(args.nodes, args.scheduler_args.split())
+    else:
+        backend = PBSBackend(args.nodes, args.scheduler_args.split(), args.cores_per_node)
+
+    launchers = {
+        False: MPI_ARGS[args.backend] if args.mpi_args is None else args.mpi_args,
+        True: (SIZED_MPI_ARGS[args.backend] if args.sized_mpi_args is None
+               else args.sized_mpi_args),
+    }
+    options = (f'--cross_sections {args.cross_sections.resolve()} '
+               f'--threshold {args.threshold}')
+    if args.worker:
+        launchers = {False: '', True: ''}
+        options += ' --worker'
+    trigger = None
+    if args.category_target is not None:
+        trigger = CampaignTrigger(benchmarks, args.category_target,
+                                  read_costs(args.history), args.max_threshold)
+        trigger.write(basedir / 'thresholds')
+        options += f' --thresholds {basedir / "thresholds"}'
+    scripts = write_scripts(basedir, tasks, launchers, options, backend.array_variable)
+    for first, last, size, longest in arrays:
+        backend.submit(scripts[size is not None], first, last,
+                       walltime(longest*args.margin), size)
+
+    # Gather results as tasks finish
+    pending = set(range(len(tasks)))
+    finished = []
+    while pending:
+        # Check whether the array is still running before looking for
+        # finished tasks so that none finishing in between are missed
+        active = backend.active()
+        done = {i for i in pending if (basedir / 'tasks' / f'done-{i}').exists()}
+
+        # Benchmarks finished in running tasks count towards the category
+        # targets as soon as their results are written
+        if trigger is not None:
+            results = {}
+            for i in range(len(tasks)):
+                path = basedir / f'results.{i}'
+                if path.exists():
+                    results.update(read_results(path))
+            if len(results) > len(trigger.results):
+                trigger.update(results)
+                trigger.write(basedir / 'thresholds')
+                print(trigger.summary())
+
+        if done:
+            pending -= done
+            finished.extend(sorted(done))
+            gather(basedir, benchmarks, finished)
+            n_results = len((basedir / 'results').read_text().splitlines())
+            print(f'{len(finished)}/{len(tasks)} tasks finished, '
+                  f'{n_results}/{len(benchmarks)} benchmarks with results')
+        elif not active:
+            print(f'Job array ended with tasks {sorted(pending)} unfinished')
+            break
+        else:
+            time.sleep(args.poll)
+    backend.shutdown()
+    if trigger is not None and not trigger.satisfied():
+        print(f'Not every category reached {args.category_target} pcm')
+
+
+if __name__ == '__main__':
+    main()
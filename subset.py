@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""Find a small subset of benchmarks that is representative of a full suite.
+
+For each fuel/spectrum category, the smallest subset is sought whose average
+C/E agrees with the average over every benchmark in the category to within a
+tolerance. When several results files are given, the subset must reproduce
+the category averages for all of them, which guards against choosing cases
+that happen to agree for a single library only. The chosen benchmarks are
+written as a new benchmark list that can be passed to run-benchmarks or
+run_benchmarks.py.
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+from tabulate import tabulate
+
+from results import (read_results, calculated_over_experimental,
+                     group_by_category)
+
+
+def deviation(values, indices):
+    """Maximum deviation over campaigns between subset and full averages
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        C/E values with shape (campaigns, benchmarks)
+    indices : numpy.ndarray
+        Indices of candidate subsets with shape (subsets, size)
+
+    Returns
+    -------
+    numpy.ndarray
+        Maximum absolute deviation of each candidate subset
+
+    """
+    full = values.mean(axis=1)
+    subset = values[:, indices].mean(axis=-1)
+    return np.abs(subset - full[:, np.newaxis]).max(axis=0)
+
+
+def refine(values, chosen, tolerance):
+    """Improve a subset by swapping single members until no swap helps"""
+    n = values.shape[1]
+    chosen = list(chosen)
+    best = deviation(values, np.array([chosen]))[0]
+    while best > tolerance:
+        others = [j for j in range(n) if j not in chosen]
+        if not others:
+            break
+        candidates = []
+        for i in range(len(chosen)):
+            for j in others:
+                candidates.append(chosen[:i] + [j] + chosen[i+1:])
+        dev = deviation(values, np.array(candidates))
+        k = dev.argmin()
+        if dev[k] >= best:
+            break
+        chosen, best = candidates[k], dev[k]
+    return chosen, best
+
+
+def smallest_subset(values, tolerance, min_size, samples, rng):
+    """Search for the smallest subset within tolerance of the full average"""
+    n = values.shape[1]
+    for size in range(min(min_size, n), n + 1):
+        # Random search over subsets of the current size
+        order = np.argsort(rng.random((samples, n)), axis=1)[:, :size]
+        dev = deviation(values, order)
+        chosen = list(order[dev.argmin()])
+
+        # Local search from the best random subset
+        chosen, best = refine(values, chosen, tolerance)
+        if best <= tolerance:
+            return sorted(chosen), best
+    return list(range(n)), 0.0
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('results', nargs='+', type=Path,
+                        help='Results file(s) from benchmark campaigns')
+    parser.add_argument('-o', '--output', type=Path, required=True,
+                        help='Benchmark list to write, e.g. benchmarks/lists/pst-subset')
+    parser.add_argument('-t', '--tolerance', type=float, default=1e-4,
+                        help='Allowed deviation in average C/E per category')
+    parser.add_argument('-m', '--min-size', type=int, default=3,
+                        help='Minimum number of benchmarks per category')
+    parser.add_argument('-n', '--samples', type=int, default=10000,
+                        help='Number of random subsets tried for each size')
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # Get C/E for benchmarks common to every campaign
+    campaigns = [calculated_over_experimental(read_results(f))
+                 for f in args.results]
+    paths = [p for p in campaigns[0] if all(p in c for c in campaigns[1:])]
+
+    rng = np.random.default_rng(args.seed)
+    selected = set()
+    table = []
+    for cat, members in sorted(group_by_category(paths).items()):
+        values = np.array([[c[p][0] for p in members] for c in campaigns])
+        chosen, dev = smallest_subset(values, args.tolerance, args.min_size,
+                                      args.samples, rng)
+        selected.update(members[i] for i in chosen)
+        table.append([cat, len(members), len(chosen),
+                      f'{values.mean():.5f}', f'{dev*1e5:.1f}'])
+
+    headers = ['Category', 'Benchmarks', 'Subset', 'Average C/E',
+               'Max deviation (pcm)']
+    print(tabulate(table, headers=headers, tablefmt='grid'))
+    print(f'Selected {len(selected)} of {len(paths)} benchmarks')
+
+    # Write list preserving the original order of benchmarks
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as fh:
+        for path in paths:
+            if path in selected:
+                fh.write(path + '\n')
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+"""Predict benchmark k-eff for combinations of modifications without transport.
+
+A linear model k = k0 + S x is built for every benchmark in a suite, where x
+holds the targets of each modification (e.g. capture-03, nubar or pfns, in
+units of their uncertainty as used by modify.py) and S the per-benchmark
+sensitivity coefficients. Coefficients are fit from campaigns in which one
+modification at a time was made, or imported from a table of sensitivities.
+Imported coefficients are single numbers per benchmark and modification:
+energy-dependent sensitivity profiles (e.g. group-wise S(E) from TSUNAMI or
+OpenMC sensitivity tallies) have to be collapsed against the energy shape
+of each modification beforehand.
+Predictions for many combinations at once are then a single matrix product,
+so a scan over thousands of candidates takes milliseconds and only the most
+promising need full NJOY and OpenMC campaigns.
+
+Build a model from a baseline campaign and single-modification campaigns:
+
+  surrogate.py build baseline/results -c capture-03 0.5 c03/results \
+      -c nubar 0.5 nubar/results -o pu239.json
+
+then rank combinations of targets by their agreement with experiment:
+
+  surrogate.py predict pu239.json -x capture-03=0.5,nubar=-0.2 \
+      --scan capture-03=-1:1:21 nubar=-1:1:21
+"""
+
+from argparse import ArgumentParser
+from collections import defaultdict
+import csv
+import itertools
+import json
+
+import numpy as np
+from tabulate import tabulate
+
+from results import read_results, benchmark_name, category, model_keff
+
+
+class Surrogate:
+    """Linear model of k-eff in the targets of a set of modifications
+
+    Parameters
+    ----------
+    benchmarks : list of str
+        Paths of the benchmarks
+    parameters : list of str
+        Names of the modifications
+    baseline : numpy.ndarray
+        Unmodified k-eff of each benchmark
+    stdev : numpy.ndarray
+        Statistical uncertainty of the baseline k-eff
+    coefficients : numpy.ndarray
+        Change in k-eff per unit target with shape (benchmarks, parameters)
+    uncertainties : numpy.ndarray
+        Statistical uncertainty of the coefficients from the modified runs
+        alone, same shape
+    baseline_weights : numpy.ndarray, optional
+        Weight of the baseline k-eff in each coefficient, with shape
+        (parameters,). Coefficients fit from campaigns all share the baseline
+        run, so its uncertainty is carried through these rather than counted
+        in each coefficient's uncertainty. Zero for imported coefficients.
+
+    """
+    def __init__(self, benchmarks, parameters, baseline, stdev, coefficients,
+                 uncertainties, baseline_weights=None):
+        self.benchmarks = list(benchmarks)
+        self.parameters = list(parameters)
+        self.baseline = np.asarray(baseline, dtype=float)
+        self.stdev = np.asarray(stdev, dtype=float)
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.uncertainties = np.asarray(uncertainties, dtype=float)
+        if baseline_weights is None:
+            baseline_weights = np.zeros(len(self.parameters))
+        self.baseline_weights = np.asarray(baseline_weights, dtype=float)
+
+    @classmethod
+    def from_campaigns(cls, baseline, campaigns):
+        """Fit coefficients from single-modification campaigns
+
+        Parameters
+        ----------
+        baseline : str
+            Results file of the unmodified campaign
+        campaigns : Iterable of tuple
+            (parameter, target, results file) of each campaign. When a
+            parameter has campaigns at several targets, the coefficient is a
+            least-squares fit through the baseline.
+
+        """
+        base = read_results(baseline)
+        runs = defaultdict(list)
+        for parameter, target, filename in campaigns:
+            runs[parameter].append((float(target), read_results(filename)))
+
+        # Only benchmarks present in every campaign are modeled
+        benchmarks = [p for p in base if all(p in r for c in runs.values() for _, r in c)]
+        k0 = np.array([base[p][0] for p in benchmarks])
+        s0 = np.array([base[p][1] for p in benchmarks])
+
+        parameters = list(runs)
+        coefficients = np.empty((len(benchmarks), len(parameters)))
+        uncertainties = np.empty_like(coefficients)
+        weights = np.empty(len(parameters))
+        for j, parameter in enumerate(parameters):
+            targets = np.array([t for t, _ in runs[parameter]])
+            k = np.array([[r[p][0] for p in benchmarks] for _, r in runs[parameter]])
+            s = np.array([[r[p][1] for p in benchmarks] for _, r in runs[parameter]])
+            norm = np.sum(targets**2)
+            coefficients[:, j] = targets @ (k - k0)/norm
+            uncertainties[:, j] = np.sqrt(targets**2 @ s**2)/norm
+            weights[j] = np.sum(targets)/norm
+        return cls(benchmarks, parameters, k0, s0, coefficients, uncertainties, weights)
+
+    @classmethod
+    def from_sensitivities(cls, baseline, filename):
+        """Import coefficients from a table of sensitivities
+
+        The table is a CSV file with benchmark, parameter and coefficient
+        columns and, optionally, an uncertainty column. Coefficients are
+        changes in k-eff per unit target, already integrated over energy;
+        group-wise profiles are not read. Missing coefficients are zero.
+
+        """
+        base = read_results(baseline)
+        table = {}
+        with open(filename, newline='') as fh:
+            for row in csv.reader(fh):
+                if not row or row[0].startswith('#'):
+                    continue
+                uncertainty = float(row[3]) if len(row) > 3 else 0.
+                table[row[0], row[1]] = (float(row[2]), uncertainty)
+
+        benchmarks = [p for p in base if any(b == p for b, _ in table)]
+        parameters = list(dict.fromkeys(q for _, q in table))
+        coefficients = np.zeros((len(benchmarks), len(parameters)))
+        uncertainties = np.zeros_like(coefficients)
+        for i, p in enumerate(benchmarks):
+            for j, q in enumerate(parameters):
+                coefficients[i, j], uncertainties[i, j] = table.get((p, q), (0., 0.))
+        k0 = np.array([base[p][0] for p in benchmarks])
+        s0 = np.array([base[p][1] for p in benchmarks])
+        return cls(benchmarks, parameters, k0, s0, coefficients, uncertainties)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as fh:
+            return cls(**json.load(fh))
+
+    def save(self, filename):
+        with open(filename, 'w') as fh:
+            json.dump({'benchmarks': self.benchmarks, 'parameters': self.parameters,
+                       'baseline': self.baseline.tolist(), 'stdev': self.stdev.tolist(),
+                       'coefficients': self.coefficients.tolist(),
+                       'uncertainties': self.uncertainties.tolist(),
+                       'baseline_weights': self.baseline_weights.tolist()}, fh, indent=2)
+
+    def targets(self, values):
+        """Convert a dictionary of targets by parameter to a vector"""
+        unknown = set(values) - set(self.parameters)
+        if unknown:
+            raise ValueError(f'No coefficients for {", ".join(sorted(unknown))}')
+        return np.array([values.get(q, 0.) for q in self.parameters])
+
+    def predict(self, x):
+        """Predict k-eff for one or more combinations of targets
+
+        Parameters
+        ----------
+        x : numpy.ndarray
+            Targets with shape (parameters,) or (candidates, parameters)
+
+        Returns
+        -------
+        keff, stdev : numpy.ndarray
+            Predicted k-eff and its statistical uncertainty with shape
+            (benchmarks,) or (candidates, benchmarks)
+
+        """
+        x = np.asarray(x, dtype=float)
+        keff = self.baseline + x @ self.coefficients.T
+
+        # The prediction is k0*(1 - x.w) plus terms in the modified runs, so
+        # the baseline contributes once, through its total weight
+        shared = (1. - x @ self.baseline_weights)[..., np.newaxis]
+        stdev = np.sqrt((shared*self.stdev)**2 + x**2 @ (self.uncertainties**2).T)
+        return keff, stdev
+
+    def experiment(self):
+        """Benchmark model k-eff and uncertainty, NaN where unknown"""
+        values = [model_keff.get(benchmark_name(p), (np.nan, np.nan))
+                  for p in self.benchmarks]
+        return np.array(values, dtype=float).T
+
+    def chi_square(self, x):
+        """Reduced chi-square of predicted k-eff against experiment
+
+        Benchmarks without a model value are left out.
+
+        """
+        keff, stdev = self.predict(x)
+        kexp, uexp = self.experiment()
+        known = ~np.isnan(kexp)
+        if not known.any():
+            raise ValueError('No benchmark model values available')
+        z = (keff[..., known] - kexp[known])/np.sqrt(uexp[known]**2 + stdev[..., known]**2)
+        return np.mean(z**2, axis=-1)
+
+    def category_averages(self, x):
+        """Average predicted C/E for each fuel/spectrum category"""
+        keff, _ = self.predict(x)
+        kexp, _ = self.experiment()
+        categories = np.array([category(p) for p in self.benchmarks])
+        averages = {}
+        for cat in sorted(set(categories)):
+            members = (categories == cat) & ~np.isnan(kexp)
+            if members.any():
+                averages[cat] = np.mean(keff[..., members]/kexp[members], axis=-1)
+        return averages
+
+
+def parse_targets(text):
+    """Parse 'name=value,name=value' into a dictionary"""
+    values = {}
+    for item in text.split(','):
+        name, value = item.split('=')
+        values[name] = float(value)
+    return values
+
+
+def scan_grid(surrogate, scans):
+    """Candidate targets from 'name=start:stop:num' ranges, one per parameter"""
+    axes = []
+    for scan in scans:
+        name, spec = scan.split('=')
+        start, stop, num = spec.split(':')
+        axes.append((surrogate.parameters.index(name),
+                     np.linspace(float(start), float(stop), int(num))))
+    x = np.zeros((np.prod([len(v) for _, v in axes]), len(surrogate.parameters)))
+    for row, point in enumerate(itertools.product(*[v for _, v in axes])):
+        for (j, _), value in zip(axes, point):
+            x[row, j] = value
+    return x
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Build a model from campaigns')
+    build.add_argument('baseline', help='Results file of the unmodified campaign')
+    build.add_argument('-c', '--campaign', nargs=3, action='append', default=[],
+                       metavar=('PARAMETER', 'TARGET', 'RESULTS'),
+                       help='Results file of a campaign with one modification')
+    build.add_argument('-s', '--sensitivities', help='CSV file of benchmark, '
+                       'parameter, coefficient and (optionally) uncertainty')
+    build.add_argument('-o', '--output', required=True, help='Model file to write')
+
+    predict = subparsers.add_parser('predict', help='Predict k-eff with a model')
+    predict.add_argument('model', help='Model file')
+    predict.add_argument('-x', '--targets', nargs='+', default=[],
+                         help='Combinations of targets, e.g. capture-03=0.5,nubar=-0.2')
+    predict.add_argument('--scan', nargs='+', default=[],
+                         help='Ranges of targets to scan, e.g. nubar=-1:1:21')
+    predict.add_argument('-n', '--best', type=int, default=10,
+                         help='Number of best scanned combinations to show')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if args.sensitivities is not None:
+            surrogate = Surrogate.from_sensitivities(args.baseline, args.sensitivities)
+        elif args.campaign:
+            surrogate = Surrogate.from_campaigns(args.baseline, args.campaign)
+        else:
+            parser.error('Need campaigns or sensitivities to build a model')
+        surrogate.save(args.output)
+        print(f'Modeled {len(surrogate.benchmarks)} benchmarks with parameters '
+              f'{", ".join(surrogate.parameters)}')
+        raise SystemExit
+
+    surrogate = Surrogate.load(args.model)
+    candidates = [surrogate.targets(parse_targets(t)) for t in args.targets]
+    labels = list(args.targets)
+    if args.scan:
+        x = scan_grid(surrogate, args.scan)
+        chi2 = surrogate.chi_square(x)
+        best = np.argsort(chi2)[:args.best]
+        candidates.extend(x[best])
+        labels.extend(','.join(f'{q}={v:g}' for q, v in zip(surrogate.parameters, row)
+                               if v != 0.) or 'none' for row in x[best])
+        print(f'Scanned {len(x)} combinations')
+
+    # Always compare against the unmodified library
+    candidates.insert(0, np.zeros(len(surrogate.parameters)))
+    labels.insert(0, 'none')
+    x = np.array(candidates)
+    chi2 = surrogate.chi_square(x)
+    averages = surrogate.category_averages(x)
+    table = [[label, f'{c:.3f}'] + [f'{averages[cat][i]:.5f}' for cat in averages]
+             for i, (label, c) in enumerate(zip(labels, chi2))]
+    print(tabulate(table, headers=['Targets', 'Chi-square'] + list(averages),
+                   tablefmt='grid', disable_numparse=True))
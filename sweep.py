@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""Make many modified versions of an evaluation from a single parse.
+
+The ENDF file is converted to GND once. Each variant (a target combined with
+a set of modify.py options) is then made and written by a worker process
+forked from the parent, so every variant starts from the unmodified data
+without the evaluation being read again. A manifest describing the variants
+is written to the output directory.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+
+from modify import (Evaluation, DEFAULT_RECIPE, add_modification_arguments,
+                    apply_modifications)
+
+# Evaluation read by the parent process and inherited by forked workers
+evaluation = None
+
+# Parser for the modify.py options of a single variant
+options_parser = argparse.ArgumentParser(prog='options')
+add_modification_arguments(options_parser)
+
+
+def variant_name(target, options):
+    """File name of a variant, with characters that are unsafe in file names
+    (such as the separators of path-valued options) replaced"""
+    label = '_'.join(flag.lstrip('-') for flag in options.split()) or 'none'
+    label = re.sub(r'[^\w.+-]', '-', label)
+    return '{0}_{1}'.format(label, target)
+
+def make_variant(task):
+    """Modify and write one variant; output is captured in a log file"""
+    target, options, directory = task
+    name = variant_name(target, options)
+    filename = os.path.join(directory, name + '.endf')
+    log = os.path.join(directory, name + '.out')
+
+    sys.stdout = open(log, 'w')
+    try:
+        print('Target: {0}\n'.format(target))
+        evaluation.target = target
+        apply_modifications(evaluation, options_parser.parse_args(options.split()))
+        evaluation.write(filename)
+    finally:
+        sys.stdout.close()
+        sys.stdout = sys.__stdout__
+
+    return {'name': name, 'target': target, 'options': options.split(),
+            'endf': filename, 'log': log,
+            'capture_2200': float(evaluation.capture[-1]),
+            'fission_2200': float(evaluation.fission[-1])}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('endf', help='ENDF file to modify')
+    parser.add_argument('directory', help='Directory to write modified ENDF files to')
+    parser.add_argument('-t', '--targets', type=float, nargs='+', required=True,
+                        help='Target percentage changes')
+    parser.add_argument('-o', '--options', nargs='+', default=[''],
+                        help='Combinations of modify.py options, each given as '
+                        'one quoted string, e.g. "--negative --nubar"')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of variants to make in parallel')
+    parser.add_argument('--reconstruct', action='store_true',
+                        help='Get 2200 m/s values by full resonance reconstruction')
+    parser.add_argument('--recipe', default=DEFAULT_RECIPE,
+                        help='Recipe with the modifications and constants for the nuclide')
+    args = parser.parse_args()
+
+    # Check option combinations before doing any work
+    for options in args.options:
+        options_parser.parse_args(options.split())
+    names = [variant_name(target, options)
+             for options in args.options for target in args.targets]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        parser.error('Variants would be written to the same file: {0}'.format(
+            ', '.join(duplicates)))
+
+    if not os.path.isdir(args.directory):
+        os.makedirs(args.directory)
+
+    # Read evaluation once in the parent process
+    evaluation = Evaluation(args.endf, None, args.reconstruct, args.recipe)
+
+    # Each task gets a freshly forked worker so that no modifications carry
+    # over from one variant to the next
+    try:
+        context = multiprocessing.get_context('fork')
+    except AttributeError:
+        context = multiprocessing
+    tasks = [(target, options, args.directory)
+             for options in args.options for target in args.targets]
+    pool = context.Pool(args.processes, maxtasksperchild=1)
+    manifest = []
+    for variant in pool.imap(make_variant, tasks):
+        print('Wrote {0}'.format(variant['endf']))
+        manifest.append(variant)
+    pool.close()
+    pool.join()
+
+    with open(os.path.join(args.directory, 'manifest.json'), 'w') as fh:
+        json.dump({'endf': os.path.abspath(args.endf),
+                   'recipe': os.path.abspath(args.recipe), 'variants': manifest},
+                  fh, indent=2)
@@ -0,0 +1,35 @@
+"""Tests of modify.py"""
+
+import os
+import sys
+import types
+
+import pytest
+
+pytest.importorskip('fudge')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import gnd_cache
+import modify
+
+EVALUATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          'evaluations', 'pu239', 'cielo-v0.endf')
+
+
+def test_write_without_reich_moore_range(tmp_path, monkeypatch):
+    # Copy the evaluation without its resonance parameters (MF2)
+    filename = tmp_path / 'no-mf2.endf'
+    with open(EVALUATION, 'r') as fin, open(filename, 'w') as fout:
+        fout.writelines(line for line in fin if line[70:72] != ' 2')
+
+    # Only the MF3 background cross sections are used without a resolved
+    # range, so the GND conversion is not needed
+    suites = {'reactionSuite': None,
+              'covarianceSuite': types.SimpleNamespace(sections=[])}
+    monkeypatch.setattr(gnd_cache, 'load', lambda filename: suites)
+
+    evaluation = modify.Evaluation(str(filename), 0.5)
+    assert evaluation.table is None
+
+    output = tmp_path / 'written.endf'
+    evaluation.write(str(output))
+    assert output.read_text() == filename.read_text()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""Thin the energy grid of the ACE file produced by run-njoy.
+
+Run on the directory given to run-njoy, before modify-csxml.py. Pointwise
+cross sections of every table in 'ace' are put on a thinned union grid under
+a relative tolerance, the file is rewritten in the same (binary or ASCII)
+format and the table lengths in 'xsdir' are updated. The memory saved and the
+maximum reconstruction error of each table are printed.
+"""
+
+import argparse
+import os
+import sys
+
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils'))
+import ace
+from thin import thin_energy_grid
+
+
+def update_xsdir(filename, lengths):
+    """Set the table length field of xsdir entries"""
+    with open(filename) as fh:
+        lines = fh.readlines()
+    with open(filename, 'w') as fh:
+        for line in lines:
+            words = line.split()
+            if len(words) > 6 and words[0] in lengths:
+                words[6] = str(lengths[words[0]])
+                line = ' '.join(words) + '\n'
+            fh.write(line)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('directory', nargs='?', default='.',
+                    help='Directory with ace and xsdir files from run-njoy')
+parser.add_argument('-t', '--tol', type=float, default=0.001,
+                    help='Maximum relative error of thinned cross sections')
+args = parser.parse_args()
+
+filename = os.path.join(args.directory, 'ace')
+binary = ace.is_binary(filename)
+tables = ace.read(filename)
+
+report = []
+for table in tables:
+    before = table.xss.nbytes
+    try:
+        nes, thinned, error = thin_energy_grid(table, args.tol)
+    except ValueError as e:
+        print(f'Skipping {table.name}: {e}')
+        continue
+    after = table.xss.nbytes
+    report.append([table.name, nes, thinned, f'{before/1024**2:.2f}',
+                   f'{after/1024**2:.2f}', f'{(before - after)/1024**2:.2f}',
+                   f'{error:.2e}'])
+
+# The original file is memory mapped when binary, so write alongside it
+# before replacing it
+temporary = filename + '.thinned'
+if binary:
+    ace.write_binary(tables, temporary)
+else:
+    ace.write_ascii(tables, temporary)
+os.replace(temporary, filename)
+
+xsdir = os.path.join(args.directory, 'xsdir')
+if os.path.exists(xsdir):
+    update_xsdir(xsdir, {t.name: len(t.xss) for t in tables})
+
+print(tabulate(report, headers=['Table', 'Energies', 'Thinned', 'Size (MB)',
+                                'Thinned (MB)', 'Saved (MB)', 'Max error'],
+               tablefmt='grid', disable_numparse=True))
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+"""Total Monte Carlo: propagate covariance data to benchmark k-eff by sampling.
+
+Relative covariances of chosen reactions are read from the MF33 sections of
+an ENDF file. N correlated perturbation vectors are drawn at once from an
+eigendecomposition of each covariance matrix (covariance data are often not
+quite positive definite, so negative eigenvalues are dropped rather than
+relying on a Cholesky factorization). For each sample, the nuclide in an HDF5
+library is perturbed with perturb_library.py and written, with its own
+cross_sections.xml, to a sample directory. Libraries are built in parallel
+and each one is run through run_benchmarks.py as soon as it is ready.
+
+The k-eff results of every completed sample are aggregated as they arrive:
+the mean, spread and correlation between benchmarks are written to tmc.json
+in the output directory after each sample, so a campaign can be inspected or
+stopped at any point.
+"""
+
+from argparse import ArgumentParser
+import json
+import multiprocessing
+from pathlib import Path
+import subprocess
+import sys
+
+import numpy as np
+import openmc.data
+from tabulate import tabulate
+
+import endf
+from perturb_library import group_multiplier, perturb, write_library
+from results import read_results
+
+# Nuclide read by the parent process and inherited by forked workers
+nuclide = None
+
+
+def read_covariances(filename, mts):
+    """Read relative self-covariances of reactions from an ENDF file
+
+    Parameters
+    ----------
+    filename : str
+        ENDF file with MF33 covariances
+    mts : Iterable of int
+        Reactions to read covariances for
+
+    Returns
+    -------
+    dict
+        Mapping of MT to (bounds, matrix) as returned by endf.read_covariance
+
+    """
+    sections = endf.read_sections(filename)
+    covariances = {}
+    for mt in mts:
+        if (33, mt) not in sections:
+            raise SystemExit(f'No MF33 covariances for MT{mt} in {filename}')
+        cov = endf.read_covariance(sections[33, mt])
+        if cov is None:
+            raise SystemExit(f'No relative covariances for MT{mt} in {filename}')
+        covariances[mt] = cov
+    return covariances
+
+
+def sample(covariances, n, rng):
+    """Draw correlated relative perturbations
+
+    Parameters
+    ----------
+    covariances : dict
+        Mapping of MT to (bounds, matrix)
+    n : int
+        Number of samples
+    rng : numpy.random.Generator
+        Random number generator
+
+    Returns
+    -------
+    dict
+        Mapping of MT to an array of relative perturbations with shape
+        (n, groups)
+
+    """
+    samples = {}
+    for mt, (bounds, matrix) in sorted(covariances.items()):
+        eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+        factor = eigenvectors*np.sqrt(np.clip(eigenvalues, 0., None))
+        samples[mt] = rng.standard_normal((n, len(eigenvalues))) @ factor.T
+    return samples
+
+
+def make_library(task):
+    """Perturb the nuclide for one sample and write a library with it"""
+    i, perturbations, bounds, library_xml, directory = task
+    library = openmc.data.DataLibrary.from_xml(library_xml)
+    entry = library.get_by_material(nuclide.name)
+
+    # Cross sections are kept non-negative
+    multipliers = {mt: group_multiplier(bounds[mt], np.maximum(1 + delta, 0.))
+                   for mt, delta in perturbations.items()}
+    perturb(nuclide, multipliers)
+    write_library(library, entry, nuclide, directory)
+    return i, directory
+
+
+class Aggregate:
+    """Running summary of k-eff over completed samples
+
+    Only benchmarks with results for every sample added are included in the
+    summary.
+
+    """
+    def __init__(self):
+        self.samples = []
+        self.keff = []
+
+    def add(self, i, results):
+        self.samples.append(i)
+        self.keff.append({path: k for path, (k, _) in results.items()})
+
+    @property
+    def benchmarks(self):
+        if not self.keff:
+            return []
+        return [p for p in self.keff[0] if all(p in k for k in self.keff[1:])]
+
+    def values(self):
+        """k-eff with shape (samples, benchmarks)"""
+        return np.array([[k[p] for p in self.benchmarks] for k in self.keff])
+
+    def summary(self):
+        values = self.values()
+        n = values.shape[0]
+        mean = values.mean(axis=0)
+        std = values.std(axis=0, ddof=1) if n > 1 else np.zeros_like(mean)
+        if n > 2:
+            correlation = np.corrcoef(values, rowvar=False)
+        else:
+            correlation = np.full((len(mean), len(mean)), np.nan)
+        return mean, std, np.atleast_2d(correlation)
+
+    def write(self, filename):
+        mean, std, correlation = self.summary()
+        with open(filename, 'w') as fh:
+            json.dump({
+                'samples': self.samples,
+                'benchmarks': self.benchmarks,
+                'keff': self.values().tolist(),
+                'mean': mean.tolist(),
+                'std': std.tolist(),
+                'correlation': np.where(np.isnan(correlation), None,
+                                        correlation).tolist()
+            }, fh, indent=2)
+
+    def print_table(self):
+        mean, std, _ = self.summary()
+        table = [[p, f'{m:.5f}', f'{s*1e5:.0f}']
+                 for p, m, s in zip(self.benchmarks, mean, std)]
+        print(tabulate(table, headers=['Benchmark', 'Mean k-eff', 'Spread (pcm)'],
+                       tablefmt='grid'))
+
+
+def run_benchmarks(library_xml, directory, threshold, mpi_args, seed=None,
+                   repository=None):
+    """Run the benchmark list with a library and return its results
+
+    With a repository, the benchmarks are checked out from that clone of the
+    benchmarks repository rather than cloned from GitHub.
+
+    """
+    if repository is not None and not (directory / 'benchmarks').is_dir():
+        directory.mkdir(parents=True, exist_ok=True)
+        subprocess.run(['git', 'clone', '--quiet', '--shared', str(repository),
+                        str(directory / 'benchmarks')], check=True)
+    script = Path(__file__).resolve().parent / 'run_benchmarks.py'
+    command = [sys.executable, str(script), '--directory', str(directory),
+               '--cross_sections', str(library_xml),
+               '--threshold', str(threshold), '--mpi_args', mpi_args]
+    if seed is not None:
+        command += ['--seed', str(seed)]
+    subprocess.run(command, check=True)
+    return read_results(directory / 'results')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('cross_sections', type=Path, help='cross_sections.xml of library')
+    parser.add_argument('nuclide', help='Name of nuclide to perturb, e.g. Pu239')
+    parser.add_argument('covariance', help='ENDF file with MF33 covariances for the nuclide')
+    parser.add_argument('directory', type=Path, help='Directory for samples')
+    parser.add_argument('-n', '--samples', type=int, default=100,
+                        help='Number of samples')
+    parser.add_argument('-m', '--mt', type=int, nargs='+', default=[18, 102],
+                        help='Reactions to perturb')
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of libraries to build in parallel')
+    parser.add_argument('--threshold', type=float, default=0.001,
+                        help='Standard deviation of k-eff for each benchmark')
+    parser.add_argument('--mpi_args', default='')
+    parser.add_argument('--transport-seed', type=int,
+                        help='Run every sample with this OpenMC seed so that the '
+                        'spread between samples excludes most statistical noise')
+    parser.add_argument('--no-run', action='store_true',
+                        help='Only build the perturbed libraries')
+    args = parser.parse_args()
+
+    # Draw all samples up front so that they do not depend on the order in
+    # which libraries are built
+    covariances = read_covariances(args.covariance, args.mt)
+    rng = np.random.default_rng(args.seed)
+    perturbations = sample(covariances, args.samples, rng)
+    bounds = {mt: b for mt, (b, _) in covariances.items()}
+    args.directory.mkdir(parents=True, exist_ok=True)
+    np.savez(args.directory / 'perturbations.npz', seed=args.seed,
+             **{f'bounds_{mt}': b for mt, b in bounds.items()},
+             **{f'delta_{mt}': d for mt, d in perturbations.items()})
+
+    # Clone the benchmarks once; each sample checks out its own copy from
+    # this clone, sharing its objects
+    repository = args.directory / 'benchmarks'
+    if not args.no_run and not repository.is_dir():
+        subprocess.run(['git', 'clone', 'https://github.com/mit-crpg/benchmarks.git'],
+                       cwd=args.directory, check=True)
+
+    # Read nuclide once in the parent process
+    library = openmc.data.DataLibrary.from_xml(args.cross_sections)
+    entry = library.get_by_material(args.nuclide)
+    if entry is None:
+        raise SystemExit(f'{args.nuclide} not found in {args.cross_sections}')
+    nuclide = openmc.data.IncidentNeutron.from_hdf5(entry['path'])
+
+    # Each library is built by a freshly forked worker so that perturbations
+    # do not accumulate on the inherited nuclide
+    tasks = [(i, {mt: d[i] for mt, d in perturbations.items()}, bounds,
+              args.cross_sections, args.directory / f'{i:04d}')
+             for i in range(args.samples)]
+    context = multiprocessing.get_context('fork')
+    pool = context.Pool(args.processes, maxtasksperchild=1)
+
+    aggregate = Aggregate()
+    for i, directory in pool.imap(make_library, tasks):
+        print(f'Sample {i}: wrote library in {directory}')
+        if args.no_run:
+            continue
+        results = run_benchmarks(directory / 'cross_sections.xml', directory / 'run',
+                                 args.threshold, args.mpi_args, args.transport_seed,
+                                 repository)
+        aggregate.add(i, results)
+        aggregate.write(args.directory / 'tmc.json')
+        print(f'Aggregate of {len(aggregate.samples)} samples:')
+        aggregate.print_table()
+    pool.close()
+    pool.join()
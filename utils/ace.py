@@ -0,0 +1,378 @@
+"""Read and write ACE tables with the XSS array held in a NumPy array.
+
+ASCII tables are parsed straight into a float64 array. When the XSS lines
+have the usual fixed width of four 20-character fields, the text is
+converted without creating a Python object per value; otherwise the lines
+are split on whitespace. Binary tables, with the record layout used by
+OpenMC's convert_binary.py and cross_sections.xml (4096-byte records of 512
+entries), are memory mapped so that reading a table does not copy its XSS
+array.
+"""
+
+import mmap
+import struct
+
+import numpy as np
+
+# Default length of records in binary ACE files in bytes
+RECORD_LENGTH = 4096
+
+# Header, IZ/AW pairs and NXS/JXS arrays of a binary table
+_HEADER = struct.Struct('=10sdd10s70s10s')
+_IZAW = struct.Struct('=' + 16*'id')
+_NXS_JXS = struct.Struct('=16i32i')
+
+
+class Table(object):
+    """ACE table
+
+    Parameters
+    ----------
+    name : str
+        ZAID of the table, e.g. '94239.71c'
+    awr : float
+        Atomic weight ratio
+    temperature : float
+        Temperature in MeV
+    date, comment, mat : str
+        Remaining header fields
+    izaw : numpy.ndarray
+        16 IZ/AW pairs, flattened
+    nxs : numpy.ndarray
+        16 integers of the NXS array
+    jxs : numpy.ndarray
+        32 integers of the JXS array (1-based locations in XSS)
+    xss : numpy.ndarray
+        XSS array
+    location : int, optional
+        Record number (binary) or line number (ASCII) at which the table
+        begins in the file it was read from
+
+    """
+    def __init__(self, name, awr, temperature, date, comment, mat, izaw, nxs,
+                 jxs, xss, location=None):
+        self.name = name
+        self.awr = awr
+        self.temperature = temperature
+        self.date = date
+        self.comment = comment
+        self.mat = mat
+        self.izaw = np.asarray(izaw, dtype=float)
+        self.nxs = np.asarray(nxs, dtype=int)
+        self.jxs = np.asarray(jxs, dtype=int)
+        self.xss = xss
+        self.location = location
+
+    def __repr__(self):
+        return f'<ACE Table: {self.name}>'
+
+
+def _next_lines(data, pos, n):
+    """Return the bytes of n lines of data starting at pos and the position
+    of the line after them"""
+    start = pos
+    for _ in range(n):
+        end = data.find(b'\n', pos)
+        pos = len(data) if end == -1 else end + 1
+    return data[start:pos], pos
+
+
+def _parse_xss(block, n):
+    """Parse n values of XSS from the bytes of its lines"""
+    # Full lines of four 20-character fields are converted in place
+    nfull = n//4
+    chars = np.frombuffer(block, dtype=np.uint8, count=min(81*nfull, len(block)))
+    if len(chars) == 81*nfull:
+        chars = chars.reshape(nfull, 81)
+        if np.all(chars[:, 80] == ord('\n')):
+            try:
+                full = np.ascontiguousarray(chars[:, :80]).view('S20').ravel()
+                rest = np.array(block[81*nfull:].split(), dtype=float)
+                if len(rest) == n - 4*nfull:
+                    return np.concatenate([full.astype(float), rest])
+            except ValueError:
+                pass
+
+    # Irregular widths
+    xss = np.array(block.split(), dtype=float)
+    if len(xss) != n:
+        raise ValueError(f'Expected {n} XSS values, found {len(xss)}')
+    return xss
+
+
+def read_ascii(filename):
+    """Read every table in an ASCII ACE file
+
+    Parameters
+    ----------
+    filename : str
+        Path to the ACE file
+
+    Returns
+    -------
+    list of Table
+
+    """
+    with open(filename, 'rb') as fh:
+        data = fh.read()
+
+    tables = []
+    pos = 0
+    location = 1
+    while pos < len(data):
+        start = pos
+        header, pos = _next_lines(data, pos, 1)
+        header = header.decode()
+        if not header.strip():
+            location += 1
+            continue
+
+        # Skip the extra header of ACE 2.0 tables to the legacy header
+        if header[:10].strip().count('.') == 2 and header[:1].isdigit():
+            line, pos = _next_lines(data, pos, 1)
+            _, pos = _next_lines(data, pos, int(line.split()[2]))
+            header, pos = _next_lines(data, pos, 1)
+            header = header.decode()
+        line2, pos = _next_lines(data, pos, 1)
+        line2 = line2.decode()
+        name = header[:10].strip()
+        awr = float(header[10:22])
+        temperature = float(header[22:34])
+        date = header[35:45]
+        comment = line2[:70]
+        mat = line2[70:80]
+
+        block, pos = _next_lines(data, pos, 4)
+        izaw = np.array(block.split(), dtype=float)
+        block, pos = _next_lines(data, pos, 2)
+        nxs = np.array(block.split(), dtype=int)
+        block, pos = _next_lines(data, pos, 4)
+        jxs = np.array(block.split(), dtype=int)
+
+        n = nxs[0]
+        block, pos = _next_lines(data, pos, (n + 3)//4)
+        xss = _parse_xss(block, n)
+        tables.append(Table(name, awr, temperature, date, comment, mat, izaw,
+                            nxs, jxs, xss, location))
+        location += data.count(b'\n', start, pos)
+    return tables
+
+
+def read_binary(filename, record_length=RECORD_LENGTH):
+    """Read every table in a binary ACE file
+
+    The file is memory mapped and the XSS array of each table is a read-only
+    view into it; copy it before modifying.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the ACE file
+    record_length : int
+        Length of records in bytes
+
+    Returns
+    -------
+    list of Table
+
+    """
+    with open(filename, 'rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    tables = []
+    offset = 0
+    while offset + _HEADER.size < len(mm):
+        hz, awr, temperature, hd, hk, hm = _HEADER.unpack_from(mm, offset)
+        izaw = _IZAW.unpack_from(mm, offset + _HEADER.size)
+        values = _NXS_JXS.unpack_from(mm, offset + _HEADER.size + _IZAW.size)
+        nxs, jxs = values[:16], values[16:]
+
+        n = nxs[0]
+        xss = np.frombuffer(mm, dtype=np.float64, count=n,
+                            offset=offset + record_length)
+        tables.append(Table(hz.decode().strip(), awr, temperature, hd.decode(),
+                            hk.decode(), hm.decode(), izaw, nxs, jxs, xss,
+                            1 + offset//record_length))
+
+        # Tables start on a record boundary
+        offset += record_length*(1 + (8*n + record_length - 1)//record_length)
+    return tables
+
+
+def is_binary(filename):
+    """Determine whether an ACE file is binary from its first table header"""
+    with open(filename, 'rb') as fh:
+        head = fh.read(_HEADER.size + _IZAW.size)
+    return b'\x00' in head
+
+
+def read(filename, record_length=RECORD_LENGTH):
+    """Read every table in an ACE file, determining whether it is binary"""
+    if is_binary(filename):
+        return read_binary(filename, record_length)
+    return read_ascii(filename)
+
+
+def write_binary(tables, filename, record_length=RECORD_LENGTH):
+    """Write tables to a binary ACE file
+
+    Parameters
+    ----------
+    tables : Iterable of Table
+        Tables to write
+    filename : str
+        Path to the ACE file
+    record_length : int
+        Length of records in bytes
+
+    Returns
+    -------
+    list of int
+        Record number (1-based) at which each table begins, as used for the
+        location attribute in cross_sections.xml
+
+    """
+    locations = []
+    record = 1
+    with open(filename, 'wb') as fh:
+        for table in tables:
+            locations.append(record)
+            xss = np.ascontiguousarray(table.xss, dtype=np.float64)
+            nxs = np.array(table.nxs, dtype=int)
+            nxs[0] = len(xss)
+
+            # Header, IZ/AW pairs and NXS/JXS arrays are padded so that XSS
+            # starts at the second record
+            header = (_HEADER.pack(table.name.encode().ljust(10), table.awr,
+                                   table.temperature, table.date.encode()[:10],
+                                   table.comment.encode()[:70], table.mat.encode()[:10]) +
+                      _IZAW.pack(*[int(v) if k % 2 == 0 else float(v)
+                                   for k, v in enumerate(table.izaw)]) +
+                      _NXS_JXS.pack(*(list(nxs) + list(table.jxs))))
+            fh.write(header.ljust(record_length, b'\0'))
+
+            # XSS is padded to a complete record
+            fh.write(xss.data)
+            nbytes = xss.nbytes
+            fh.write(b'\0'*(-nbytes % record_length))
+            record += 1 + (nbytes + record_length - 1)//record_length
+    return locations
+
+
+def write_ascii(tables, filename):
+    """Write tables to an ASCII ACE file
+
+    Returns
+    -------
+    list of int
+        Line number at which each table begins
+
+    """
+    locations = []
+    line = 1
+    with open(filename, 'w') as fh:
+        for table in tables:
+            locations.append(line)
+            xss = np.asarray(table.xss, dtype=float)
+            nxs = np.array(table.nxs, dtype=int)
+            nxs[0] = len(xss)
+            fh.write(f'{table.name:>10}{table.awr:12.6f} {table.temperature:11.4E} '
+                     f'{table.date:<10}\n')
+            fh.write(f'{table.comment:<70}{table.mat:<10}\n')
+            pairs = [f'{int(table.izaw[2*i]):7d}{table.izaw[2*i + 1]:11.0f}'
+                     for i in range(16)]
+            for i in range(4):
+                fh.write(''.join(pairs[4*i:4*i + 4]) + '\n')
+            for values in (nxs, table.jxs):
+                for i in range(0, len(values), 8):
+                    fh.write(''.join(f'{v:9d}' for v in values[i:i + 8]) + '\n')
+            full = len(xss) - len(xss) % 4
+            np.savetxt(fh, xss[:full].reshape(-1, 4), fmt='%20.11E', delimiter='')
+            if full < len(xss):
+                fh.write(''.join(f'{v:20.11E}' for v in xss[full:]) + '\n')
+            line += 12 + (len(xss) + 3)//4
+    return locations
+
+
+def replace_blocks(table, blocks):
+    """Replace blocks of a table's XSS array, moving the blocks after them
+
+    A block extends from the location given by its JXS entry to the next
+    location given by any JXS entry. Every JXS entry and NXS(1) are updated
+    for the new block lengths.
+
+    Parameters
+    ----------
+    table : Table
+        Table to modify in place
+    blocks : dict
+        Mapping of JXS index (1-based, e.g. 9 for the AND block) to the new
+        contents of the block
+
+    """
+    xss = np.asarray(table.xss)
+    jxs = np.array(table.jxs, dtype=int)
+    starts = sorted(set(jxs[jxs > 0]))
+    ends = starts[1:] + [len(xss) + 1]
+    replaced = {jxs[k - 1]: np.asarray(v, dtype=float) for k, v in blocks.items()}
+
+    pieces = []
+    moved = {}
+    location = 1
+    for start, end in zip(starts, ends):
+        moved[start] = location
+        piece = replaced.get(start, xss[start - 1:end - 1])
+        pieces.append(piece)
+        location += len(piece)
+
+    table.xss = np.concatenate([xss[:starts[0] - 1]] + pieces)
+    table.jxs = np.array([moved[v] if v > 0 else 0 for v in jxs])
+    table.nxs = np.array(table.nxs, dtype=int)
+    table.nxs[0] = len(table.xss)
+
+
+def read_angular(xss, jxs9, locb):
+    """Read the angular distributions of one reaction from the AND block
+
+    Parameters
+    ----------
+    xss : numpy.ndarray
+        XSS array
+    jxs9 : int
+        JXS(9), the 1-based location of the AND block
+    locb : int
+        Locator of the reaction's distributions relative to JXS(9), from the
+        LAND block
+
+    Returns
+    -------
+    energies : numpy.ndarray
+        Incident energies
+    lc : numpy.ndarray
+        Locators of the distribution at each incident energy
+    distributions : list
+        For each incident energy, None for isotropic scattering, an array of
+        33 cosine bin boundaries for equiprobable bins, or a tuple of
+        (interpolation, cosine, pdf, cdf) arrays for a tabular distribution
+
+    """
+    # Locators are relative to JXS(9); index 'base + l' is 0-based
+    base = jxs9 - 2
+    start = base + locb
+    ne = int(xss[start])
+    energies = xss[start + 1:start + 1 + ne]
+    lc = xss[start + 1 + ne:start + 1 + 2*ne].astype(int)
+    distributions = []
+    for l in lc:
+        if l == 0:
+            distributions.append(None)
+        elif l > 0:
+            distributions.append(xss[base + l:base + l + 33])
+        else:
+            i = base - l
+            interpolation = int(xss[i])
+            n = int(xss[i + 1])
+            distributions.append((interpolation, xss[i + 2:i + 2 + n],
+                                  xss[i + 2 + n:i + 2 + 2*n],
+                                  xss[i + 2 + 2*n:i + 2 + 3*n]))
+    return energies, lc, distributions
@@ -1,100 +1,234 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
+import argparse
+from multiprocessing import Pool
+import os
 import sys
 
 import matplotlib.pyplot as plt
-from scipy.interpolate import interp1d
-from fudge.legacy.converting.endfFileToGND import endfFileToGND
+import numpy as np
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import gnd_cache
+from modify import covariance_index, find_covariance
 
 plotfunc = {('lin', 'lin'): plt.plot, ('lin', 'log'): plt.semilogy,
             ('log', 'lin'): plt.semilogx, ('log', 'log'): plt.loglog}
 
+# Quantities that are compared along with axis labels and scales
+quantities = [
+    ('capture', 'Cross section (b)', 'log'),
+    ('fission', 'Cross section (b)', 'log'),
+    ('nubar', 'Prompt nubar', 'lin'),
+    ('pfns', 'Probability', 'lin'),
+]
+
+
+def finish(filename=None):
+    plt.grid(True, which='both', color='lightgray', ls='-', alpha=0.7)
+    plt.gca().set_axisbelow(True)
+    if filename is None:
+        plt.show()
+    else:
+        plt.savefig(filename, bbox_inches='tight')
+    plt.close()
+
 def plot_cross_section(xs1, xs2, xlabel='Energy (eV)', ylabel='Cross section (b)',
-                       xscale='log', yscale='log'):
+                       xscale='log', yscale='log', filename=None):
     plotfunc[xscale, yscale](xs1[0], xs1[1])
     plotfunc[xscale, yscale](xs2[0], xs2[1])
-    plt.grid(True, which='both', color='lightgray', ls='-', alpha=0.7)
-    plt.gca().set_axisbelow(True)
     plt.xlabel(xlabel)
     plt.ylabel(ylabel)
-    plt.show()
-    plt.close()
+    finish(filename)
 
 def plot_diff(xs1, xs2, xlabel='Energy (eV)', ylabel='Difference (b)',
-              xscale='log', yscale='lin', uncertainty=None):
-    f = interp1d(*xs2)
-    plotfunc[xscale, yscale](xs1[0], f(xs1[0]) - xs1[1])
+              xscale='log', yscale='lin', uncertainty=None, filename=None):
+    x = np.asarray(xs1[0])
+    plotfunc[xscale, yscale](x, np.interp(x, *xs2) - xs1[1])
     if uncertainty:
         plotfunc[xscale, yscale](uncertainty[0], uncertainty[1], 'k--')
-    plt.grid(True, which='both', color='lightgray', ls='-', alpha=0.7)
-    plt.gca().set_axisbelow(True)
     plt.xlabel(xlabel)
     plt.ylabel(ylabel)
-    plt.show()
-    plt.close()
+    finish(filename)
 
 def plot_relative_diff(xs1, xs2, xlabel='Energy (eV)', ylabel='Relative difference',
-                       xscale='log', yscale='lin', uncertainty=None):
-    f = interp1d(*xs2)
-    plotfunc[xscale, yscale](xs1[0], abs(f(xs1[0]) - xs1[1])/xs1[1])
+                       xscale='log', yscale='lin', uncertainty=None, filename=None):
+    x = np.asarray(xs1[0])
+    y = np.asarray(xs1[1])
+    plotfunc[xscale, yscale](x, abs(np.interp(x, *xs2) - y)/y)
     if uncertainty:
         plotfunc[xscale, yscale](uncertainty[0], uncertainty[1], 'k--')
-    plt.grid(True, which='both', color='lightgray', ls='-', alpha=0.7)
-    plt.gca().set_axisbelow(True)
     plt.xlabel(xlabel)
     plt.ylabel(ylabel)
-    plt.show()
-    plt.close()
+    finish(filename)
+
+
+def load(filename, accuracy):
+    """Read an evaluation and reconstruct its resonances"""
+    t = gnd_cache.load(filename)
+    t['reactionSuite'].reconstructResonances(accuracy=accuracy)
+    return t
+
+def get_data(rs):
+    """Return (x, y) arrays of each compared quantity for an evaluation"""
+    prompt = rs.getReaction('fission').outputChannel.particles[0]
+    pfns = prompt.distributions.components['uncorrelated'].\
+        energyComponent['pointwise'].getAtEnergy(1e-5)
+    data = {
+        'capture': rs.getReaction('capture').getCrossSection()['linear'],
+        'fission': rs.getReaction('fission').getCrossSection()['linear'],
+        'nubar': prompt.multiplicity['pointwise'],
+        'pfns': pfns
+    }
+    return {key: tuple(map(np.array, xys.copyDataToXsAndYs()))
+            for key, xys in data.items()}
+
+def get_uncertainties(cov):
+    """Return relative uncertainty vectors for quantities with covariances"""
+    index = covariance_index(cov)
+    uncertainties = {}
+    for key, _, _ in quantities:
+        section = find_covariance(index, key)
+        if section is not None:
+            uncertainties[key] = tuple(map(np.array, section.getNativeData().
+                                           getUncertaintyVector().copyDataToXsAndYs()))
+    return uncertainties
+
+
+def relative_difference(xs1, xs2):
+    """Relative difference of two tabulated functions on their union grid"""
+    x = np.union1d(xs1[0], xs2[0])
+    y1 = np.interp(x, *xs1)
+    y2 = np.interp(x, *xs2)
+    rdiff = np.zeros_like(x)
+    nonzero = y1 != 0.
+    rdiff[nonzero] = (y2[nonzero] - y1[nonzero])/y1[nonzero]
+    return x, rdiff
+
+def compare(data1, data2, uncertainties):
+    """Compute statistics on the relative difference of each quantity
+
+    Returns a dictionary mapping each quantity to a tuple of the maximum
+    relative difference, the energy at which it occurs, the RMS relative
+    difference, and the maximum ratio of the relative difference to the
+    relative uncertainty (None when no covariance is available or the
+    uncertainty is zero everywhere).
+
+    """
+    stats = {}
+    for key, _, _ in quantities:
+        x, rdiff = relative_difference(data1[key], data2[key])
+        i = np.abs(rdiff).argmax()
+        rms = np.sqrt(np.mean(rdiff**2))
+        if key in uncertainties:
+            unc = np.interp(x, *uncertainties[key])
+            positive = unc > 0.
+            sigmas = None
+            if positive.any():
+                sigmas = np.abs(rdiff[positive]/unc[positive]).max()
+        else:
+            sigmas = None
+        stats[key] = (rdiff[i], x[i], rms, sigmas)
+    return stats
+
+def plot_all(data1, data2, uncertainties, directory=None, prefix=''):
+    """Plot each quantity, its difference, and its relative difference"""
+    for key, ylabel, yscale in quantities:
+        if directory is None:
+            filenames = [None]*3
+        else:
+            filenames = [os.path.join(directory, '{}{}_{}.png'.format(prefix, key, kind))
+                         for kind in ('values', 'diff', 'rdiff')]
+        unc = uncertainties.get(key)
+        plot_cross_section(data1[key], data2[key], ylabel=ylabel, yscale=yscale,
+                           filename=filenames[0])
+        plot_diff(data1[key], data2[key], filename=filenames[1],
+                  ylabel='Difference (b)' if yscale == 'log' else 'Difference')
+        plot_relative_diff(data1[key], data2[key], uncertainty=unc,
+                           filename=filenames[2])
+
+def load_pair(file1, file2, covfile, accuracy):
+    """Get compared quantities for two evaluations and their uncertainties"""
+    t1 = load(file1, accuracy)
+    t2 = load(file2, accuracy)
+    if covfile == file1:
+        cov = t1['covarianceSuite']
+    elif covfile == file2:
+        cov = t2['covarianceSuite']
+    else:
+        cov = gnd_cache.load(covfile)['covarianceSuite']
+    return (get_data(t1['reactionSuite']), get_data(t2['reactionSuite']),
+            get_uncertainties(cov))
+
+def compare_pair(args):
+    """Compare one pair of evaluations; used as a worker in batch mode"""
+    file1, file2, covfile, accuracy, directory = args
+    data1, data2, uncertainties = load_pair(file1, file2, covfile, accuracy)
+    if directory is not None:
+        prefix = '{}_{}_'.format(*[os.path.splitext(os.path.basename(f))[0]
+                                   for f in (file1, file2)])
+        plot_all(data1, data2, uncertainties, directory, prefix)
+    return file1, file2, compare(data1, data2, uncertainties)
+
+def print_table(results):
+    table = []
+    for file1, file2, stats in results:
+        for key, _, _ in quantities:
+            rmax, energy, rms, sigmas = stats[key]
+            table.append([os.path.basename(file1), os.path.basename(file2), key,
+                          '{:.3%}'.format(rmax), '{:.4e}'.format(energy),
+                          '{:.3%}'.format(rms),
+                          'n/a' if sigmas is None else '{:.2f}'.format(sigmas)])
+    headers = ['Evaluation 1', 'Evaluation 2', 'Quantity', 'Max rel. diff',
+               'At energy (eV)', 'RMS rel. diff', 'Max diff/unc']
+    print(tabulate(table, headers=headers, tablefmt='grid'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('endf', nargs='*', help='Two ENDF files to compare and, '
+                        'optionally, a third file with covariances')
+    parser.add_argument('-p', '--pairs', help='File listing pairs of ENDF files '
+                        '(and optionally a covariance file) to compare, one per line')
+    parser.add_argument('-o', '--output', help='Directory to save figures in')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of pairs to compare in parallel')
+    parser.add_argument('-a', '--accuracy', type=float, default=1e-4,
+                        help='Accuracy for resonance reconstruction')
+    args = parser.parse_args()
+
+    pairs = []
+    if args.pairs:
+        with open(args.pairs, 'r') as fh:
+            for line in fh:
+                words = line.split()
+                if len(words) >= 2:
+                    pairs.append(words[:3])
+    if args.endf:
+        if len(args.endf) < 2:
+            parser.error('Need two ENDF files to compare')
+        pairs.append(args.endf[:3])
+    if not pairs:
+        parser.error('No ENDF files given to compare')
 
+    # Without a pairs file or output directory, plots are shown interactively
+    interactive = args.pairs is None and args.output is None
+    if not interactive:
+        plt.switch_backend('Agg')
+    if args.output is not None and not os.path.isdir(args.output):
+        os.makedirs(args.output)
 
-file1 = sys.argv[1]
-file2 = sys.argv[2]
-covfile = sys.argv[3] if len(sys.argv) > 3 else file1
-
-t1 = endfFileToGND(file1, toStdOut=False, toStdErr=False)
-t2 = endfFileToGND(file2, toStdOut=False, toStdErr=False)
-eval1 = t1['reactionSuite']
-eval2 = t2['reactionSuite']
-
-if covfile == file1:
-    cov = t1['covarianceSuite']
-elif covfile == file2:
-    cov = t2['covarianceSuite']
-else:
-    tc = endfFileToGND(covfile, toStdOut=False, toStdErr=False)
-    cov = tc['covarianceSuite']
-
-# Reconstruct resonance
-eval1.reconstructResonances(accuracy=1e-4)
-eval2.reconstructResonances(accuracy=1e-4)
-
-# Get cross sections
-capture_xs1 = eval1.getReaction('capture').getCrossSection()['linear'].copyDataToXsAndYs()
-capture_xs2 = eval2.getReaction('capture').getCrossSection()['linear'].copyDataToXsAndYs()
-capture_unc = cov.sections[19].getNativeData().getUncertaintyVector().copyDataToXsAndYs()
-fission_xs1 = eval1.getReaction('fission').getCrossSection()['linear'].copyDataToXsAndYs()
-fission_xs2 = eval2.getReaction('fission').getCrossSection()['linear'].copyDataToXsAndYs()
-fission_unc = cov.sections[12].getNativeData().getUncertaintyVector().copyDataToXsAndYs()
-plot_cross_section(capture_xs1, capture_xs2)
-plot_diff(capture_xs1, capture_xs2)
-plot_relative_diff(capture_xs1, capture_xs2, uncertainty=capture_unc)
-plot_cross_section(fission_xs1, fission_xs2)
-plot_diff(fission_xs1, fission_xs2)
-plot_relative_diff(fission_xs1, fission_xs2, uncertainty=fission_unc)
-
-prompt1 = eval1.getReaction('fission').outputChannel.particles[0]
-prompt2 = eval2.getReaction('fission').outputChannel.particles[0]
-nubar1 = prompt1.multiplicity['pointwise'].copyDataToXsAndYs()
-nubar2 = prompt2.multiplicity['pointwise'].copyDataToXsAndYs()
-nubar_unc = cov.sections[0].getNativeData().getUncertaintyVector().copyDataToXsAndYs()
-plot_cross_section(nubar1, nubar2, ylabel='Prompt nubar', yscale='lin')
-plot_diff(nubar1, nubar2, ylabel='Difference')
-plot_relative_diff(nubar1, nubar2, uncertainty=nubar_unc)
-
-pfns1 = prompt1.distributions.components['uncorrelated'].\
-    energyComponent['pointwise'].getAtEnergy(1e-5).copyDataToXsAndYs()
-pfns2 = prompt2.distributions.components['uncorrelated'].\
-    energyComponent['pointwise'].getAtEnergy(1e-5).copyDataToXsAndYs()
-plot_cross_section(pfns1, pfns2, ylabel='Probability', yscale='lin')
-plot_diff(pfns1, pfns2, ylabel='Difference')
-plot_relative_diff(pfns1, pfns2)
+    tasks = [(p[0], p[1], p[2] if len(p) > 2 else p[0], args.accuracy, args.output)
+             for p in pairs]
+    if interactive:
+        file1, file2, covfile, accuracy, _ = tasks[0]
+        data1, data2, uncertainties = load_pair(file1, file2, covfile, accuracy)
+        print_table([(file1, file2, compare(data1, data2, uncertainties))])
+        plot_all(data1, data2, uncertainties)
+    else:
+        pool = Pool(args.processes)
+        results = pool.map(compare_pair, tasks)
+        pool.close()
+        print_table(results)
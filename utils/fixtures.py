@@ -0,0 +1,210 @@
+"""Synthetic inputs of configurable size for timing the project's own tools.
+
+Each function writes files in the format a tool reads, filled with plausible
+but made-up values, so that the tools can be timed at any scale without
+OpenMC, NJOY or real evaluations:
+
+  - tar archives of OpenMC output and tally files (get_results.py)
+  - results files with k-effective, leakage and above-thermal leakage
+    (make-xls.py)
+  - cross_sections.xml libraries with an NJOY xsdir entry and a stand-in
+    for OpenMC's convert_xsdir.py (modify-csxml.py)
+  - ACE tables with tabulated and equiprobable angular distributions
+    (thin.py)
+"""
+
+import io
+import os
+import tarfile
+
+import numpy as np
+
+import ace
+
+# Fuel and spectrum of the ICSBEP categories
+FUELS = ('pu', 'heu', 'leu', 'ieu', 'u233', 'mix')
+FORMS = ('met', 'sol', 'comp')
+SPECTRA = ('fast', 'inter', 'therm', 'mixed')
+
+
+def benchmark_paths(n):
+    """Paths of n benchmarks spread over the categories, as in a benchmark
+    list, e.g. 'icsbep/pu-met-fast-001/openmc/case-2'"""
+    paths = []
+    for i in range(n):
+        fuel = FUELS[i % len(FUELS)]
+        form = FORMS[i//len(FUELS) % len(FORMS)]
+        spectrum = SPECTRA[i//(len(FUELS)*len(FORMS)) % len(SPECTRA)]
+        number = i//(len(FUELS)*len(FORMS)*len(SPECTRA)) + 1
+        model = f'{fuel}-{form}-{spectrum}-{number:03d}'
+        # Every third model has several cases
+        if number % 3 == 0:
+            paths.append(f'icsbep/{model}/openmc/case-{i % 5 + 1}')
+        else:
+            paths.append(f'icsbep/{model}/openmc')
+    return paths
+
+
+def write_archive(filename, n, seed=1):
+    """Write a tar archive of OpenMC output and tally files of n benchmarks,
+    laid out as read by get_results.py"""
+    rng = np.random.default_rng(seed)
+    with tarfile.open(filename, 'w') as tar:
+        for path in dict.fromkeys(benchmark_paths(n)):
+            keff, leakage, atlf = rng.normal([1., 0.2, 0.05], [0.005, 0.05, 0.01])
+            output = (
+                ' ============================>     RESULTS     <============================\n\n'
+                f' k-effective (Collision)     = {keff:.5f} +/-  0.00012\n'
+                f' k-effective (Track-length)  = {keff:.5f} +/-  0.00011\n'
+                f' k-effective (Absorption)    = {keff:.5f} +/-  0.00013\n'
+                f' Combined k-effective        = {keff:.5f} +/-  0.00010\n'
+                f' Leakage Fraction            = {abs(leakage):.5f} +/-  0.00020\n'
+                f' Above-thermal Leakage       = {abs(atlf):.5f} +/-  0.00010\n')
+            tallies = (
+                ' ============================>     TALLY 1     <============================\n\n'
+                ' Material 1\n'
+                '   O-16\n'
+                f'     Absorption Rate                      {rng.uniform(1e-4, 1e-3):.6e} '
+                f'+/- {rng.uniform(1e-7, 1e-6):.6e}\n'
+                '   Pu-239\n'
+                f'     Fission Rate                         {rng.uniform(0.1, 0.5):.6e} '
+                f'+/- {rng.uniform(1e-5, 1e-4):.6e}\n')
+            for name, text in (('output', output), ('tallies.out', tallies)):
+                data = text.encode()
+                info = tarfile.TarInfo(f'benchmarks/{path}/{name}')
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+
+def write_results(filename, n, seed=2):
+    """Write a results file of n benchmarks with k-effective, leakage and
+    above-thermal leakage and their uncertainties"""
+    rng = np.random.default_rng(seed)
+    with open(filename, 'w') as fh:
+        for path in benchmark_paths(n):
+            keff, leakage, atlf = rng.normal([1., 0.2, 0.05], [0.005, 0.05, 0.01])
+            fh.write(f'{path} {keff:.5f} 0.00010 {abs(leakage):.5f} 0.00020 '
+                     f'{abs(atlf):.5f} 0.00010\n')
+
+
+def write_library(directory, n):
+    """Write a library for modify-csxml.py to update
+
+    The directory receives a cross_sections_nndc.xml listing n tables, a
+    'run' directory with the xsdir of one modified table as written by NJOY,
+    and a 'home' directory with a stand-in for openmc/src/utils/convert_xsdir.py
+    that writes the corresponding ace_table element. Run modify-csxml.py from
+    the directory with HOME set to 'home' and 'run' as its argument.
+
+    """
+    os.makedirs(os.path.join(directory, 'run'), exist_ok=True)
+    with open(os.path.join(directory, 'cross_sections_nndc.xml'), 'w') as fh:
+        fh.write('<?xml version="1.0" ?>\n<cross_sections>\n'
+                 '  <filetype>binary</filetype>\n'
+                 '  <record_length>4096</record_length>\n'
+                 '  <entries>512</entries>\n'
+                 '  <directory>/opt/data/ace/nndc</directory>\n')
+        for i in range(n):
+            z, a = 1 + i % 100, 1000 + i
+            fh.write(f'  <ace_table alias="X-{a}.71c" awr="{a/1.00866:.6f}" '
+                     f'location="1" name="{z}{a:04d}.71c" path="293.6K/X_{a}_293.6K.ace" '
+                     f'temperature="2.53e-08" zaid="{z}{a:04d}"/>\n')
+        fh.write('</cross_sections>\n')
+
+    # The modified table replaces the one in the middle of the library
+    z, a = 1 + (n//2) % 100, 1000 + n//2
+    with open(os.path.join(directory, 'run', 'xsdir'), 'w') as fh:
+        fh.write(f'{z}{a:04d}.71c {a/1.00866:.6f} filename route 1 1 123456 0 0 '
+                 '2.5301E-08\n')
+
+    utils = os.path.join(directory, 'home', 'openmc', 'src', 'utils')
+    os.makedirs(utils, exist_ok=True)
+    script = os.path.join(utils, 'convert_xsdir.py')
+    with open(script, 'w') as fh:
+        fh.write('#!/usr/bin/env python3\n'
+                 'import sys\n'
+                 'words = open(sys.argv[1]).read().splitlines()[2].split()\n'
+                 'with open(sys.argv[2], "w") as fh:\n'
+                 '    fh.write(\'<cross_sections>\\n  <ace_table name="{}" path="{}" '
+                 'awr="{}" location="1"/>\\n</cross_sections>\\n\'\n'
+                 '             .format(words[0], words[2], words[1]))\n')
+    os.chmod(script, 0o755)
+
+
+def make_table(name, n_energies, seed=3):
+    """ACE table with elastic scattering and an inelastic level
+
+    Elastic scattering has tabulated (linear-linear) angular distributions
+    at each of n_energies incident energies, the inelastic level 32
+    equiprobable cosine bins at half as many, both varying smoothly with
+    energy so that thinning removes most of them.
+
+    """
+    rng = np.random.default_rng(seed)
+    energies = np.logspace(-5, np.log10(2e7), n_energies)
+
+    # ESZ block: energies, total, absorption, elastic and heating
+    elastic = 4. + 2./np.sqrt(energies/1e3 + 1.)
+    absorption = 0.3/np.sqrt(energies)
+    esz = np.concatenate([energies, elastic + absorption, absorption, elastic,
+                          np.full(n_energies, 1.)])
+    mtr = [51.]
+
+    # AND block, with locators relative to its start (1-based)
+    block = []
+    locators = []
+
+    def add_reaction(incident, distribution):
+        locators.append(len(block) + 1)
+        ne = len(incident)
+        start = len(block)
+        block.extend([float(ne)] + list(incident) + [0.]*ne)
+        for i, e in enumerate(incident):
+            block[start + 1 + ne + i] = distribution(e, len(block) + 1)
+
+    mu = np.linspace(-1., 1., 21)
+
+    def tabular(e, location):
+        b = 0.3*np.tanh(e/1e6) + rng.normal(0., 1e-4)
+        pdf = (1. + 3.*b*mu)/2.
+        cdf = np.concatenate([[0.], np.cumsum(np.diff(mu)*(pdf[1:] + pdf[:-1])/2)])
+        block.extend([2., float(len(mu))] + list(mu) + list(pdf) + list(cdf/cdf[-1]))
+        return -location
+
+    bins = np.linspace(-1., 1., 33)
+
+    def equiprobable(e, location):
+        s = 0.2*np.tanh(e/1e7)
+        block.extend(np.clip(bins + s*(1. - bins**2), -1., 1.))
+        return location
+
+    add_reaction(energies, tabular)
+    add_reaction(np.logspace(5, np.log10(2e7), max(n_energies//2, 2)), equiprobable)
+
+    # Blocks in order: ESZ, MTR, LAND, AND and a short DLW block after it
+    xss = np.concatenate([esz, mtr, locators, block, np.full(5, 7.)])
+    jxs = np.zeros(32, dtype=int)
+    jxs[0] = 1
+    jxs[2] = len(esz) + 1
+    jxs[7] = jxs[2] + len(mtr)
+    jxs[8] = jxs[7] + len(locators)
+    jxs[9] = jxs[8] + len(block)
+    jxs[10] = jxs[9] + 1
+    nxs = np.zeros(16, dtype=int)
+    nxs[0] = len(xss)
+    nxs[1] = int(name.split('.')[0])
+    nxs[2] = n_energies
+    nxs[3] = len(mtr)
+    nxs[4] = len(mtr)
+    return ace.Table(name, 15.857510, 2.5301e-8, '01/01/21', 'synthetic table',
+                     '   mat9999', np.zeros(32), nxs, jxs, xss)
+
+
+def write_ace(filename, n_energies, n_tables=2, binary=True):
+    """Write an ACE file of synthetic tables with n_energies incident
+    energies each"""
+    tables = [make_table(f'{8016 + k}.71c', n_energies, seed=k) for k in range(n_tables)]
+    if binary:
+        ace.write_binary(tables, filename)
+    else:
+        ace.write_ascii(tables, filename)
@@ -1,108 +1,188 @@
 #!/usr/bin/env python
 
-import os
+"""Apply perturbations to pointwise data of ENDF evaluations from a recipe.
+
+A recipe is a JSON file listing evaluations, each with the perturbations to
+make to it, e.g.
+
+  {"evaluations": [
+     {"endf": "pu239.endf", "output": "pu239-perturbed.endf",
+      "covariances": "pu239-cov.endf",
+      "perturbations": [
+        {"mt": 102, "multiply": 1.02},
+        {"mt": [2, 4], "add": -0.1, "energy": [1.0e3, 1.0e5]},
+        {"mt": 18, "covariance": 0.5},
+        {"mf": 1, "mt": 456, "multiply": 0.999}]}]}
+
+Each perturbation applies to the MF3 cross sections (or, with "mf": 1, the
+tabulated MT452/456 nubar) of one or more MT numbers and is exactly one of
+
+  add         constant added to the values (b for cross sections)
+  multiply    factor multiplying the values
+  covariance  fraction of the relative uncertainty from the MF33 (or MF31)
+              covariances, so that values become value*(1 + fraction*u(E))
+              with u(E) the uncertainty of the group holding E
+
+optionally restricted to an energy range in eV. Perturbations are applied in
+order on whole arrays of values, and only the perturbed sections are
+rewritten, the rest of each file being copied unchanged. Covariances are read
+from the evaluation itself unless another ENDF file is given. Paths are
+relative to the recipe. Redundant cross sections such as MT1 are left as they
+are since NJOY reconstructs them from their components. Within resonance
+ranges MF3 holds only the background, so only the background is perturbed
+there; resonance parameters are modified with modify.py.
+"""
+
+from __future__ import print_function
 import argparse
-from tkFileDialog import askopenfilename, asksaveasfilename
-from Tkinter import Tk
-
-from fudge.legacy.converting.endfFileToGND import endfFileToGND
-
-
-def get_file():
-    root = Tk()
-    root.withdraw()
-    filename = askopenfilename(filetypes=[("All", "*"),])
-    root.destroy()
-    return filename
-
-def perturb_reaction(data, reaction):
-    choice = None
-    choices = ['Add constant cross section',
-               'Multiply by constant',
-               'Multiply by fraction of covariance',
-               'Return']
-    while choice != len(choices):
-        choice = get_choice(choices)
-        if choice == 1:
-            factor = eval(raw_input('How much to add (b)? '))
-            if reaction.crossSection.nativeData == 'linear':
-                crossSection = reaction.crossSection['linear']
-                for i, (energy, value) in enumerate(crossSection):
-                    crossSection[i] = [energy, value + factor]
-            else:
-                print("Can't perturb reaction with {} cross section".format(
-                        reaction.crossSection.nativeData))
-        elif choice == 2:
-            factor = eval(raw_input('How factor to multiply by? '))
-            if 'linear' in reaction.crossSection.forms:
-                crossSection = reaction.crossSection['linear']
-                for i, (energy, value) in enumerate(crossSection):
-                    crossSection[i] = [energy, value*factor]
+import json
+from multiprocessing import Pool
+import os
+import sys
+
+import numpy as np
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import endf
+
+# Kinds of perturbation a recipe entry may give
+KINDS = ('add', 'multiply', 'covariance')
+
+
+def load_recipe(filename):
+    """Read a perturbation recipe, making paths absolute"""
+    with open(filename, 'r') as fh:
+        recipe = json.load(fh)
+    directory = os.path.dirname(os.path.abspath(filename))
+    for evaluation in recipe['evaluations']:
+        for key in ('endf', 'output', 'covariances'):
+            if key in evaluation:
+                evaluation[key] = os.path.join(directory, evaluation[key])
+    return recipe
+
+def uncertainty_vector(lines):
+    """Return a function giving the relative uncertainty at each energy from
+    MF31/MF33 lines, zero outside the covariance groups"""
+    covariance = endf.read_covariance(lines)
+    if covariance is None:
+        return None
+    bounds, matrix = covariance
+    u = np.sqrt(np.clip(np.diag(matrix), 0., None))
+    def uncertainty(E):
+        g = np.searchsorted(bounds, E, side='right') - 1
+        inside = (g >= 0) & (g < len(u))
+        return np.where(inside, u[np.clip(g, 0, len(u) - 1)], 0.)
+    return uncertainty
+
+def _check_section(key, lines):
+    """Raise an error unless a section starts with the TAB1 record to perturb"""
+    mf, mt = key
+    if mf == 1 and (mt not in (452, 456) or endf.parse_int(lines[0][33:44]) != 2):
+        raise ValueError('MF1/MT{0} does not hold tabulated nubar'.format(mt))
+    elif mf not in (1, 3):
+        raise ValueError('Cannot perturb MF{0}'.format(mf))
+
+def perturb_evaluation(evaluation):
+    """Apply the perturbations of one recipe entry and write the result
+
+    Returns
+    -------
+    list
+        Row of a summary table for each perturbation applied
+
+    """
+    sections = endf.read_sections(evaluation['endf'])
+    covariances = sections
+    if 'covariances' in evaluation:
+        covariances = endf.read_sections(evaluation['covariances'])
+
+    values = {}
+    rows = []
+    for perturbation in evaluation['perturbations']:
+        kinds = [k for k in KINDS if k in perturbation]
+        if len(kinds) != 1:
+            raise ValueError('Perturbation needs exactly one of {0}: {1}'.format(
+                ', '.join(KINDS), perturbation))
+        kind = kinds[0]
+        amount = perturbation[kind]
+        mf = perturbation.get('mf', 3)
+        mts = perturbation['mt']
+        if not isinstance(mts, list):
+            mts = [mts]
+        low, high = perturbation.get('energy', (-np.inf, np.inf))
+
+        for mt in mts:
+            key = (mf, mt)
+            if key not in sections:
+                raise ValueError('{0} has no MF{1}/MT{2}'.format(evaluation['endf'], mf, mt))
+            if key not in values:
+                _check_section(key, sections[key])
+                values[key] = endf.read_tab1(sections[key], 1)
+            E, y = values[key]
+            inside = (E >= low) & (E <= high)
+
+            if kind == 'add':
+                modified = np.where(inside, y + amount, y)
+            elif kind == 'multiply':
+                modified = np.where(inside, y*amount, y)
             else:
-                print("Can't perturb reaction with {} cross section".format(
-                        reaction.crossSection.nativeData))
-        elif choice == 3:
-            factor = eval(raw_input('What fraction of variance? '))
-            pass
-
-def perturb_cross_section(data):
-    rs = data['reactionSuite']
-    n = len(rs.reactions)
-
-    choices = ['{} + {} --> {}'.format(rs.projectile, rs.target, r)
-               for r in rs.reactions] + ['Return to main menu']
-    choice = None
-    while choice != len(choices):
-        choice = get_choice(choices)
-        if 0 < choice <= n:
-            perturb_reaction(data, rs.reactions[choice - 1])
-
-def save(data):
-    root = Tk()
-    root.withdraw()
-    filename = asksaveasfilename()
-    root.destroy()
-
-    if filename:
-        endf = data['reactionSuite'].toENDF6(
-            {'verbosity': 0}, covarianceSuite=data['covarianceSuite'])
-        open(filename, 'w').write(endf)
-
-def get_choice(choices):
-    os.system('clear')
-    for i, choice in enumerate(choices):
-        print('{}) {}'.format(i + 1, choice))
-    return eval(raw_input('--> '))
-
-def main(filename=None):
-    # Prompt to load ENDF file
-    if not filename:
-        filename = get_file()
-    print('Loading {}...'.format(filename))
-    data = endfFileToGND(filename, toStdOut=False, toStdErr=False)
-
-    choice = None
-    choices = ['Perturb cross section',
-               'Perturb fission neutron yield',
-               'Perturb resonances',
-               'Plot cross section',
-               'Save new ENDF file',
-               'Exit']
-    while choice != len(choices):
-        choice = get_choice(choices)
-        if choice == 1:
-            perturb_cross_section(data)
-        elif choice == 2:
-            pass
-        elif choice == 3:
-            pass
-        elif choice == 4:
-            pass
-        elif choice == 5:
-            save(data)
+                cov_key = (30 + mf, mt)
+                u = None
+                if cov_key in covariances:
+                    u = uncertainty_vector(covariances[cov_key])
+                if u is None:
+                    raise ValueError('No relative covariances in MF{0}/MT{1}'.format(*cov_key))
+                modified = np.where(inside, y*(1 + amount*u(E)), y)
+
+            # Cross sections stay non-negative
+            if mf == 3:
+                modified = np.maximum(modified, 0.)
+            values[key] = (E, modified)
+
+            changed = np.flatnonzero(modified != y)
+            largest = np.max(np.abs(modified[changed]/y[changed] - 1)) if (
+                changed.size and np.all(y[changed] != 0.)) else np.nan
+            energies = '{0:g}-{1:g}'.format(low, high) if 'energy' in perturbation else 'all'
+            rows.append([mf, mt, kind, amount, energies,
+                         '{0}/{1}'.format(changed.size, E.size),
+                         'n/a' if np.isnan(largest) else '{0:.3%}'.format(largest)])
+
+    # Total nubar follows changes made to prompt nubar alone, as in modify.py
+    if (1, 456) in values and (1, 452) in sections and (1, 452) not in values:
+        _check_section((1, 452), sections[1, 452])
+        E, nu = values[1, 456]
+        nu0 = endf.read_tab1(sections[1, 456], 1)[1]
+        x, y = endf.read_tab1(sections[1, 452], 1)
+        values[1, 452] = (x, y + np.interp(x, E, nu - nu0))
+
+    replacements = {}
+    for key, (E, y) in values.items():
+        lines = sections[key]
+        n = endf.tab1_length(lines, 1)
+        replacements[key] = lines[:1] + endf.replace_tab1(lines, 1, y) + lines[1 + n:]
+    endf.write_patched(evaluation['endf'], evaluation['output'], replacements)
+    return rows
+
+def run(evaluation):
+    rows = perturb_evaluation(evaluation)
+    return evaluation['endf'], evaluation['output'], rows
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('endf', nargs='?', help='ENDF file', default=None)
+    parser.add_argument('recipe', help='JSON file listing evaluations and perturbations')
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help='Number of evaluations to perturb in parallel')
     args = parser.parse_args()
-    main(args.endf)
+
+    evaluations = load_recipe(args.recipe)['evaluations']
+    pool = Pool(args.processes)
+    for filename, output, rows in pool.imap(run, evaluations):
+        print('Perturbed {0} -> {1}'.format(filename, output))
+        print(tabulate(rows, headers=['MF', 'MT', 'Perturbation', 'Amount',
+                                      'Energy range (eV)', 'Points changed',
+                                      'Largest change'],
+                       tablefmt='grid', disable_numparse=True) + '\n')
+    pool.close()
+    pool.join()
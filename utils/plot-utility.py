@@ -17,6 +17,9 @@ import pandas as pd
 sys.path.insert(0, '/home/romano/benchmarks/icsbep')
 from icsbep.icsbep import model_keff
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from results import read_batches, paired_difference
+
 
 def benchmark_name(excel_label):
     if '/' not in excel_label: return excel_label
@@ -55,6 +58,15 @@ def get_result_dataframe(filename):
     return df
 
 
+def get_batches(filename):
+    """Get per-batch k-eff written by run_benchmarks.py next to a results
+    spreadsheet, keyed by benchmark name, or None if there is none"""
+    path = os.path.join(os.path.dirname(os.path.abspath(filename)), 'batches')
+    if not os.path.isfile(path):
+        return None
+    return {benchmark_name(p): k for p, k in read_batches(path).items()}
+
+
 def get_icsbep_dataframe():
     keff = [x[0] for x in model_keff.values()]
     stdev = [x[1] for x in model_keff.values()]
@@ -148,8 +160,10 @@ def set_file_options(options, i):
 def plot(options, save=False):
     # Read data from spreadsheets
     dataframes = {}
+    batches = {}
     for xls, label in zip(options['files'], options['labels']):
         dataframes[label] = get_result_dataframe(xls)
+        batches[label] = get_batches(xls)
 
     # Get model keff and uncertainty from ICSBEP
     icsbep = get_icsbep_dataframe()
@@ -219,6 +233,14 @@ def plot(options, save=False):
 
             diff = keff_i - keff0
             err = np.sqrt(stdev_i**2 + stdev0**2)
+
+            # Runs made with the same seed are compared batch by batch, which
+            # accounts for the correlation between them
+            b0, b_i = batches[base], batches[label]
+            if b0 is not None and b_i is not None:
+                for name in index:
+                    if name in b0 and name in b_i and len(b0[name]) == len(b_i[name]):
+                        diff[name], err[name], _ = paired_difference(b0[name], b_i[name])
             kwargs['label'] = options['labels'][i + 1] + ' - ' + options['labels'][0]
             if options['show_uncertainties']:
                 plt.errorbar(x, diff, yerr=err, color=f'C{i}', **kwargs)
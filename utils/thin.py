@@ -1,127 +1,491 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
+
+"""Thin the incident energy grids of angular distributions in ACE tables.
+
+For every reaction with angular distributions in the AND block (elastic
+scattering and reactions with secondary neutrons), incident energies are
+removed as long as the Legendre moments of the distribution, interpolated
+linearly in energy between the energies that are kept, stay within the given
+tolerances. The AND block is rebuilt without the removed distributions and
+the blocks following it are moved up, so that tables actually shrink.
+
+Either a single ACE file or every table of a library given by an
+(old-style) cross_sections.xml can be thinned. In the latter case files are
+thinned in parallel, written to an output directory along with a new
+cross_sections.xml, and a report of the reduction in points and size for
+each nuclide is written.
+"""
 
 import argparse
-import struct
+from concurrent.futures import ProcessPoolExecutor
+import os
+import xml.etree.ElementTree as ET
+
 import numpy as np
-import matplotlib.pyplot as plt
-
-import warnings
-with warnings.catch_warnings():
-    from pyne.utils import VnVWarning
-    warnings.filterwarnings("ignore", category=VnVWarning)
-    import pyne.ace
-
-parser = argparse.ArgumentParser()
-parser.add_argument('ace', action='store', help='ACE file to thin')
-parser.add_argument('-t', '--tol', dest='tol', action='store', type=float,
-                    default=0.01, help='tolerance for thinning')
-args = parser.parse_args()
-
-# ==============================================================================
-# Read data from ACE file
-lib = pyne.ace.Library(args.ace)
-lib.read()
-o16 = lib.tables.values()[0]
-elastic = o16.reactions[2]
-ad = elastic.angular_distribution
-E = ad.energy
-
-# Determine average scattering cosine at each incident energy
-print ('Generating average mu...')
-avgmu = np.zeros_like(E)
-mu = np.linspace(-1., 1., 10000)
-for i in range(len(E)):
-    p = np.interp(mu, ad.cosine[i], ad.pdf[i])
-    avgmu[i] = sum(np.diff(mu)*(p[1:] + p[:-1])*(mu[1:] + mu[:-1])/4)
-
-# Perform thinning on energy grid based on change in 1st-order Legendre moment
-print('Thinning energy grid...')
-i = 0
-keep = [i]
-j = 2
-while True:
-    interp = avgmu[i] + (avgmu[i+j] - avgmu[i])/(E[i+j] - E[i])*(
-        E[i+1:i+j] - E[i])
-    true = avgmu[i+1:i+j]
-    err = abs(interp - true)
-    if np.any(err > args.tol):
-        keep.append(i + j - 1)
-        i += j - 1
-        j = 2
+from numpy.polynomial import legendre
+from tabulate import tabulate
+
+import ace
+
+
+def _power_moments(cosine, pdf, interpolation, order):
+    """Moments <mu^k>, k = 1..order, of tabulated distributions"""
+    n = np.array([len(c) for c in cosine])
+    mu = np.concatenate(cosine)
+    p = np.concatenate(pdf)
+    owner = np.repeat(np.arange(len(n)), n)
+
+    # Segments between consecutive points of the same distribution
+    same = owner[1:] == owner[:-1]
+    a, b = mu[:-1][same], mu[1:][same]
+    pa, pb = p[:-1][same], p[1:][same]
+    segment = owner[:-1][same]
+    if interpolation is None:
+        histogram = np.zeros(len(a), dtype=bool)
     else:
+        histogram = (np.asarray(interpolation) == 1)[segment]
+
+    # Density on each segment is alpha + beta*mu
+    dmu = b - a
+    beta = np.where(histogram, 0., (pb - pa)/np.where(dmu > 0., dmu, 1.))
+    alpha = pa - beta*a
+    area = np.bincount(segment, alpha*dmu + beta*(b*b - a*a)/2, len(n))
+    moments = np.empty((len(n), order))
+    for k in range(1, order + 1):
+        integral = (alpha*(b**(k + 1) - a**(k + 1))/(k + 1) +
+                    beta*(b**(k + 2) - a**(k + 2))/(k + 2))
+        moments[:, k - 1] = np.bincount(segment, integral, len(n))/area
+    return moments
+
+def average_cosine(cosine, pdf, interpolation=None):
+    """Exact average cosine of tabulated angular distributions.
+
+    The first moment of each distribution is integrated segment by segment
+    from its tabulated points, for all incident energies at once.
+
+    Parameters
+    ----------
+    cosine, pdf : sequence of numpy.ndarray
+        Tabulated cosines and probability densities at each incident energy
+    interpolation : sequence of int, optional
+        ACE interpolation flag of each distribution (1 = histogram, 2 =
+        linear-linear). Defaults to linear-linear.
+
+    Returns
+    -------
+    numpy.ndarray
+        Average cosine at each incident energy
+
+    """
+    return _power_moments(cosine, pdf, interpolation, 1)[:, 0]
+
+def legendre_moments(distributions, order):
+    """Legendre moments P1..P(order) of angular distributions from an AND
+    block, as returned by ace.read_angular
+
+    Returns
+    -------
+    numpy.ndarray
+        Moments with shape (energies, order)
+
+    """
+    power = np.zeros((len(distributions), order))
+
+    tabular = [i for i, d in enumerate(distributions) if isinstance(d, tuple)]
+    if tabular:
+        power[tabular] = _power_moments(
+            [distributions[i][1] for i in tabular], [distributions[i][2] for i in tabular],
+            [distributions[i][0] for i in tabular], order)
+
+    # 32 equiprobable bins, uniform within each bin
+    bins = [i for i, d in enumerate(distributions)
+            if d is not None and not isinstance(d, tuple)]
+    if bins:
+        bounds = np.array([distributions[i] for i in bins])
+        a, b = bounds[:, :-1], bounds[:, 1:]
+        width = np.where(b > a, b - a, 1.)
+        for k in range(1, order + 1):
+            power[bins, k - 1] = np.mean((b**(k + 1) - a**(k + 1))/((k + 1)*width), axis=1)
+
+    # Isotropic distributions have <mu^k> = 1/(k + 1) for even k
+    isotropic = [i for i, d in enumerate(distributions) if d is None]
+    for k in range(2, order + 1, 2):
+        power[isotropic, k - 1] = 1/(k + 1)
+
+    # Convert moments of powers of mu to Legendre moments
+    moments = np.empty_like(power)
+    for l in range(1, order + 1):
+        coefficients = legendre.leg2poly([0]*l + [1])
+        moments[:, l - 1] = coefficients[0] + power[:, :l] @ coefficients[1:]
+    return moments
+
+def thin(x, y, tol):
+    """Select points so that linear interpolation between them reproduces y.
+
+    Starting from each kept point, the range of slopes for which a line
+    through it stays within tol of every point passed so far is narrowed
+    one point at a time. The next point is kept when the line to the point
+    after it falls outside that range. Each point is visited once, so the
+    cost is linear, and every removed point is within tol of the
+    interpolated value. Both points of a discontinuity (repeated x) are
+    kept.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        Nondecreasing abscissae
+    y : numpy.ndarray
+        Values with shape (n,) or, to thin several functions on the same grid
+        at once, (n, m)
+    tol : float or numpy.ndarray
+        Maximum absolute interpolation error at removed points, broadcast
+        against y so that it may differ by function and by point
+
+    Returns
+    -------
+    numpy.ndarray
+        Indices of the points to keep
+
+    """
+    x = np.asarray(x, dtype=float).tolist()
+    y = np.asarray(y, dtype=float)
+    tol = np.asarray(tol, dtype=float)
+    if y.ndim == 1:
+        y = y[:, np.newaxis]
+        tol = tol[..., np.newaxis]
+    m = y.shape[1]
+    tol = np.broadcast_to(tol, y.shape).tolist()
+    y = y.tolist()
+    unbounded = ([-np.inf]*m, [np.inf]*m)
+
+    n = len(x)
+    keep = [0]
+    i = 0
+    lo, hi = unbounded
+    j = 1
+    while j < n:
+        if x[j] == x[j - 1]:
+            if keep[-1] != j - 1:
+                keep.append(j - 1)
+            keep.append(j)
+            i = j
+            lo, hi = unbounded
+        else:
+            dx = x[j] - x[i]
+            yi, yj = y[i], y[j]
+            slopes = [(yj[k] - yi[k])/dx for k in range(m)]
+            if not all(lo[k] <= slopes[k] <= hi[k] for k in range(m)):
+                # Line to x[j] misses a point in between; keep the last
+                # point that could be reached and start again from it
+                i = j - 1
+                keep.append(i)
+                lo, hi = unbounded
+                continue
+            tj = tol[j]
+            lo = [max(lo[k], (yj[k] - tj[k] - yi[k])/dx) for k in range(m)]
+            hi = [min(hi[k], (yj[k] + tj[k] - yi[k])/dx) for k in range(m)]
         j += 1
-        if i + j == len(E):
-            keep.append(i + j - 1)
-            break
-keep = np.array(keep)
-
-plt.semilogx(E, avgmu, 'b.')
-plt.semilogx(E[keep], avgmu[keep], 'ko')
-plt.show()
-
-print('Original = {}'.format(len(E)))
-print('Thinned  = {}'.format(len(keep)))
-
-# ==============================================================================
-# MODIFY ACE FILE AND WRITE AS BINARY
-
-# Read data from ASCII file
-ascii = open(args.ace, 'r')
-lines = ascii.readlines()
-ascii.close()
-
-# Set default record length
-record_length = 4096
-
-# Open binary file
-binary = open(args.ace + '.thinned', 'wb')
-
-idx = 0
-while idx < len(lines):
-    # Read/write header block
-    hz = lines[idx][:10].encode('UTF-8')
-    aw0 = float(lines[idx][10:22])
-    tz = float(lines[idx][22:34])
-    hd = lines[idx][35:45].encode('UTF-8')
-    hk = lines[idx + 1][:70].encode('UTF-8')
-    hm = lines[idx + 1][70:80].encode('UTF-8')
-    binary.write(struct.pack(str('=10sdd10s70s10s'), hz, aw0, tz, hd, hk, hm))
-
-    # Read/write IZ/AW pairs
-    data = ' '.join(lines[idx + 2:idx + 6]).split()
-    iz = list(map(int, data[::2]))
-    aw = list(map(float, data[1::2]))
-    izaw = [item for sublist in zip(iz, aw) for item in sublist]
-    binary.write(struct.pack(str('=' + 16*'id'), *izaw))
-
-    # Read/write NXS and JXS arrays. Null bytes are added at the end so
-    # that XSS will start at the second record
-    nxs = list(map(int, ' '.join(lines[idx + 6:idx + 8]).split()))
-    jxs = list(map(int, ' '.join(lines[idx + 8:idx + 12]).split()))
-    binary.write(struct.pack(str('=16i32i{0}x'.format(record_length - 500)),
-                             *(nxs + jxs)))
-
-    # Read/write XSS array. Null bytes are added to form a complete record
-    # at the end of the file
-    n_lines = (nxs[0] + 3)//4
-    xss = list(map(float, ' '.join(lines[
-        idx + 12:idx + 12 + n_lines]).split()))
-
-    # Modify angular distributions
-    idx = jxs[8] - 1
-    LC = xss[idx + 1 + len(E):idx + 1 + 2*len(E)]
-    ne = len(keep)
-    xss[idx] = ne
-    for i in range(ne):
-        xss[idx + 1 + i] = E[keep[i]]
-        xss[idx + 1 + ne + i] = LC[keep[i]]
-
-    extra_bytes = record_length - ((len(xss)*8 - 1) % record_length + 1)
-    binary.write(struct.pack(str('={0}d{1}x'.format(nxs[0], extra_bytes)),
-                             *xss))
-
-    # Advance to next table in file
-    idx += 12 + n_lines
-
-# Close binary file
-binary.close()
+    if keep[-1] != n - 1:
+        keep.append(n - 1)
+    return np.array(keep)
+
+
+def _distribution_values(d):
+    """XSS values of one distribution and the sign of its locator"""
+    if isinstance(d, tuple):
+        interpolation, cosine, pdf, cdf = d
+        return np.concatenate([[interpolation, len(cosine)], cosine, pdf, cdf]), -1
+    return np.asarray(d), 1
+
+def thin_table(table, tol):
+    """Thin the angular distributions of every reaction in a table
+
+    Parameters
+    ----------
+    table : ace.Table
+        Continuous-energy neutron table, modified in place
+    tol : Iterable of float
+        Tolerances on Legendre moments P1, P2, ...
+
+    Returns
+    -------
+    list
+        [MT, energies before, energies after, maximum error of each moment]
+        for each reaction thinned
+
+    """
+    tol = np.asarray(tol, dtype=float)
+    xss = np.asarray(table.xss)
+    jxs8, jxs9 = table.jxs[7], table.jxs[8]
+    nr = table.nxs[4]
+
+    # MT of each reaction with angular distributions; elastic comes first
+    mts = [2] + [int(v) for v in xss[table.jxs[2] - 1:table.jxs[2] - 1 + nr]]
+    locators = xss[jxs8 - 1:jxs8 + nr].astype(int)
+
+    block = []
+    new_locators = locators.copy()
+    stats = []
+    for r, (mt, locb) in enumerate(zip(mts, locators)):
+        if locb <= 0:
+            continue
+        energies, lc, distributions = ace.read_angular(xss, jxs9, locb)
+        keep = np.arange(len(energies))
+        errors = np.zeros(len(tol))
+        if len(energies) > 2:
+            moments = legendre_moments(distributions, len(tol))
+            keep = thin(energies, moments, tol)
+            for k in range(len(tol)):
+                errors[k] = np.abs(np.interp(energies, energies[keep], moments[keep, k])
+                                   - moments[:, k]).max()
+        stats.append([mt, len(energies), len(keep)] + list(errors))
+
+        # Rewrite the reaction's energies, locators and distributions
+        ne = len(keep)
+        new_locators[r] = len(block) + 1
+        header = len(block)
+        block.extend([ne] + list(energies[keep]) + [0]*ne)
+        for k, i in enumerate(keep):
+            d = distributions[i]
+            if d is None:
+                continue
+            values, sign = _distribution_values(d)
+            block[header + 1 + ne + k] = sign*(len(block) + 1)
+            block.extend(values)
+
+    # Replace LAND and AND blocks, moving up the blocks that follow
+    ace.replace_blocks(table, {8: new_locators, 9: block})
+    return stats
+
+
+def _threshold_values(xss, i, nes):
+    """Values of an (IE, NE, values) array at location i on the full grid"""
+    ie, ne = int(xss[i]), int(xss[i + 1])
+    values = np.zeros(nes)
+    values[ie - 1:ie - 1 + ne] = xss[i + 2:i + 2 + ne]
+    return ie - 1, ie - 1 + ne, values
+
+def thin_energy_grid(table, rtol):
+    """Thin the energy grid shared by the cross sections in a table
+
+    Every function tabulated on the grid of the ESZ block -- total,
+    absorption and elastic cross sections, heating numbers, reaction
+    cross sections, total fission and photon production cross sections --
+    is thinned at once under the same relative tolerance, so that all of
+    them stay on one union grid. The first and last point of each reaction
+    are always kept so that thresholds are preserved.
+
+    Parameters
+    ----------
+    table : ace.Table
+        Continuous-energy neutron table, modified in place
+    rtol : float
+        Maximum relative interpolation error at removed points
+
+    Returns
+    -------
+    tuple of int and float
+        Number of energies before and after thinning and the maximum relative
+        error of any cross section on the original grid
+
+    """
+    xss = np.asarray(table.xss)
+    jxs = table.jxs
+    nes, ntr, ntrp = table.nxs[2], table.nxs[3], table.nxs[5]
+    if table.nxs[6] > 0:
+        raise ValueError(f'{table.name} has secondary particle production data '
+                         'which cannot be thinned')
+
+    esz = xss[jxs[0] - 1:jxs[0] - 1 + 5*nes].reshape(5, nes)
+    energy = esz[0]
+    columns = list(esz[1:])
+    bounds = [0, nes - 1]
+
+    # Reaction cross sections, each starting at its threshold index IE
+    lsig = xss[jxs[5] - 1:jxs[5] - 1 + ntr].astype(int)
+    for loc in lsig:
+        first, last, values = _threshold_values(xss, jxs[6] - 2 + loc, nes)
+        columns.append(values)
+        bounds += [first, last - 1]
+
+    # Total photon production cross section leads the GPD block
+    if jxs[11] > 0:
+        columns.append(xss[jxs[11] - 1:jxs[11] - 1 + nes])
+
+    # Total fission cross section
+    if jxs[20] > 0:
+        first, last, values = _threshold_values(xss, jxs[20] - 1, nes)
+        columns.append(values)
+        bounds += [first, last - 1]
+
+    # Photon production given as cross sections (MFTYPE 13); yields have
+    # their own energy grids
+    if ntrp > 0:
+        lsigp = xss[jxs[13] - 1:jxs[13] - 1 + ntrp].astype(int)
+        for loc in lsigp:
+            i = jxs[14] - 2 + loc
+            if int(xss[i]) == 13:
+                first, last, values = _threshold_values(xss, i + 1, nes)
+                columns.append(values)
+                bounds += [first, last - 1]
+
+    # Thin each stretch between points that must be kept
+    y = np.array(columns).T
+    tol = rtol*np.abs(y)
+    bounds = sorted(set(bounds))
+    keep = [bounds[0]]
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        keep.extend(a + thin(energy[a:b + 1], y[a:b + 1], tol[a:b + 1])[1:])
+    keep = np.array(keep)
+    index = np.full(nes, -1)
+    index[keep] = np.arange(len(keep))
+
+    # Maximum relative error of interpolating on the thinned grid
+    error = 0.
+    for values in columns:
+        interpolated = np.interp(energy, energy[keep], values[keep])
+        nonzero = values != 0.
+        if nonzero.any():
+            error = max(error, np.max(np.abs(interpolated[nonzero]/values[nonzero] - 1)))
+
+    def threshold_array(i):
+        first, last, values = _threshold_values(xss, i, nes)
+        kept = keep[(keep >= first) & (keep < last)]
+        return [index[first] + 1, len(kept)] + list(values[kept])
+
+    blocks = {1: esz[:, keep].ravel()}
+    sig = []
+    new_lsig = []
+    for loc in lsig:
+        new_lsig.append(len(sig) + 1)
+        sig.extend(threshold_array(jxs[6] - 2 + loc))
+    blocks[6] = new_lsig
+    blocks[7] = sig
+    if jxs[11] > 0:
+        gpd = xss[jxs[11] - 1:jxs[11] - 1 + nes]
+        following = [v for v in jxs if v > jxs[11]]
+        end = min(following) - 1 if following else len(xss)
+        blocks[12] = np.concatenate([gpd[keep], xss[jxs[11] - 1 + nes:end]])
+    if jxs[20] > 0:
+        blocks[21] = threshold_array(jxs[20] - 1)
+    if ntrp > 0:
+        sigp = []
+        new_lsigp = []
+        for loc in lsigp:
+            i = jxs[14] - 2 + loc
+            new_lsigp.append(len(sigp) + 1)
+            if int(xss[i]) == 13:
+                sigp.extend([13] + threshold_array(i + 1))
+            else:
+                # Yields: MFTYPE, MTMULT, NR, NBT, INT, NE, energies, yields
+                nr = int(xss[i + 2])
+                ne = int(xss[i + 3 + 2*nr])
+                sigp.extend(xss[i:i + 4 + 2*nr + 2*ne])
+        blocks[14] = new_lsigp
+        blocks[15] = sigp
+
+    ace.replace_blocks(table, blocks)
+    table.nxs[2] = len(keep)
+    return nes, len(keep), error
+
+
+def thin_file(task):
+    """Thin the tables of one ACE file and write the thinned file"""
+    path, output, names, filetype, record_length, tol = task
+    tables = ace.read(path, record_length)
+    report = []
+    for table in tables:
+        if names is not None and table.name not in names:
+            continue
+        before = table.xss.nbytes
+        stats = thin_table(table, tol)
+        report.append((table.name, stats, before, table.xss.nbytes))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    if filetype == 'binary':
+        locations = ace.write_binary(tables, output, record_length)
+    else:
+        locations = ace.write_ascii(tables, output)
+    return path, report, {t.name: loc for t, loc in zip(tables, locations)}
+
+
+def print_report(report, tol, fh=None):
+    table = []
+    for name, stats, before, after in report:
+        points_before = sum(s[1] for s in stats)
+        points_after = sum(s[2] for s in stats)
+        errors = np.max([s[3:] for s in stats], axis=0) if stats else np.zeros(len(tol))
+        table.append([name, len(stats), points_before, points_after,
+                      f'{before/1024**2:.2f}', f'{after/1024**2:.2f}',
+                      f'{1 - after/before:.1%}'] + [f'{e:.2e}' for e in errors])
+    headers = (['Table', 'Reactions', 'Energies', 'Thinned', 'Size (MB)',
+                'Thinned (MB)', 'Reduction'] +
+               [f'Max P{l + 1} error' for l in range(len(tol))])
+    print(tabulate(table, headers=headers, tablefmt='grid', disable_numparse=True),
+          file=fh)
+
+
+def thin_library(cross_sections, directory, tol, processes=None):
+    """Thin every table listed in an old-style cross_sections.xml"""
+    tree = ET.parse(cross_sections)
+    root = tree.getroot()
+    filetype = root.findtext('filetype', 'ascii').strip()
+    record_length = int(root.findtext('record_length', str(ace.RECORD_LENGTH)))
+    # Paths are relative to the directory element, which is itself relative
+    # to the location of cross_sections.xml
+    basedir = os.path.join(os.path.dirname(os.path.abspath(cross_sections)),
+                           root.findtext('directory', '').strip())
+
+    # Group tables by the file they are in
+    entries = root.findall('ace_table')
+    files = {}
+    for entry in entries:
+        files.setdefault(entry.get('path'), set()).add(entry.get('name'))
+    tasks = [(os.path.join(basedir, path), os.path.join(directory, path), names,
+              filetype, record_length, tol) for path, names in files.items()]
+
+    report = []
+    locations = {}
+    with ProcessPoolExecutor(processes) as executor:
+        for path, file_report, file_locations in executor.map(thin_file, tasks):
+            print(f'Thinned {path}')
+            report.extend(file_report)
+            for name, loc in file_locations.items():
+                locations[os.path.relpath(path, basedir), name] = loc
+
+    # Point the library at the thinned files
+    directory_element = root.find('directory')
+    if directory_element is None:
+        directory_element = ET.SubElement(root, 'directory')
+    directory_element.text = os.path.abspath(directory)
+    for entry in entries:
+        key = (os.path.normpath(entry.get('path')), entry.get('name'))
+        if key in locations:
+            entry.set('location', str(locations[key]))
+    tree.write(os.path.join(directory, 'cross_sections.xml'), xml_declaration=True)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='ACE file or cross_sections.xml to thin')
+    parser.add_argument('-o', '--output', help='Thinned ACE file, or directory '
+                        'for a thinned library')
+    parser.add_argument('-t', '--tol', type=float, nargs='+', default=[0.01],
+                        help='Tolerances on Legendre moments P1, P2, ...')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of ACE files to thin in parallel')
+    parser.add_argument('--record-length', type=int, default=ace.RECORD_LENGTH,
+                        help='Record length of binary ACE files in bytes')
+    args = parser.parse_args()
+
+    if args.input.endswith('.xml'):
+        directory = args.output or 'thinned'
+        report = thin_library(args.input, directory, args.tol, args.processes)
+        with open(os.path.join(directory, 'thin_report.txt'), 'w') as fh:
+            print_report(report, args.tol, fh)
+    else:
+        output = args.output or args.input + '.thinned'
+        _, report, _ = thin_file((args.input, output, None, 'binary',
+                                  args.record_length, args.tol))
+    print_report(report, args.tol)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""Time the project's own tools on synthetic inputs of several sizes.
+
+Inputs are generated by fixtures.py, so neither OpenMC nor NJOY is needed.
+Each tool is run as a separate process, as it is in a campaign, and the best
+wall time of a few repetitions is kept. The size of the input at each scale
+is
+
+  get_results   benchmarks in the tar archive
+  make-xls      benchmarks in the results file
+  modify-csxml  tables in cross_sections.xml
+  thin          incident energies of each angular distribution in two tables
+
+Timings are appended to a JSON lines history file along with the date, git
+commit and Python version, and each is printed next to the previous timing
+of the same tool and scale so that regressions stand out:
+
+  time-tools.py --scales 100 1000 10000 --history timings.jsonl
+
+A tool that fails, e.g. make-xls.py without xlwt installed, is reported with
+its last line of error output rather than a time. get_results.py is run with
+a Python 2 interpreter (--python2) since it predates Python 3.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from tabulate import tabulate
+
+import fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = ('get_results', 'make-xls', 'modify-csxml', 'thin')
+
+
+def prepare(tool, scale, directory):
+    """Write the input of a tool at a scale and return the command running
+    it, with the directory and environment to run it in"""
+    env = os.environ.copy()
+    if tool == 'get_results':
+        fixtures.write_archive(os.path.join(directory, 'results.tar'), scale)
+        command = [os.path.join(ROOT, 'post-process', 'get_results.py'), 'results.tar']
+    elif tool == 'make-xls':
+        fixtures.write_results(os.path.join(directory, 'results'), scale)
+        command = [os.path.join(ROOT, 'make-xls.py'), 'results']
+    elif tool == 'modify-csxml':
+        fixtures.write_library(directory, scale)
+        env['HOME'] = os.path.join(directory, 'home')
+        command = [os.path.join(ROOT, 'modify-csxml.py'), 'run']
+    elif tool == 'thin':
+        fixtures.write_ace(os.path.join(directory, 'table.ace'), scale)
+        command = [os.path.join(ROOT, 'utils', 'thin.py'), 'table.ace', '-t', '0.01']
+    else:
+        raise ValueError(f'Unknown tool {tool}')
+    return command, env
+
+
+def time_tool(tool, scale, repeat, python, python2):
+    """Best wall time of a tool at a scale in seconds, or an error message"""
+    interpreter = python2 if tool == 'get_results' else python
+    if shutil.which(interpreter) is None:
+        return None, f'{interpreter} not found'
+
+    directory = tempfile.mkdtemp(prefix=f'{tool}-')
+    try:
+        command, env = prepare(tool, scale, directory)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = subprocess.run([interpreter] + command, cwd=directory, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                    text=True)
+            elapsed = time.perf_counter() - start
+            if result.returncode != 0:
+                lines = result.stderr.strip().splitlines()
+                return None, lines[-1] if lines else f'exit status {result.returncode}'
+            best = elapsed if best is None else min(best, elapsed)
+        return best, None
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def read_history(filename):
+    """Read previous timings, keyed by tool and scale, latest last"""
+    history = {}
+    if os.path.exists(filename):
+        with open(filename, 'r') as fh:
+            for line in fh:
+                if line.strip():
+                    record = json.loads(line)
+                    history.setdefault((record['tool'], record['scale']), []).append(record)
+    return history
+
+
+def commit():
+    """Current git commit of the repository, if known"""
+    result = subprocess.run(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return result.stdout.strip() or None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tools', nargs='+', choices=TOOLS, default=TOOLS)
+    parser.add_argument('--scales', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Sizes of the inputs (see above)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Runs of each tool at each scale, of which the fastest counts')
+    parser.add_argument('--history', default='tool-timings.jsonl',
+                        help='JSON lines file that timings are appended to')
+    parser.add_argument('--python', default=sys.executable,
+                        help='Interpreter for the Python 3 tools')
+    parser.add_argument('--python2', default='python2',
+                        help='Interpreter for get_results.py')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Print timings without adding them to the history')
+    args = parser.parse_args()
+
+    history = read_history(args.history)
+    run = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit(),
+           'python': platform.python_version(), 'host': platform.node()}
+
+    rows = []
+    records = []
+    for tool in args.tools:
+        for scale in args.scales:
+            seconds, error = time_tool(tool, scale, args.repeat, args.python, args.python2)
+            previous = [r for r in history.get((tool, scale), [])
+                        if r['seconds'] is not None]
+            last = previous[-1] if previous else None
+            if seconds is None:
+                change = ''
+            elif last is None:
+                change = 'new'
+            else:
+                change = f'{seconds/last["seconds"] - 1:+.1%}'
+            rows.append([tool, scale, '-' if seconds is None else f'{seconds:.3f}',
+                         '-' if last is None else f'{last["seconds"]:.3f}',
+                         change, error or ''])
+            records.append(dict(run, tool=tool, scale=scale, seconds=seconds, error=error))
+
+    print(tabulate(rows, headers=['Tool', 'Scale', 'Time (s)', 'Previous (s)',
+                                  'Change', 'Error'],
+                   tablefmt='grid', disable_numparse=True))
+
+    if not args.no_save:
+        with open(args.history, 'a') as fh:
+            for record in records:
+                fh.write(json.dumps(record) + '\n')